@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+Run the benchmark suite and compare the timings with an earlier run.
+
+    python benchmarks/run.py                      # run everything, save benchmarks/results/<commit>.json
+    python benchmarks/run.py -k map               # only benchmarks whose name contains "map"
+    python benchmarks/run.py --compare base.json  # also compare with a saved run (default: the latest one)
+
+`cpptraj`, `tleap`, and `antechamber` are replaced by the shims in `benchmarks/shims`, which copy the
+recorded outputs in `tests/cb7-1`, so the timings only cover this package. The exit status is 1 if any
+benchmark is slower than the baseline by more than `--threshold`.
+"""
+
+import argparse as argparse
+import contextlib as contextlib
+import datetime as datetime
+import glob as glob
+import json as json
+import os as os
+import platform as platform
+import shutil as shutil
+import statistics as statistics
+import subprocess as sp
+import sys as sys
+import tempfile as tempfile
+import time as time
+import traceback as traceback
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY = os.path.dirname(BENCHMARKS_DIRECTORY)
+sys.path.insert(0, REPOSITORY)
+sys.path.insert(0, BENCHMARKS_DIRECTORY)
+
+from suite import BENCHMARKS, CB7  # noqa: E402
+
+
+def describe_commit():
+    try:
+        output = sp.check_output(['git', 'describe', '--always', '--dirty'],
+                                 cwd=REPOSITORY,
+                                 stderr=sp.DEVNULL)
+        return output.decode('utf-8').strip()
+    except (OSError, sp.CalledProcessError):
+        return 'unknown'
+
+
+def use_shims():
+    os.environ['PATH'] = os.path.join(BENCHMARKS_DIRECTORY,
+                                      'shims') + os.pathsep + os.environ['PATH']
+    os.environ['SMIRNOVERT_FIXTURES'] = CB7
+
+
+def run_benchmark(function, repeat):
+    """
+    Time a single benchmark.
+
+    Parameters
+    ----------
+    function : callable
+        Benchmark from `suite.BENCHMARKS`
+    repeat : int
+        Number of repetitions
+
+    Returns
+    -------
+    dict
+        Timings (s) of each repetition and their minimum, median, and mean, or the reason it was skipped
+    """
+    scratch = tempfile.mkdtemp(prefix=f'benchmark-{function.__name__}-')
+    cwd = os.getcwd()
+    try:
+        os.chdir(scratch)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            try:
+                benchmark = function(scratch)
+            except ImportError as error:
+                return dict(skipped=f'{error}')
+            prepare, run = benchmark if isinstance(benchmark, tuple) else (
+                lambda: None, lambda _: benchmark())
+            timings = []
+            for _ in range(function.repeat or repeat):
+                state = prepare()
+                start = time.perf_counter()
+                run(state)
+                timings.append(time.perf_counter() - start)
+    except Exception:
+        return dict(error=traceback.format_exc())
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+    return dict(
+        timings=timings,
+        min=min(timings),
+        median=statistics.median(timings),
+        mean=statistics.mean(timings))
+
+
+def latest_results(directory, exclude=None):
+    files = [
+        file for file in glob.glob(os.path.join(directory, '*.json'))
+        if os.path.abspath(file) != os.path.abspath(exclude or '')
+    ]
+    return max(files, key=os.path.getmtime) if files else None
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change in the median time of each benchmark relative to a baseline run.
+
+    Parameters
+    ----------
+    results : dict
+        Current run
+    baseline : dict
+        Earlier run
+    threshold : float
+        Relative slowdown that counts as a regression (e.g., 0.1 for 10%)
+
+    Returns
+    -------
+    list
+        Names of the benchmarks that regressed
+    """
+    print(f'\nCompared with {baseline["commit"]} ({baseline["date"]}):')
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        previous = baseline['benchmarks'].get(name, dict())
+        if 'median' not in result or 'median' not in previous:
+            continue
+        ratio = result['median'] / previous['median']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  <-- slower'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = '  <-- faster'
+        print(f'{name:30} {previous["median"]:10.4f} s {result["median"]:10.4f} s '
+              f'{ratio:7.2f}x{flag}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-k', '--filter', default='', help='Only run benchmarks whose name contains this')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Repetitions per benchmark')
+    parser.add_argument(
+        '-o',
+        '--output-dir',
+        default=os.path.join(BENCHMARKS_DIRECTORY, 'results'),
+        help='Directory of saved runs')
+    parser.add_argument('--compare', help='Saved run to compare with (default: the latest one)')
+    parser.add_argument(
+        '--threshold', type=float, default=0.1, help='Relative slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    use_shims()
+    results = dict(
+        commit=describe_commit(),
+        date=datetime.datetime.now().isoformat(timespec='seconds'),
+        python=platform.python_version(),
+        machine=platform.platform(),
+        benchmarks=dict())
+    for function in BENCHMARKS:
+        if args.filter not in function.__name__:
+            continue
+        result = run_benchmark(function, args.repeat)
+        results['benchmarks'][function.__name__] = result
+        if 'skipped' in result:
+            print(f'{function.__name__:30} skipped ({result["skipped"]})')
+        elif 'error' in result:
+            print(f'{function.__name__:30} failed\n{result["error"]}')
+        else:
+            print(f'{function.__name__:30} {result["median"]:10.4f} s (min {result["min"]:.4f} s, '
+                  f'{len(result["timings"])} runs)')
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output = os.path.join(args.output_dir, results['commit'] + '.json')
+    baseline_file = args.compare or latest_results(args.output_dir, exclude=output)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'\nSaved {output}.')
+
+    if baseline_file is None:
+        return 0
+    with open(baseline_file, 'r') as file:
+        baseline = json.load(file)
+    return 1 if compare(results, baseline, args.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Stand-ins for `cpptraj`, `tleap`, and `antechamber` that copy pre-recorded outputs instead of running the
+programs, so the benchmarks run offline and only measure this package. Each output file named in the input
+is looked up by its base name in the directories listed in `$SMIRNOVERT_FIXTURES` (e.g., `tests/cb7-1`).
+"""
+
+import os as os
+import shlex as shlex
+import shutil as shutil
+import sys as sys
+
+
+def find_fixture(file_name):
+    for directory in os.environ.get('SMIRNOVERT_FIXTURES', '').split(os.pathsep):
+        candidate = os.path.join(directory, os.path.basename(file_name))
+        if directory and os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError(f'No recorded output for {file_name} in $SMIRNOVERT_FIXTURES.')
+
+
+def copy_fixture(file_name, destination=None):
+    shutil.copyfile(find_fixture(file_name), destination or file_name)
+    print(f'Copied recorded {os.path.basename(file_name)}.')
+
+
+def option(arguments, flag):
+    return arguments[arguments.index(flag) + 1]
+
+
+def cpptraj(arguments):
+    with open(option(arguments, '-i'), 'r') as file:
+        commands = [shlex.split(line) for line in file if line.strip()]
+    for command in commands:
+        if command[0] in ('trajout', 'outtraj'):
+            copy_fixture(command[1])
+        elif command[0] == 'mask' and 'maskmol2' in command:
+            output = command[command.index('maskmol2') + 1]
+            # `cpptraj` appends the frame number to `maskmol2` output.
+            copy_fixture(output, output + '.1')
+
+
+def antechamber(arguments):
+    copy_fixture(option(arguments, '-o'))
+
+
+def tleap(arguments):
+    script = option(arguments, '-f')
+    if script == '-':
+        return tleap_stdin()
+    with open(script, 'r') as file:
+        commands = [line.split() for line in file if line.strip()]
+    with open('leap.log', 'w') as log:
+        for command in commands:
+            log.write(' '.join(command) + '\n')
+            if command[0] == 'saveamberparm':
+                copy_fixture(command[2])
+                copy_fixture(command[3])
+
+
+def tleap_stdin():
+    # Commands arrive one line at a time, as from `smirnovert.tleap.TleapWorker`; `logFile` switches the log.
+    log = open(os.devnull, 'w')
+    for line in sys.stdin:
+        command = shlex.split(line)
+        if not command:
+            continue
+        if command[0] == 'quit':
+            break
+        if command[0] == 'logFile':
+            log.close()
+            log = open(command[1], 'w')
+            continue
+        log.write(line)
+        if command[0] == 'saveamberparm':
+            copy_fixture(command[2])
+            copy_fixture(command[3])
+        log.flush()
+        sys.stdout.flush()
+    log.close()
+
+
+def main(program):
+    programs = dict(cpptraj=cpptraj, antechamber=antechamber, tleap=tleap)
+    try:
+        programs[program](sys.argv[1:])
+    except (OSError, ValueError, IndexError) as error:
+        print(f'{program} (benchmark shim): {error}', file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+"""
+Benchmarks built on the `tests/cb7-1` and `tests/a-bam-p/original` fixtures.
+
+Each benchmark is a function that takes a scratch directory, does its (untimed) setup, and returns either the
+callable to time or a `(prepare, run)` pair, in which case `prepare()` is called (untimed) before every
+repetition and its return value is passed to `run()`. Benchmarks that need a missing toolkit (e.g., OpenEye
+or `openforcefield`) raise `ImportError` during setup and are skipped.
+"""
+
+import os as os
+import shutil as shutil
+
+TESTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests')
+CB7 = os.path.join(TESTS, 'cb7-1')
+BAM = os.path.join(TESTS, 'a-bam-p', 'original')
+
+BENCHMARKS = []
+
+
+def benchmark(repeat=None):
+    """
+    Register a benchmark.
+
+    Parameters
+    ----------
+    repeat : int
+        Number of repetitions, if different from the harness default (e.g., for end-to-end runs)
+    """
+
+    def decorator(function):
+        function.repeat = repeat
+        BENCHMARKS.append(function)
+        return function
+
+    return decorator
+
+
+def _load_cb7_mols(scratch):
+    import parmed as pmd
+    from smirnovert.utils import load_mol2
+
+    reference = pmd.load_file(
+        os.path.join(CB7, 'cb7-1.prmtop'), xyz=os.path.join(CB7, 'cb7-1.rst7'))
+    # The recorded SMIRNOFF99Frosst host-guest and `tleap` water and ions, combined like `convert()` does.
+    target = pmd.load_file(
+        os.path.join(CB7, 'hg.prmtop'), xyz=os.path.join(CB7, 'hg.inpcrd')) + pmd.load_file(
+            os.path.join(CB7, 'water_ions.prmtop'),
+            xyz=os.path.join(CB7, 'water_ions.inpcrd'))
+    for name, structure in [('reference', reference), ('target', target)]:
+        structure.save(os.path.join(scratch, name + '.mol2'), overwrite=True)
+        structure.save(os.path.join(scratch, name + '.pdb'), overwrite=True)
+    return (load_mol2(os.path.join(scratch, 'reference.mol2')),
+            load_mol2(os.path.join(scratch, 'target.mol2')))
+
+
+@benchmark()
+def split_topology(scratch):
+    from smirnovert.utils import split_topology
+
+    return lambda: split_topology(file_name=os.path.join(CB7, 'cb7-1.pruned.pdb'))
+
+
+@benchmark()
+def create_host_guest_topology(scratch):
+    from smirnovert.utils import create_host_guest_topology, split_topology
+
+    components = split_topology(file_name=os.path.join(CB7, 'cb7-1.pruned.pdb'))
+    return lambda: create_host_guest_topology(components, host_resname='CB7', guest_resname='MOL')
+
+
+@benchmark()
+def write_pdb_with_conect(scratch):
+    import parmed as pmd
+    from smirnovert.utils import write_pdb_with_conect
+
+    reference = pmd.load_file(os.path.join(BAM, 'full.topo'), xyz=os.path.join(BAM, 'full.crds'))
+    return lambda: write_pdb_with_conect(
+        structure=reference, output_pdb=os.path.join(scratch, 'full.pruned.pdb'))
+
+
+@benchmark()
+def map_atoms(scratch):
+    from smirnovert.utils import map_atoms
+
+    reference_mol, target_mol = _load_cb7_mols(scratch)
+    return lambda: map_atoms(reference_mol, target_mol)
+
+
+@benchmark()
+def map_atoms_cached(scratch):
+    from smirnovert.utils import map_atoms
+
+    reference_mol, target_mol = _load_cb7_mols(scratch)
+    cache = os.path.join(scratch, 'mappings')
+    map_atoms(reference_mol, target_mol, cache=cache)
+    return lambda: map_atoms(reference_mol, target_mol, cache=cache)
+
+
+@benchmark()
+def map_residues(scratch):
+    from smirnovert.utils import load_pdb, map_atoms, map_residues
+
+    reference_to_target_mapping = map_atoms(*_load_cb7_mols(scratch))
+    reference_mol = load_pdb(os.path.join(scratch, 'reference.pdb'))
+    target_mol = load_pdb(os.path.join(scratch, 'target.pdb'))
+    return lambda: map_residues(reference_to_target_mapping, reference_mol, target_mol)
+
+
+@benchmark()
+def amber_create_mapping(scratch):
+    import parmed as pmd
+    from smirnovert.amber import create_mapping
+
+    structure = pmd.load_file(os.path.join(CB7, 'hg.prmtop'), xyz=os.path.join(CB7, 'hg.inpcrd'))
+    return lambda: create_mapping(structure, 'CB7', 'MOL')
+
+
+@benchmark()
+def amber_remap_atom_types(scratch):
+    import parmed as pmd
+    from smirnovert.amber import create_mapping, remap_atom_types
+
+    def load():
+        return pmd.load_file(os.path.join(CB7, 'hg.prmtop'), xyz=os.path.join(CB7, 'hg.inpcrd'))
+
+    host_mapping, guest_mapping = create_mapping(load(), 'CB7', 'MOL')
+
+    def prepare():
+        # `remap_atom_types()` modifies the parameters in place.
+        return load()
+
+    def run(parm):
+        remap_atom_types(parm, 'CB7', host_mapping, 'MOL', guest_mapping, scratch + os.sep)
+
+    return prepare, run
+
+
+@benchmark()
+def rewrite_restraints_file(scratch):
+    from smirnovert.utils import rewrite_restraints_file
+
+    # The identity mapping still exercises every lookup.
+    reference_to_target_mapping = {index: index for index in range(100000)}
+    return lambda: rewrite_restraints_file(
+        reference_restraints=os.path.join(BAM, 'disang.rest'),
+        target_restraints=os.path.join(scratch, 'disang.rest'),
+        reference_to_target_mapping=reference_to_target_mapping)
+
+
+@benchmark()
+def rewrite_mdin_tree(scratch):
+    from smirnovert.mdin import rewrite_mdin_tree
+
+    # Twenty windows, each with the recorded input files.
+    reference = os.path.join(scratch, 'reference')
+    for window in range(20):
+        directory = os.path.join(reference, f'a{window:03d}')
+        os.makedirs(directory)
+        for file_name in ['mini.in', 'therm1.in', 'therm2.in', 'eqnpt.in', 'mdin']:
+            shutil.copy(os.path.join(BAM, file_name), directory)
+    residue_mapping = {number: number for number in range(1, 1000)}
+    return lambda: rewrite_mdin_tree(
+        reference, os.path.join(scratch, 'target'), residue_mapping)
+
+
+def _solvated_cb7(compact):
+    import parmed as pmd
+    from smirnovert.compact import CompactSystem
+    from smirnovert.solvent import create_water_and_ions_blocks
+
+    reference = pmd.load_file(
+        os.path.join(CB7, 'cb7-1.prmtop'), xyz=os.path.join(CB7, 'cb7-1.rst7'))
+    host_guest = pmd.load_file(
+        os.path.join(CB7, 'hg.prmtop'), xyz=os.path.join(CB7, 'hg.inpcrd'))
+    blocks = create_water_and_ions_blocks(reference['!:CB7,MOL'])
+    if compact:
+        return CompactSystem(host_guest, blocks, box=reference.box)
+    merged = host_guest + CompactSystem(pmd.Structure(), blocks).to_structure()
+    merged.box = reference.box
+    return merged
+
+
+@benchmark()
+def save_merged_structure(scratch):
+    merged = _solvated_cb7(compact=False)
+    return lambda: merged.save(os.path.join(scratch, 'smirnoff.prmtop'), overwrite=True)
+
+
+@benchmark()
+def save_compact_system(scratch):
+    merged = _solvated_cb7(compact=True)
+    return lambda: merged.save(os.path.join(scratch, 'smirnoff.prmtop'), overwrite=True)
+
+
+@benchmark()
+def save_inpcrd(scratch):
+    merged = _solvated_cb7(compact=True)
+    return lambda: merged.save(os.path.join(scratch, 'smirnoff.inpcrd'), overwrite=True)
+
+
+@benchmark()
+def save_ncrst(scratch):
+    merged = _solvated_cb7(compact=True)
+    return lambda: merged.save(os.path.join(scratch, 'smirnoff.ncrst'), overwrite=True)
+
+
+@benchmark()
+def copy_box_vectors(scratch):
+    from smirnovert.restart import write_restart
+    from smirnovert.utils import copy_box_vectors
+
+    merged = _solvated_cb7(compact=True)
+    target = os.path.join(scratch, 'smirnoff.inpcrd')
+
+    def prepare():
+        write_restart(target, merged.coordinates, overwrite=True)
+
+    def run(_):
+        copy_box_vectors(os.path.join(CB7, 'cb7-1.rst7'), target)
+
+    return prepare, run
+
+
+@benchmark()
+def load_reference(scratch):
+    import parmed as pmd
+
+    return lambda: pmd.load_file(os.path.join(CB7, 'cb7-1.prmtop'), xyz=os.path.join(CB7, 'cb7-1.rst7'))
+
+
+@benchmark()
+def read_solute(scratch):
+    from smirnovert.stream import read_solute
+
+    return lambda: read_solute(
+        os.path.join(CB7, 'cb7-1.prmtop'), os.path.join(CB7, 'cb7-1.rst7'), resnames=['CB7', 'MOL'])
+
+
+@benchmark()
+def read_solvent_blocks(scratch):
+    from smirnovert.stream import read_solvent_blocks
+
+    return lambda: read_solvent_blocks(
+        os.path.join(CB7, 'cb7-1.prmtop'), os.path.join(CB7, 'cb7-1.rst7'), ['CB7', 'MOL'], chunk_size=1000)
+
+
+@benchmark()
+def write_solvent_pdb(scratch):
+    from smirnovert.stream import write_solvent_pdb
+
+    return lambda: write_solvent_pdb(
+        os.path.join(CB7, 'cb7-1.prmtop'),
+        os.path.join(CB7, 'cb7-1.rst7'),
+        os.path.join(scratch, 'water_ions.pdb'), ['CB7', 'MOL'],
+        chunk_size=1000)
+
+
+@benchmark()
+def extract_reference_separately(scratch):
+    from smirnovert.utils import create_host_mol2, extract_water_and_ions
+
+    prmtop = os.path.join(CB7, 'cb7-1.prmtop')
+    inpcrd = os.path.join(CB7, 'cb7-1.rst7')
+
+    def run():
+        for resname in ('CB7', 'MOL'):
+            create_host_mol2(inpcrd, prmtop, resname, resname + '.mol2', path=scratch)
+        extract_water_and_ions(prmtop, inpcrd, ':CB7', ':MOL', 'water_ions.pdb', path=scratch)
+
+    return run
+
+
+@benchmark()
+def extract_reference_once(scratch):
+    from smirnovert.utils import extract_with_cpptraj, water_and_ions_strip_mask
+
+    outputs = [('CB7.mol2', '!:CB7'), ('MOL.mol2', '!:MOL'),
+               ('water_ions.pdb', water_and_ions_strip_mask(':CB7', ':MOL'))]
+    return lambda: extract_with_cpptraj(
+        os.path.join(CB7, 'cb7-1.prmtop'), os.path.join(CB7, 'cb7-1.rst7'), outputs, path=scratch)
+
+
+def _water_ions_parameters(scratch, worker=None):
+    from smirnovert.utils import create_water_and_ions_parameters
+
+    shutil.copy(os.path.join(CB7, 'water_ions.pdb'), scratch)
+
+    def run():
+        create_water_and_ions_parameters(
+            input_pdb='water_ions.pdb',
+            output_prmtop='water_ions.prmtop',
+            output_inpcrd='water_ions.inpcrd',
+            path=scratch,
+            worker=worker)
+
+    return run
+
+
+@benchmark()
+def water_ions_parameters(scratch):
+    return _water_ions_parameters(scratch)
+
+
+@benchmark()
+def water_ions_parameters_worker(scratch):
+    from smirnovert.utils import create_tleap_worker
+
+    # The worker starts (and sources the force field) during the untimed first call.
+    run = _water_ions_parameters(scratch, worker=create_tleap_worker())
+    run()
+    return run
+
+
+def _convert(scratch, session=True, **kwargs):
+    from smirnovert.convert import Converter, convert
+
+    # Without a session, every run goes through the module-level `convert()`, which parses the force field again.
+    converter = Converter() if session else None
+    destination = os.path.join(scratch, 'cb7-1')
+
+    def prepare():
+        shutil.rmtree(destination, ignore_errors=True)
+        os.makedirs(destination)
+
+    def run(_):
+        (converter.convert if session else convert)(
+            source=CB7,
+            destination=destination,
+            prefix='cb7-1',
+            reference_prmtop='cb7-1.prmtop',
+            reference_inpcrd='cb7-1.rst7',
+            host_resname='CB7',
+            guest_resname='MOL',
+            **kwargs)
+
+    return prepare, run
+
+
+@benchmark(repeat=3)
+def convert(scratch):
+    return _convert(scratch)
+
+
+@benchmark(repeat=3)
+def convert_new_session(scratch):
+    return _convert(scratch, session=False)
+
+
+@benchmark(repeat=3)
+def convert_reused_session(scratch):
+    return _convert(scratch)
+
+
+@benchmark(repeat=3)
+def convert_in_memory(scratch):
+    return _convert(scratch, in_memory=True, solvent_templates=True)
+
+
+@benchmark(repeat=3)
+def convert_compact(scratch):
+    return _convert(scratch, in_memory=True, solvent_templates=True, compact=True)
+
+
+@benchmark(repeat=3)
+def convert_ncrst(scratch):
+    return _convert(scratch, in_memory=True, solvent_templates=True, compact=True, restart_format='ncrst')
+
+
+@benchmark(repeat=3)
+def convert_streaming(scratch):
+    return _convert(scratch, solvent_templates=True, compact=True, streaming=True)
+
+
+@benchmark(repeat=3)
+def convert_persistent_tleap(scratch):
+    return _convert(scratch, in_memory=True, persistent_tleap=True)
@@ -49,6 +49,11 @@ setuptools.setup(
     ],
     packages=['smirnovert'],
 
+    # Command-line programs
+    entry_points={
+        'console_scripts': ['smirnovert = smirnovert.cli:main'],
+    },
+
     # Specify python version
     python_requires='>=3.6',
 
@@ -65,5 +70,5 @@ setuptools.setup(
     ],
 
     # Additional groups of dependencies
-    extras_require={},
+    extras_require={'yaml': ['pyyaml']},
 )
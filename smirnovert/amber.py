@@ -2,8 +2,14 @@
 """
 Provides a wrapper to change SMIRNOFF99Frosst "atom types" to two-character unique atom types.
 """
+import collections as collections
+import logging as logging
+
+import numpy as np
 import parmed as pmd
 
+from .profiling import profiled
+
 CHARS = "0 1 2 3 4 5 6 7 8 9 a b c d e f g h i j k l m n o p q r\
             s t u v w x y z A B C D E F G H I J K L M N O P Q R S T\
             U V W X Y Z * & $ # % [ ] { } < > ? + = : ; ' . , ! ~ `\
@@ -15,7 +21,125 @@ def create_element_type_lists(first_chars, second_chars):
     return [first_char + second_char for first_char in first_chars for second_char in second_chars]
 
 
-def create_mapping(structure, host_resname, guest_resname):
+# First characters of the new types of the common elements. Other elements use the first letter of their
+# symbol, and every element falls back to any unused type once these run out.
+FIRST_CHARS = {1: ["H", "h", "1"], 6: ["C", "c", "6"], 7: ["N", "n", "7"], 8: ["O", "o", "8"]}
+
+
+def _type_names(element, used):
+    """ Yield the unused two character atom types for an element, marking each one as used. """
+    first_chars = FIRST_CHARS.get(element)
+    if first_chars is None:
+        symbol = pmd.periodic_table.Element[element]
+        first_chars = [symbol[0].upper(), symbol[0].lower()]
+    for chars in (first_chars, CHARS):
+        for type_name in create_element_type_lists(chars, CHARS):
+            if type_name not in used:
+                used.add(type_name)
+                yield type_name
+
+
+def nonbonded_key(atom):
+    """
+    The nonbonded parameters that an AMBER atom type stands for: atomic number, mass, and Lennard-Jones radius and
+    well depth (rounded, so values that differ only by the precision of the `prmtop` are equal).
+    """
+    return atom.element, round(atom.mass, 4), round(atom.rmin, 6), round(atom.epsilon, 6)
+
+
+def bonded_terms(structure, slots):
+    """
+    The bonds, angles, and dihedrals between atoms that have a slot, as `(kind, slots, parameters)`. The
+    parameters of a dihedral are the set of all its terms (a multi-term dihedral is one entry per term in a
+    `prmtop`), and impropers are a kind of their own.
+    """
+    terms = set()
+    for kind, items, natom, fields in [
+        ("bond", structure.bonds, 2, ("k", "req")),
+        ("angle", structure.angles, 3, ("k", "theteq")),
+    ]:
+        for item in items:
+            atoms = [getattr(item, f"atom{number}").idx for number in range(1, natom + 1)]
+            if item.type is None or not all(atom in slots for atom in atoms):
+                continue
+            parameters = tuple(getattr(item.type, field) for field in fields)
+            terms.add((kind, tuple(slots[atom] for atom in atoms), parameters))
+
+    dihedrals = collections.defaultdict(set)
+    for dihedral in structure.dihedrals:
+        atoms = (dihedral.atom1.idx, dihedral.atom2.idx, dihedral.atom3.idx, dihedral.atom4.idx)
+        if dihedral.type is None or not all(atom in slots for atom in atoms):
+            continue
+        kind = "improper" if dihedral.improper else "dihedral"
+        if kind == "dihedral":
+            atoms = min(atoms, atoms[::-1])
+        types = dihedral.type if isinstance(dihedral.type, pmd.DihedralTypeList) else [dihedral.type]
+        dihedrals[kind, atoms].update((t.phi_k, t.per, t.phase, t.scee, t.scnb) for t in types)
+    for (kind, atoms), parameters in dihedrals.items():
+        terms.add((kind, tuple(slots[atom] for atom in atoms), frozenset(parameters)))
+    return terms
+
+
+def term_key(kind, types):
+    """
+    The atom types of a bonded term in a canonical order: reversed bonds, angles, and dihedrals are the same
+    term, and an improper only depends on its central (third) atom and the set of the other three.
+    """
+    if kind == "improper":
+        return kind, tuple(sorted(types[:2] + types[3:])), types[2]
+    return kind, min(types, types[::-1])
+
+
+def _collapse_types(slots, keys, terms, new_type):
+    """
+    Assign the slots types, sharing a type between slots with the same nonbonded parameters (`keys`) unless the
+    shared type would give two different sets of parameters to the same combination of types in `terms`. A slot
+    reuses the first compatible type; if even a new type clashes, the slots of the clashing terms get types of
+    their own and the assignment starts over.
+    """
+    order = {slot: index for index, slot in enumerate(slots)}
+    # Each term is checked once, when the last of its slots gets a type.
+    completed = collections.defaultdict(list)
+    for term in terms:
+        completed[max(term[1], key=order.get)].append(term)
+
+    exclusive = set()
+    while True:
+        names = new_type()
+        types = dict()
+        shared = collections.defaultdict(list)
+        parameters = dict()
+        clash = None
+        for slot in slots:
+            candidates = [] if slot in exclusive else shared[keys[slot]]
+            for type_name in candidates + [None]:
+                fresh = type_name is None
+                types[slot] = names(slot) if fresh else type_name
+                found = dict()
+                clash = None
+                for kind, term_slots, term_parameters in completed[slot]:
+                    key = term_key(kind, tuple(types[other] for other in term_slots))
+                    known = found.get(key, parameters.get(key))
+                    if known is not None and known[0] != term_parameters:
+                        clash = set(term_slots) | set(known[1])
+                        break
+                    found[key] = (term_parameters, term_slots)
+                if clash is None or fresh:
+                    break
+            if clash is not None:
+                break
+            parameters.update(found)
+            if fresh and slot not in exclusive:
+                shared[keys[slot]].append(types[slot])
+        if clash is None:
+            return types
+        if clash <= exclusive:
+            raise ValueError("Atoms with the same atom type have different bonded parameters.")
+        exclusive |= clash
+
+
+@profiled()
+def create_mapping(structure, host_resname, guest_resname, collapse=False):
     """
     Create a mapping between position in a residue (i.e., the "first" atom when iterating through the atoms in a
     residue) and fake atom types that depend on the element. This is useful for at least two reasons: first,
@@ -25,6 +149,11 @@ def create_mapping(structure, host_resname, guest_resname):
     even though the parameters will be the same (as they should be for chemically identical atoms). Having different
     types makes it effectively impossible to run this through `tleap` and other utilities.
 
+    With `collapse=True`, atoms with the same nonbonded parameters (see `nonbonded_key()`) share one type, in the
+    host and guest alike, as long as every bond, angle, and dihedral between the shared types keeps a single set of
+    parameters (otherwise the atoms get types of their own). The Lennard-Jones tables of the `prmtop` grow with the
+    square of the number of types, so this gives much smaller files, and the `frcmod` holds fewer, shared entries.
+
     Parameters
     ----------
     structure : pmd.Structure
@@ -33,6 +162,8 @@ def create_mapping(structure, host_resname, guest_resname):
         Residue name of the host molecule
     guest_resname : str
         Residue name of the guest molecule
+    collapse : bool
+        Whether to reuse one type for atoms with identical nonbonded and compatible bonded parameters
 
     Returns
     -------
@@ -42,62 +173,66 @@ def create_mapping(structure, host_resname, guest_resname):
         Dictionary mapping between original guest atom typse and the new types
     """
 
-    hydrogen_list = create_element_type_lists(['H', 'h', '1'], CHARS)
-    carbon_list = create_element_type_lists(['C', 'c', '6'], CHARS)
-    oxygen_list = create_element_type_lists(['O', 'o', '8'], CHARS)
-    nitrogen_list = create_element_type_lists(['N', 'n', '7'], CHARS)
+    def new_type():
+        used = set()
+        names = dict()
 
-    host_mapping = dict()
-    guest_mapping = dict()
-    hydrogen_index = 0
-    carbon_index = 0
-    nitrogen_index = 0
-    oxygen_index = 0
+        def type_name(slot):
+            element = elements[slot]
+            if element not in names:
+                names[element] = _type_names(element, used)
+            name = next(names[element], None)
+            if name is None:
+                raise ValueError("Ran out of two character atom types.")
+            return name
 
+        return type_name
+
+    # A slot is a position in the host or guest residue; every residue with that name shares its types.
+    slots = []
+    elements = dict()
+    keys = dict()
+    slot_of = dict()
+    first = dict()
     for residue in structure.residues:
-        if residue.name == host_resname and not host_mapping:
-            for atom_index, atom in enumerate(residue):
-                # WARNING
-                # Assumption: each host residue has atoms numbered in the same order!
-                # This is going to greatly simplify assigning unique atom types *only* within a residue.
-                # To be completely thorough, we could add a check here that the parameters associated with each
-                # atom type in each residue are identical, but for now I've manually checked this is correct.
-                if atom.element == 1:
-                    host_mapping[atom_index] = hydrogen_list[hydrogen_index]
-                    hydrogen_index += 1
-                elif atom.element == 6:
-                    host_mapping[atom_index] = carbon_list[carbon_index]
-                    carbon_index += 1
-                elif atom.element == 7:
-                    host_mapping[atom_index] = nitrogen_list[nitrogen_index]
-                    nitrogen_index += 1
-                elif atom.element == 8:
-                    host_mapping[atom_index] = oxygen_list[oxygen_index]
-                    oxygen_index += 1
-                else:
-                    print(f'Whoops, missing atom type lists for element {atom.element}.')
-        elif residue.name == guest_resname and not guest_mapping:
+        # WARNING
+        # Assumption: each host residue has atoms numbered in the same order!
+        # This is going to greatly simplify assigning unique atom types *only* within a residue.
+        # To be completely thorough, we could add a check here that the parameters associated with each
+        # atom type in each residue are identical, but for now I've manually checked this is correct.
+        for label, resname in [("host", host_resname), ("guest", guest_resname)]:
+            if residue.name != resname:
+                continue
             for atom_index, atom in enumerate(residue):
-                if atom.element == 1:
-                    guest_mapping[atom_index] = hydrogen_list[hydrogen_index]
-                    hydrogen_index += 1
-                elif atom.element == 6:
-                    guest_mapping[atom_index] = carbon_list[carbon_index]
-                    carbon_index += 1
-                elif atom.element == 7:
-                    guest_mapping[atom_index] = nitrogen_list[nitrogen_index]
-                    nitrogen_index += 1
-                elif atom.element == 8:
-                    guest_mapping[atom_index] = oxygen_list[oxygen_index]
-                    oxygen_index += 1
-                else:
-                    print(f'Whoops, missing atom type lists for this element {atom.element}')
+                slot = (label, atom_index)
+                slot_of[atom.idx] = slot
+                if label not in first or first[label] is residue:
+                    first[label] = residue
+                    slots.append(slot)
+                    elements[slot] = atom.element
+                    keys[slot] = nonbonded_key(atom)
+            break
+
+    if collapse:
+        types = _collapse_types(slots, keys, bonded_terms(structure, slot_of), new_type)
+    else:
+        type_name = new_type()
+        types = {slot: type_name(slot) for slot in slots}
+
+    host_mapping = {index: types[label, index] for label, index in slots if label == "host"}
+    guest_mapping = {index: types[label, index] for label, index in slots if label == "guest"}
     return host_mapping, guest_mapping
 
 
-def remap_atom_types(AmberParm, host_resname, host_mapping, guest_resname, guest_mapping, destination):
+# Files written by `remap_atom_types()`.
+OUTPUTS = ("mol2", "prmtop", "frcmod", "host_mol2", "guest_mol2")
+
+
+@profiled()
+def remap_atom_types(AmberParm, host_resname, host_mapping, guest_resname, guest_mapping, destination, outputs=OUTPUTS):
     """
-    Remap atom types given a dictionary.
+    Remap atom types given a dictionary. The types of every host and guest residue are assigned in one array
+    operation, and the host and guest residues are sliced from the same (in memory) parameter set.
 
     Parameters
     ----------
@@ -113,37 +248,43 @@ def remap_atom_types(AmberParm, host_resname, host_mapping, guest_resname, guest
         Mapping between old and new atom types by *position* in the residue
     destination : str
         Path for the output files (which will be overwritten)
+    outputs : list
+        Files to write (see `OUTPUTS`): the whole system as `smirnoff-unique.mol2`, `.prmtop`, and `.frcmod`, and
+        the first host residue and every guest residue as `smirnoff-<resname>-unique.mol2`
 
     """
-    for residue in AmberParm.residues:
-        if residue.name == host_resname:
-            for index, atom in enumerate(residue):
-                print(f'Assigning {residue.number} {atom.name} {atom.type} → {host_mapping[index]}')
-                AmberParm.parm_data['AMBER_ATOM_TYPE'][int(atom.type) - 1] = host_mapping[index]
-                atom.type = host_mapping[index]
-        if residue.name == guest_resname:
-            for index, atom in enumerate(residue):
-                print(f'Assigning {residue.number} {atom.name} {atom.type} → {guest_mapping[index]}')
-
-                # This is not working correctly!
-                AmberParm.parm_data['AMBER_ATOM_TYPE'][int(atom.type) - 1] = guest_mapping[index]
-                atom.type = guest_mapping[index]
+    unknown = set(outputs) - set(OUTPUTS)
+    if unknown:
+        raise ValueError(f"Unknown outputs {sorted(unknown)}; choose from {OUTPUTS}.")
+
+    types = np.array(AmberParm.parm_data["AMBER_ATOM_TYPE"], dtype=object)
+    first_residues = dict()
+    for resname, mapping in [(host_resname, host_mapping), (guest_resname, guest_mapping)]:
+        new_types = np.array([mapping[index] for index in range(len(mapping))], dtype=object)
+        for residue in AmberParm.residues:
+            if residue.name != resname:
+                continue
+            first_residues.setdefault(resname, residue)
+            start = residue.atoms[0].idx
+            types[start:start + len(residue)] = new_types[:len(residue)]
+        logging.debug(f"Assigned new atom types to every {resname} residue.")
+    AmberParm.parm_data["AMBER_ATOM_TYPE"] = types.tolist()
 
     AmberParm.load_atom_info()
     AmberParm.fill_LJ()
-    AmberParm.save(destination + 'smirnoff-unique.mol2', overwrite=True)
-    AmberParm.save(destination + 'smirnoff-unique.prmtop', overwrite=True)
-
-    parameter_set = pmd.amber.AmberParameterSet.from_structure(AmberParm)
-    parameter_set.write(destination + 'smirnoff-unique.frcmod')
-
-    # Read back in the `prmtop`...
-    structure = pmd.load_file(destination + 'smirnoff-unique.prmtop', structure=True)
-
-    # Write out a `mol2` file for the guest -- expecting all atom types to begin with `G`...
-    single_guest = structure[':' + guest_resname]
-    single_guest.save(destination + 'smirnoff-' + guest_resname + '-unique.mol2', overwrite=True)
+    if "mol2" in outputs:
+        AmberParm.save(destination + "smirnoff-unique.mol2", overwrite=True)
+    if "prmtop" in outputs:
+        AmberParm.save(destination + "smirnoff-unique.prmtop", overwrite=True)
+    if "frcmod" in outputs:
+        parameter_set = pmd.amber.AmberParameterSet.from_structure(AmberParm)
+        parameter_set.write(destination + "smirnoff-unique.frcmod")
 
-    single_host = structure[
-        ':' + str(structure[':' + host_resname].residues[0].number + 1)]
-    single_host.save(destination + 'smirnoff-' + host_resname + '-unique.mol2', overwrite=True)
+    # Write out a `mol2` file for every guest residue and for the first host residue...
+    for output, resname in [("guest_mol2", guest_resname), ("host_mol2", host_resname)]:
+        if output in outputs and resname in first_residues:
+            if resname == guest_resname:
+                residues = AmberParm[":" + guest_resname]
+            else:
+                residues = AmberParm[":" + str(first_residues[resname].idx + 1)]
+            residues.save(destination + "smirnoff-" + resname + "-unique.mol2", overwrite=True)
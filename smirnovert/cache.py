@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+"""
+Provides a persistent, on-disk cache of SMIRNOFF99Frosst-parameterized molecules.
+"""
+
+import fcntl as fcntl
+import hashlib as hashlib
+import logging as logging
+import os as os
+import pickle as pickle
+import tempfile as tempfile
+
+import numpy as np
+
+from .mapping import IndexMap
+from .tables import read_atoms
+
+
+def molecule_key(molecule, component, forcefield_file, options):
+    """
+    Create a content-addressed cache key for a parameterized molecule. The key combines the canonical
+    isomeric SMILES and connectivity of the molecule (e.g., as read from the SYBYL `mol2`), the atom
+    ordering of the topology it is applied to, the force field file, and the `createSystem` options.
+    Coordinates are not part of the key.
+
+    Parameters
+    ----------
+    molecule : openeye.oechem.OEMol
+        Molecule used to assign parameters
+    component : pmd.Structure
+        Topology of the molecule, in the atom order of the system being converted
+    forcefield_file : str
+        SMIRNOFF `offxml` file (either a path or a file name distributed with `openforcefield`)
+    options : dict
+        Keyword arguments passed to `ForceField.createSystem`
+
+    Returns
+    -------
+    str
+        Hexadecimal key
+    """
+    # The toolkits are only needed for molecules, so the mapping cache works without them.
+    from openeye.oechem import OECreateIsoSmiString
+    from openforcefield.utils import get_data_filename
+
+    digest = hashlib.sha256()
+    digest.update(OECreateIsoSmiString(molecule).encode())
+    for atom in molecule.GetAtoms():
+        digest.update(
+            f'{atom.GetIdx()}:{atom.GetAtomicNum()}:{atom.GetFormalCharge()};'.encode())
+    for bond in molecule.GetBonds():
+        digest.update(
+            f'{bond.GetBgnIdx()}-{bond.GetEndIdx()}:{bond.GetOrder()};'.encode())
+    for atom in component.atoms:
+        digest.update(
+            f'{atom.residue.name}:{atom.name}:{atom.atomic_number};'.encode())
+    for bond in component.bonds:
+        digest.update(f'{bond.atom1.idx}-{bond.atom2.idx};'.encode())
+
+    if not os.path.exists(forcefield_file):
+        forcefield_file = get_data_filename(forcefield_file)
+    with open(forcefield_file, 'rb') as file:
+        digest.update(hashlib.sha256(file.read()).digest())
+
+    digest.update(repr(sorted(options.items())).encode())
+    return digest.hexdigest()
+
+
+class StructureCache(object):
+    """
+    A directory of pickled ParmEd structures, keyed by `molecule_key()`. Entries are written atomically, so
+    several processes can share the same directory. When the directory grows beyond `max_size` bytes, the
+    least recently used entries are removed.
+
+    Parameters
+    ----------
+    directory : str
+        Cache directory (created if necessary)
+    max_size : int
+        Maximum size of the cache, in bytes
+    """
+
+    def __init__(self, directory, max_size=2**30):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        """
+        Load a structure from the cache.
+
+        Parameters
+        ----------
+        key : str
+            Cache key
+
+        Returns
+        -------
+        pmd.Structure or None
+            The cached structure, or None if the key is not in the cache
+        """
+        try:
+            with open(self.path(key), 'rb') as file:
+                structure = pickle.load(file)
+        except FileNotFoundError:
+            logging.debug(f'Cache miss for {key}.')
+            return None
+        except (pickle.UnpicklingError, EOFError):
+            logging.warning(f'Removing unreadable cache entry {key}...')
+            self._remove(self.path(key))
+            return None
+        # Mark the entry as recently used for eviction.
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            pass
+        logging.debug(f'Cache hit for {key}.')
+        return structure
+
+    def put(self, key, structure):
+        """
+        Store a structure in the cache, then evict old entries if the cache is too large.
+
+        Parameters
+        ----------
+        key : str
+            Cache key
+        structure : pmd.Structure
+            Parameterized structure
+        """
+        descriptor, temporary = tempfile.mkstemp(
+            dir=self.directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                pickle.dump(structure, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.path(key))
+        except BaseException:
+            self._remove(temporary)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in `max_size`.
+        """
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith('.pkl'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_size:
+                    break
+                logging.debug(f'Evicting {name} from the cache...')
+                self._remove(os.path.join(self.directory, name))
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def topology_fingerprint(mol):
+    """
+    Hash the topology of a molecule (or whole system): the element of each atom, the bonds, and the residue
+    name and number of each atom. Coordinates, atom names, and charges are not part of the fingerprint, so
+    every window of an APR calculation has the same one.
+
+    Parameters
+    ----------
+    mol : openeye.oechem.OEMol
+        Molecule (or whole system)
+
+    Returns
+    -------
+    str
+        Hexadecimal fingerprint
+    """
+    table, _ = read_atoms(mol)
+    bonds = np.array(
+        sorted(
+            tuple(sorted((bond.GetBgnIdx(), bond.GetEndIdx())))
+            for bond in mol.GetBonds()),
+        dtype=np.int64)
+    digest = hashlib.sha256()
+    for array in (table['element'], bonds, table['resname'], table['resnum']):
+        digest.update(np.ascontiguousarray(array).tobytes())
+        digest.update(b';')
+    return digest.hexdigest()
+
+
+class MappingCache(object):
+    """
+    A directory of atom and residue mappings (see `mapping.IndexMap`), keyed by the topology fingerprints of
+    the reference and target systems. Each entry also stores the fingerprints it was computed from, and entries
+    that do not match the current topologies are rejected.
+
+    Parameters
+    ----------
+    directory : str
+        Cache directory (created if necessary)
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def fingerprints(self, kind, reference_mol, target_mol, mapping=None):
+        """
+        Fingerprint a mapping request.
+
+        Parameters
+        ----------
+        kind : str
+            `atoms` or `residues`
+        reference_mol : openeye.oechem.OEMol
+            Reference system
+        target_mol : openeye.oechem.OEMol
+            Target system
+        mapping : IndexMap
+            Atom mapping the requested mapping is derived from (e.g., for residues)
+
+        Returns
+        -------
+        numpy.ndarray
+            Fingerprints of the request, whose hash is the cache key
+        """
+        fingerprints = [kind, topology_fingerprint(reference_mol), topology_fingerprint(target_mol)]
+        if mapping is not None:
+            if isinstance(mapping, dict):
+                mapping = IndexMap.from_dict(mapping)
+            fingerprints.append(hashlib.sha256(mapping.targets.tobytes()).hexdigest())
+        return np.array(fingerprints)
+
+    def path(self, fingerprints):
+        key = hashlib.sha256(';'.join(fingerprints.tolist()).encode()).hexdigest()
+        return os.path.join(self.directory, f'{fingerprints[0]}-{key}.npz')
+
+    def get(self, fingerprints):
+        """
+        Load a mapping from the cache.
+
+        Parameters
+        ----------
+        fingerprints : numpy.ndarray
+            From `fingerprints()`
+
+        Returns
+        -------
+        IndexMap or None
+            The cached mapping, or None if it is not in the cache (or does not match the topologies)
+        """
+        path = self.path(fingerprints)
+        try:
+            with np.load(path, allow_pickle=False) as entry:
+                stored, targets = entry['fingerprints'], entry['targets']
+        except FileNotFoundError:
+            logging.debug(f'No cached {fingerprints[0]} mapping.')
+            return None
+        except (OSError, ValueError, KeyError):
+            logging.warning(f'Removing unreadable mapping cache entry {path}...')
+            StructureCache._remove(path)
+            return None
+        if stored.tolist() != fingerprints.tolist():
+            logging.warning(f'Rejecting stale mapping cache entry {path}...')
+            StructureCache._remove(path)
+            return None
+        logging.info(f'Using cached {fingerprints[0]} mapping from {path}.')
+        return IndexMap(targets)
+
+    def put(self, fingerprints, mapping):
+        """
+        Store a mapping in the cache.
+
+        Parameters
+        ----------
+        fingerprints : numpy.ndarray
+            From `fingerprints()`
+        mapping : IndexMap
+            Mapping to store
+        """
+        descriptor, temporary = tempfile.mkstemp(
+            dir=self.directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                np.savez(file, fingerprints=fingerprints, targets=mapping.targets)
+            os.replace(temporary, self.path(fingerprints))
+        except BaseException:
+            StructureCache._remove(temporary)
+            raise
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""
+Converts a batch of host-guest systems to SMIRNOFF99Frosst from the command line.
+
+    smirnovert systems.yaml -j 8 --summary summary.tsv
+
+The manifest (YAML or JSON) lists the systems, each with the keyword arguments of `convert.convert()` or
+their short names (`prmtop`, `inpcrd`, `host`, and `guest`), and optional `defaults` shared by all systems:
+
+    defaults:
+      prefix: smirnoff
+      in_memory: true
+    systems:
+      - name: cb7-1
+        source: cb7-1
+        prmtop: cb7-1.prmtop
+        inpcrd: cb7-1.rst7
+        host: CB7
+        guest: MOL
+        dummy: false
+
+Relative paths are relative to the manifest. Each system is written to its `destination`, or to
+`<output directory>/<name>` (by default, `converted/<name>` next to the manifest, so the outputs never land
+in a source directory). Names and destinations must be unique. Running the manifest again converts every
+system again, replacing its earlier `smirnoff.*` outputs. The exit status is 1 if any system failed.
+"""
+
+import argparse as argparse
+import csv as csv
+import json as json
+import logging as logging
+import os as os
+import sys as sys
+
+# Short names of `convert()` keyword arguments in the manifest.
+ALIASES = {
+    'prmtop': 'reference_prmtop',
+    'inpcrd': 'reference_inpcrd',
+    'host': 'host_resname',
+    'guest': 'guest_resname',
+}
+
+KEYS = {
+    'name', 'source', 'destination', 'prefix', 'reference_prmtop',
+    'reference_inpcrd', 'host_resname', 'guest_resname', 'dummy', 'debug',
+    'cache', 'in_memory', 'solvent_templates', 'concurrent', 'incremental',
+    'profile', 'compact', 'restart_format', 'streaming', 'persistent_tleap'
+}
+
+REQUIRED = ('source', 'reference_prmtop', 'reference_inpcrd', 'host_resname',
+            'guest_resname')
+
+SUMMARY_COLUMNS = ('name', 'status', 'elapsed', 'prmtop', 'inpcrd', 'error')
+
+
+def load_manifest(file_name):
+    """
+    Read a YAML or JSON manifest. PyYAML is only imported for `.yaml` and `.yml` files.
+
+    Parameters
+    ----------
+    file_name : str
+        Manifest file
+
+    Returns
+    -------
+    dict or list
+        The parsed manifest
+    """
+    with open(file_name, 'r') as file:
+        if os.path.splitext(file_name)[1].lower() not in ('.yaml', '.yml'):
+            return json.load(file)
+        try:
+            import yaml as yaml
+        except ImportError:
+            raise ImportError(
+                f'Reading {file_name} needs PyYAML; install it or use a JSON manifest.'
+            )
+        return yaml.safe_load(file)
+
+
+def read_systems(file_name, output_dir=None):
+    """
+    Read the systems of a manifest as keyword arguments for `convert.convert_many()`.
+
+    Parameters
+    ----------
+    file_name : str
+        Manifest file (YAML or JSON)
+    output_dir : str
+        Directory of the systems without a `destination` (defaults to `converted` next to the manifest)
+
+    Returns
+    -------
+    list of dict
+        Keyword arguments for `convert()` (plus `name`), one dictionary per system
+    """
+    manifest = load_manifest(file_name)
+    if isinstance(manifest, list):
+        manifest = dict(systems=manifest)
+    if not isinstance(manifest, dict) or not isinstance(
+            manifest.get('systems'), list):
+        raise ValueError(f'{file_name} has no list of systems.')
+
+    root = os.path.dirname(os.path.abspath(file_name))
+    output_dir = os.path.abspath(output_dir or os.path.join(root, 'converted'))
+    defaults = manifest.get('defaults') or dict()
+    systems = []
+    for index, entry in enumerate(manifest['systems']):
+        system = dict()
+        for key, value in list(defaults.items()) + list(entry.items()):
+            system[ALIASES.get(key, key)] = value
+        unknown = set(system) - KEYS
+        if unknown:
+            raise ValueError(
+                f'Unknown keys {sorted(unknown)} in system {index + 1} of {file_name}.'
+            )
+        missing = [key for key in REQUIRED if key not in system]
+        if missing:
+            raise ValueError(
+                f'Missing keys {missing} in system {index + 1} of {file_name}.'
+            )
+        system['source'] = os.path.join(root, system['source'])
+        system.setdefault('name', os.path.basename(
+            os.path.normpath(system['source'])))
+        system.setdefault('prefix', 'smirnoff')
+        if 'destination' in system:
+            system['destination'] = os.path.join(root, system['destination'])
+        else:
+            system['destination'] = os.path.join(output_dir, system['name'])
+        if isinstance(system.get('cache'), str):
+            system['cache'] = os.path.join(root, system['cache'])
+        systems.append(system)
+
+    # Each system needs its own destination, or the conversions would overwrite each other.
+    for key in ('name', 'destination'):
+        seen = set()
+        for system in systems:
+            value = system[key]
+            if key == 'destination':
+                value = os.path.abspath(value)
+            if value in seen:
+                raise ValueError(
+                    f'Several systems of {file_name} have the {key} {value}; give each system its own.'
+                )
+            seen.add(value)
+    return systems
+
+
+def summary_rows(systems, results, failures):
+    """
+    One row per system, in the order of the manifest.
+    """
+    records = {record['destination']: record for record in results + failures}
+    rows = []
+    for system in systems:
+        record = records[os.path.abspath(system['destination'])]
+        rows.append(
+            dict(
+                name=record['name'],
+                status='failed' if record['error'] else 'converted',
+                elapsed=f'{record["elapsed"]:.1f}',
+                prmtop=record.get('prmtop', ''),
+                inpcrd=record.get('inpcrd', ''),
+                error=record['error'] or ''))
+    return rows
+
+
+def print_summary(rows, file=sys.stdout):
+    """
+    Print the summary as a table with aligned columns.
+    """
+    widths = {
+        column: max([len(column)] + [len(row[column]) for row in rows])
+        for column in SUMMARY_COLUMNS
+    }
+    for row in [dict(zip(SUMMARY_COLUMNS, SUMMARY_COLUMNS))] + rows:
+        print(
+            '  '.join(f'{row[column]:{widths[column]}}'
+                      for column in SUMMARY_COLUMNS).rstrip(),
+            file=file)
+
+
+def write_summary(rows, file_name):
+    """
+    Write the summary as JSON (`.json`) or tab-separated values.
+    """
+    with open(file_name, 'w', newline='') as file:
+        if file_name.lower().endswith('.json'):
+            json.dump(rows, file, indent=2)
+        else:
+            writer = csv.DictWriter(
+                file, fieldnames=SUMMARY_COLUMNS, delimiter='\t')
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='smirnovert',
+        description=__doc__.strip().splitlines()[0],
+        epilog='The manifest format is described in the `smirnovert.cli` documentation.')
+    parser.add_argument('manifest', help='YAML or JSON file listing the systems')
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=None,
+        help='Number of systems converted at the same time (default: the number of CPUs)')
+    parser.add_argument(
+        '-o',
+        '--output-dir',
+        help='Directory of the systems without a destination (default: converted/ next to the manifest)')
+    parser.add_argument(
+        '--scratch', help='Directory for the per-system working directories')
+    parser.add_argument(
+        '--summary', help='Also write the summary table to this file (.json or tab-separated)')
+    parser.add_argument(
+        '-v', '--verbose', action='store_true', help='Log every stage')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s %(levelname)s %(message)s')
+    try:
+        systems = read_systems(args.manifest, args.output_dir)
+    except (OSError, ValueError, ImportError) as error:
+        parser.error(str(error))
+
+    # Importing the conversion code loads the toolkits, so it waits until the manifest is known to be valid.
+    from .convert import convert_many
+
+    results, failures = convert_many(
+        systems, workers=args.jobs, scratch=args.scratch)
+
+    rows = summary_rows(systems, results, failures)
+    print_summary(rows)
+    if args.summary:
+        write_summary(rows, args.summary)
+    print(
+        f'\n{len(results)} converted, {len(failures)} failed.',
+        file=sys.stderr if failures else sys.stdout)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Provides a compact representation of a solvated system: the solute as a ParmEd structure, and the water and
+ions as blocks of one parameterized template repeated many times, with the coordinates of all copies in one
+array. The merged topology is only ever built as arrays (see `prmtop.merge_topologies()`).
+"""
+
+import os as os
+
+import numpy as np
+import parmed as pmd
+
+from .prmtop import merge_topologies, write_prmtop
+from .restart import write_restart
+
+
+class SolventBlock(object):
+    """
+    Consecutive copies of one residue (or group of residues), e.g., 1500 TIP3P waters.
+
+    Parameters
+    ----------
+    template : pmd.Structure
+        The parameterized template (an `AmberParm` is used as is)
+    count : int
+        Number of copies
+    coordinates : numpy.ndarray
+        Coordinates (Å) of all copies, shape `(count * len(template.atoms), 3)`
+    """
+
+    def __init__(self, template, count, coordinates):
+        self.template = template
+        self.count = count
+        self.coordinates = np.asarray(
+            coordinates, dtype=np.float64).reshape(-1, 3)
+        if len(self.coordinates) != count * len(template.atoms):
+            raise ValueError(
+                f'Expected coordinates for {count} × {len(template.atoms)} atoms, not {len(self.coordinates)}.'
+            )
+
+    def __repr__(self):
+        names = '-'.join(residue.name for residue in self.template.residues)
+        return f'<SolventBlock {names} × {self.count}>'
+
+
+class CompactSystem(object):
+    """
+    A solute followed by blocks of solvent, saved without creating ParmEd objects for the solvent atoms.
+
+    Parameters
+    ----------
+    solute : pmd.Structure
+        The parameterized solute (e.g., the host and guest), with coordinates
+    blocks : list of SolventBlock
+        The solvent (water, ions, and dummy atoms), in order
+    box : array_like
+        Box lengths and angles
+    """
+
+    def __init__(self, solute, blocks, box=None):
+        self.solute = solute
+        self.blocks = list(blocks)
+        self.box = None if box is None else np.asarray(box, dtype=np.float64)
+
+    @property
+    def coordinates(self):
+        """ The coordinates of all atoms, shape `(natom, 3)`. """
+        return np.concatenate(
+            [np.asarray(self.solute.coordinates).reshape(-1, 3)] +
+            [block.coordinates for block in self.blocks])
+
+    def __len__(self):
+        return len(self.solute.atoms) + sum(
+            block.count * len(block.template.atoms) for block in self.blocks)
+
+    def topology_sections(self):
+        """
+        The sections of the merged `prmtop`.
+
+        Returns
+        -------
+        list of tuple
+            `(flag, format, values)` of each section
+        """
+        return merge_topologies(
+            [(self.solute, 1)] +
+            [(block.template, block.count) for block in self.blocks],
+            box=self.box)
+
+    def save(self, fname, overwrite=False):
+        """
+        Write the topology (`.prmtop` or `.parm7`) or the coordinates (`.inpcrd` or `.rst7`, or a NetCDF
+        restart with `.ncrst` or `.nc`), like `pmd.Structure.save()`.
+
+        Parameters
+        ----------
+        fname : str
+            Output file
+        overwrite : bool
+            Whether to overwrite an existing file
+        """
+        extension = os.path.splitext(fname)[1].lower()
+        if extension in ('.prmtop', '.parm7'):
+            write_prmtop(fname, self.topology_sections(), overwrite=overwrite)
+        elif extension in ('.inpcrd', '.rst7', '.restrt', '.ncrst', '.nc'):
+            write_restart(
+                fname, self.coordinates, box=self.box, overwrite=overwrite)
+        else:
+            raise ValueError(
+                f'Cannot write {fname}; use `to_structure()` and ParmEd instead.'
+            )
+
+    def to_structure(self):
+        """
+        Build the whole system as one ParmEd structure (which creates an object for every atom and term).
+
+        Returns
+        -------
+        pmd.Structure
+        """
+        structure = self.solute.copy(pmd.Structure)
+        for block in self.blocks:
+            structure += block.template * block.count if block.count > 1 else block.template
+        structure.coordinates = self.coordinates
+        if self.box is not None:
+            structure.box = self.box
+        return structure
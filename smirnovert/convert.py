@@ -4,12 +4,622 @@ Provides a wrapper script to convert a given host-guest system to SMIRNOFF param
 """
 
 from .utils import *
+from .cache import StructureCache, molecule_key
+from .compact import CompactSystem, SolventBlock
+from .frames import atom_order, first_frame, read_frames
+from .pipeline import Stage, run_stages
+from .profiling import profile as record_profile, profiled, stage
+from .restart import RESTART_FORMATS, write_inpcrd, write_restart
+from .solvent import MissingTemplate, create_water_and_ions_blocks, create_water_and_ions_structure
+from .stream import (
+    InpcrdReader,
+    PrmtopReader,
+    read_solute,
+    read_solvent_blocks,
+    read_solvent_structure,
+    write_solvent_pdb,
+)
 from openforcefield.typing.engines.smirnoff import ForceField, unit
 from openforcefield.utils import mergeStructure
 
+import numpy as np
 import parmed as pmd
 import glob
+import logging
+import multiprocessing.util
 import os
+import shutil
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+FORCEFIELD = "forcefield/smirnoff99Frosst.offxml"
+SYSTEM_OPTIONS = dict(nonbondedCutoff=1.1 * unit.nanometer, ewaldErrorTolerance=1e-4)
+
+
+class Converter(object):
+    """
+    A conversion session. The SMIRNOFF99Frosst force field is parsed (and its SMIRKS patterns compiled)
+    once, when the session is created, and reference structures are kept in memory between calls, so
+    notebooks and batch drivers only pay the startup cost once.
+
+    Parameters
+    ----------
+    forcefield : str
+        SMIRNOFF `offxml` file
+    cache : str or smirnovert.cache.StructureCache
+        If set, the host and guest are parameterized separately and the results are stored in (and reused
+        from) this on-disk cache
+    """
+
+    def __init__(self, forcefield=FORCEFIELD, cache=None):
+        logging.info(f"Loading {forcefield}...")
+        self.forcefield = forcefield
+        self.ff = ForceField(forcefield)
+        if cache is not None and not isinstance(cache, StructureCache):
+            cache = StructureCache(cache)
+        self.cache = cache
+        self.references = dict()
+        self.tleap_workers = dict()
+        self.profile = None
+
+    def tleap_worker(self, dummy=False):
+        """
+        The persistent `tleap` process of this session for the water and ions (see `create_tleap_worker()`),
+        started on its first job and kept until `close()`.
+        Parameters
+        ----------
+        dummy : bool
+            Whether the dummy atom parameters are loaded
+
+        Returns
+        -------
+        worker : smirnovert.tleap.TleapWorker
+        """
+        if dummy not in self.tleap_workers:
+            self.tleap_workers[dummy] = create_tleap_worker(dummy_atoms=dummy)
+        return self.tleap_workers[dummy]
+
+    def water_and_ions_parameters(self, persistent_tleap=False, **kwargs):
+        """
+        Create the water and ion parameters with `create_water_and_ions_parameters()`. With `persistent_tleap`,
+        `tleap` runs in the worker of this session (see `tleap_worker()`), which is only started here, so
+        conversions that skip this step never start it.
+        Parameters
+        ----------
+        persistent_tleap : bool
+            Whether to use the persistent `tleap` process of this session
+        kwargs : dict
+            Arguments of `create_water_and_ions_parameters()`, except `worker`
+        """
+        worker = self.tleap_worker(kwargs.get("dummy_atoms", False)) if persistent_tleap else None
+        return create_water_and_ions_parameters(worker=worker, **kwargs)
+
+    def close(self):
+        """
+        Quit the persistent `tleap` processes of this session.
+        """
+        for worker in self.tleap_workers.values():
+            worker.close()
+        self.tleap_workers.clear()
+
+    def load_reference(self, amber_prmtop, amber_inpcrd):
+        """
+        Load (or reuse) the reference structure. Structures are reused as long as neither file changes.
+        Parameters
+        ----------
+        amber_prmtop : str
+            Existing AMBER parameter file
+        amber_inpcrd : str
+            Existing AMBER coordinate file
+
+        Returns
+        -------
+        reference : parmed.Structure
+            The reference structure, with coordinates
+        """
+        key = tuple(
+            (os.path.abspath(file), os.path.getmtime(file))
+            for file in (amber_prmtop, amber_inpcrd)
+        )
+        if key not in self.references:
+            with stage("load_reference"):
+                self.references[key] = pmd.load_file(amber_prmtop, xyz=amber_inpcrd)
+        return self.references[key]
+
+    def convert(
+        self,
+        source,
+        destination,
+        prefix,
+        reference_prmtop,
+        reference_inpcrd,
+        host_resname,
+        guest_resname,
+        dummy=False,
+        debug=False,
+        in_memory=False,
+        solvent_templates=False,
+        concurrent=True,
+        incremental=False,
+        profile=False,
+        compact=False,
+        restart_format="inpcrd",
+        streaming=False,
+        persistent_tleap=False,
+    ):
+        """
+        Convert from an existing parameter set to SMIRNOFF99Frosst.
+        Parameters
+        ----------
+        source : str
+            Directory where existing files will be read
+        destination : str
+            Directory where new files will be written
+        prefix : str
+            Base name of output files (e.g., "smirnoff" or "hg")
+        reference_prmtop : str
+            Name of existing AMBER parameter file
+        reference_inpcrd : str
+            Name of existing AMBER coordinate file
+        host_resname : str
+            Residue name of the host molecule (*not* the mask)
+        guest_resname : str
+            Residue name of the guest molecule (*not* the mask)
+        dummy : bool
+            Whether the reference structures include dummy atoms
+        debug : bool
+            If True, intermediary files will be kept
+        in_memory : bool
+            If True, pass structures between stages in memory and only write the files needed by
+            `antechamber` and `tleap` (plus `hg.prmtop` and `hg.inpcrd` when `debug` is set)
+        solvent_templates : bool
+            If True, parameterize the water, ions, and dummy atoms in-process from templates (TIP3P water and
+            Joung-Cheatham ions) instead of running `tleap`; residues without a template still go through `tleap`
+        concurrent : bool
+            If True, run independent stages (e.g., the host and guest `antechamber` runs) at the same time
+        incremental : bool
+            If True, keep the intermediary files and record a hash of the inputs of each stage in
+            `destination/.stamps`, so a later run only repeats the stages whose inputs changed
+        profile : bool
+            If True, record the wall time, CPU time, peak memory, and I/O of every stage and external program
+            in `self.profile` and write them to `destination/prefix.profile.json`
+        compact : bool
+            If True, keep the water and ions as blocks of repeated templates and write `smirnoff.prmtop` and
+            `smirnoff.inpcrd` straight from arrays, without building ParmEd objects for the whole system
+        restart_format : str
+            Format of the coordinate files: "inpcrd" (ASCII) or "ncrst" (NetCDF, which is faster to read and write
+            and keeps the full precision), written as `smirnoff.inpcrd` or `smirnoff.ncrst`
+        streaming : bool
+            If True, read the reference `prmtop` and `inpcrd` in chunks instead of loading the whole system: only
+            the host and guest are loaded into ParmEd, and the water, ions, and dummy atoms are read straight into
+            templates (`solvent_templates`) or into `water_ions.pdb`. This implies `in_memory`; combine it with
+            `compact` to keep the peak memory bounded for very large boxes
+        persistent_tleap : bool
+            If True, build the water and ion parameters in a `tleap` process that this `Converter` keeps running
+            (see `tleap_worker()`), so the force field files are only sourced by the first conversion
+
+        Returns
+        -------
+        merged : parmed.Structure or smirnovert.compact.CompactSystem
+            The SMIRNOFF99Frosst parameters and coordinates (a `CompactSystem` if `compact` is set)
+        """
+        if profile:
+            with record_profile() as records:
+                with stage("convert"):
+                    merged = self.convert(
+                        source,
+                        destination,
+                        prefix,
+                        reference_prmtop,
+                        reference_inpcrd,
+                        host_resname,
+                        guest_resname,
+                        dummy=dummy,
+                        debug=debug,
+                        in_memory=in_memory,
+                        solvent_templates=solvent_templates,
+                        concurrent=concurrent,
+                        incremental=incremental,
+                        compact=compact,
+                        restart_format=restart_format,
+                        streaming=streaming,
+                        persistent_tleap=persistent_tleap,
+                    )
+            self.profile = records
+            records.to_json(os.path.join(destination, prefix) + ".profile.json")
+            return merged
+
+        if restart_format not in RESTART_FORMATS:
+            raise ValueError(f"Unknown restart format {restart_format}; choose from {sorted(RESTART_FORMATS)}.")
+        restart_extension = RESTART_FORMATS[restart_format]
+        if streaming:
+            in_memory = True
+
+        stamps = os.path.join(destination, ".stamps")
+        if not incremental:
+            clean_up(
+                destination=destination, host_resname=host_resname, guest_resname=guest_resname
+            )
+            shutil.rmtree(stamps, ignore_errors=True)
+            # Outputs of an earlier conversion into this destination must not pass for the results of this one.
+            for name in ("hg", "smirnoff"):
+                for extension in (".prmtop",) + tuple(RESTART_FORMATS.values()):
+                    output = os.path.join(destination, name + extension)
+                    if os.path.exists(output):
+                        os.remove(output)
+        reference_files = [
+            os.path.join(source, reference_prmtop),
+            os.path.join(source, reference_inpcrd),
+        ]
+        solute_resnames = [host_resname.upper(), guest_resname.upper()]
+        if streaming:
+            with stage("load_reference"):
+                reference = read_solute(*reference_files, resnames=solute_resnames)
+            box = InpcrdReader(reference_files[1]).box
+        else:
+            reference = self.load_reference(*reference_files)
+            box = reference.box
+
+        pruned_pdb = os.path.join(destination, prefix) + ".pruned.pdb"
+        if in_memory:
+            components = reference.split()
+        else:
+            write_pdb_with_conect(structure=reference, output_pdb=pruned_pdb)
+            components = split_topology(file_name=pruned_pdb)
+        hg_topology = create_host_guest_topology(
+            components, host_resname=host_resname, guest_resname=guest_resname
+        )
+
+        # Independent stages (e.g., the host and guest `antechamber` runs, or the water and ion parameters)
+        # run concurrently.
+        stages = []
+        scratch = []
+        # Without `in_memory`, the host and guest `mol2` files and the water and ions PDB are written by a single
+        # `cpptraj` run, which only reads the reference once.
+        cpptraj_outputs = []
+        for resname in (host_resname, guest_resname):
+            mol2 = os.path.join(destination, resname) + ".mol2"
+            sybyl_mol2 = os.path.join(destination, resname) + "-sybyl.mol2"
+            if in_memory:
+                # `antechamber` still needs a file, but it can come straight from the reference.
+                mol2_stage = f"{resname}-mol2"
+                stages.append(
+                    Stage(
+                        mol2_stage,
+                        reference[":" + resname.upper()].save,
+                        dict(fname=mol2, overwrite=True),
+                        inputs=reference_files,
+                        outputs=[mol2],
+                    )
+                )
+            else:
+                mol2_stage = "reference-cpptraj"
+                cpptraj_outputs.append((os.path.basename(mol2), f"!:{resname.upper()}"))
+            # Each `antechamber` run gets its own directory for its scratch files.
+            scratch.append(os.path.join(destination, f"antechamber-{resname}"))
+            os.makedirs(scratch[-1], exist_ok=True)
+            stages.append(
+                Stage(
+                    f"{resname}-sybyl",
+                    convert_mol2_to_sybyl_antechamber,
+                    dict(
+                        input_mol2=os.path.abspath(mol2),
+                        output_mol2=os.path.abspath(sybyl_mol2),
+                        ac_doctor=False,
+                        path=scratch[-1],
+                    ),
+                    requires=[mol2_stage],
+                    inputs=[mol2],
+                    outputs=[sybyl_mol2],
+                )
+            )
+
+        solvent_mask = f"!:{host_resname.upper()},{guest_resname.upper()}"
+        water_ions_pdb = os.path.join(destination, "water_ions.pdb")
+        water_ions_pdb_stage = "water-ions-pdb"
+        if solvent_templates:
+
+            def water_and_ions_with_tleap():
+                # The water and ions of models or residues without a template go through `tleap` after all.
+                if streaming:
+                    write_solvent_pdb(
+                        amber_prmtop=reference_files[0],
+                        amber_inpcrd=reference_files[1],
+                        output_pdb=water_ions_pdb,
+                        exclude_resnames=solute_resnames,
+                    )
+                else:
+                    write_pdb_with_conect(structure=reference[solvent_mask], output_pdb=water_ions_pdb)
+                self.water_and_ions_parameters(
+                    persistent_tleap=persistent_tleap,
+                    input_pdb="water_ions.pdb",
+                    output_prmtop="water_ions.prmtop",
+                    output_inpcrd="water_ions.inpcrd",
+                    dummy_atoms=dummy,
+                    path=destination,
+                )
+                return pmd.amber.AmberParm(
+                    os.path.join(destination, "water_ions.prmtop"),
+                    xyz=os.path.join(destination, "water_ions.inpcrd"),
+                )
+
+            if streaming:
+                build = read_solvent_blocks if compact else read_solvent_structure
+                kwargs = dict(
+                    amber_prmtop=reference_files[0],
+                    amber_inpcrd=reference_files[1],
+                    exclude_resnames=solute_resnames,
+                    dummy_atoms=dummy,
+                )
+            else:
+                build = create_water_and_ions_blocks if compact else create_water_and_ions_structure
+                kwargs = dict(structure=reference[solvent_mask], dummy_atoms=dummy)
+            stages.append(
+                Stage(
+                    "water-ions",
+                    water_and_ions_from_templates,
+                    dict(build=build, fallback=water_and_ions_with_tleap, **kwargs),
+                )
+            )
+        else:
+            if streaming:
+                stages.append(
+                    Stage(
+                        "water-ions-pdb",
+                        write_solvent_pdb,
+                        dict(
+                            amber_prmtop=reference_files[0],
+                            amber_inpcrd=reference_files[1],
+                            output_pdb=water_ions_pdb,
+                            exclude_resnames=solute_resnames,
+                        ),
+                        inputs=reference_files,
+                        outputs=[water_ions_pdb],
+                    )
+                )
+            elif in_memory:
+                stages.append(
+                    Stage(
+                        "water-ions-pdb",
+                        write_pdb_with_conect,
+                        dict(
+                            structure=reference[solvent_mask],
+                            output_pdb=water_ions_pdb,
+                        ),
+                        inputs=reference_files,
+                        outputs=[water_ions_pdb],
+                    )
+                )
+            else:
+                water_ions_pdb_stage = "reference-cpptraj"
+                cpptraj_outputs.append(
+                    (
+                        "water_ions.pdb",
+                        water_and_ions_strip_mask(
+                            host_residue=":" + host_resname.upper(),
+                            guest_residue=":" + guest_resname.upper(),
+                        ),
+                    )
+                )
+            stages.append(
+                Stage(
+                    "water-ions",
+                    self.water_and_ions_parameters,
+                    dict(
+                        persistent_tleap=persistent_tleap,
+                        input_pdb="water_ions.pdb",
+                        output_prmtop="water_ions.prmtop",
+                        output_inpcrd="water_ions.inpcrd",
+                        dummy_atoms=dummy,
+                        path=destination,
+                    ),
+                    requires=[water_ions_pdb_stage],
+                    inputs=[water_ions_pdb],
+                    outputs=[
+                        os.path.join(destination, "water_ions.prmtop"),
+                        os.path.join(destination, "water_ions.inpcrd"),
+                    ],
+                )
+            )
+
+        if cpptraj_outputs:
+            stages.append(
+                Stage(
+                    "reference-cpptraj",
+                    extract_with_cpptraj,
+                    dict(
+                        amber_prmtop=reference_files[0],
+                        amber_inpcrd=reference_files[1],
+                        outputs=cpptraj_outputs,
+                        name="cpptraj",
+                        path=destination,
+                    ),
+                    inputs=reference_files,
+                    outputs=[os.path.join(destination, file_name) for file_name, _ in cpptraj_outputs],
+                )
+            )
+
+        try:
+            results = run_stages(
+                stages,
+                workers=None if concurrent else 1,
+                stamps=stamps if incremental else None,
+            )
+        finally:
+            for directory in scratch:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        if solvent_templates:
+            water_and_ions = results["water-ions"]
+        else:
+            water_and_ions = pmd.amber.AmberParm(
+                os.path.join(destination, "water_ions.prmtop"),
+                xyz=os.path.join(destination, "water_ions.inpcrd"),
+            )
+
+        host = load_mol2(
+            filename=os.path.join(destination, host_resname) + "-sybyl.mol2",
+            name=host_resname,
+            add_tripos=True,
+        )
+
+        guest = load_mol2(
+            filename=os.path.join(destination, guest_resname) + "-sybyl.mol2",
+            name=guest_resname,
+            add_tripos=False,
+        )
+
+        check_unique_atom_names(host)
+        check_unique_atom_names(guest)
+        molecules = [host, guest]
+
+        if self.cache is None:
+            with stage("createSystem"):
+                system = self.ff.createSystem(hg_topology.topology, molecules, **SYSTEM_OPTIONS)
+                hg_structure = pmd.openmm.topsystem.load_topology(
+                    hg_topology.topology, system, hg_topology.positions
+                )
+        else:
+            hg_structure = pmd.Structure()
+            for component in components:
+                resname = component[0].residues[0].name
+                if resname == host_resname.upper():
+                    molecule = host
+                elif resname == guest_resname.upper():
+                    molecule = guest
+                else:
+                    continue
+                structure = parameterize_molecule(
+                    self.ff, component[0], molecule, self.cache, forcefield=self.forcefield
+                )
+                # Keep the numeric SMIRNOFF99Frosst atom types unique across the host and guest.
+                offset_numeric_atom_types(structure, len(hg_structure.atoms))
+                hg_structure += structure
+
+        check_bond_lengths(hg_structure, threshold=4)
+
+        if debug or not in_memory:
+            hg_structure.save(os.path.join(destination, "hg.prmtop"), overwrite=incremental)
+            hg_structure.save(os.path.join(destination, "hg" + restart_extension), overwrite=incremental)
+
+        with stage("mergeStructure"):
+            if compact:
+                if not isinstance(water_and_ions, list):
+                    water_and_ions = [SolventBlock(water_and_ions, 1, water_and_ions.coordinates)]
+                merged = CompactSystem(hg_structure, water_and_ions, box=box)
+            else:
+                merged = mergeStructure(hg_structure, water_and_ions)
+                merged.box = box
+        merged.save(os.path.join(destination, "smirnoff.prmtop"), overwrite=incremental)
+        merged.save(os.path.join(destination, "smirnoff" + restart_extension), overwrite=incremental)
+
+        if not debug and not incremental:
+            clean_up(
+                destination=destination,
+                host_resname=host_resname,
+                guest_resname=guest_resname,
+            )
+
+        return merged
+
+    def convert_frames(
+        self,
+        source,
+        destination,
+        reference_prmtop,
+        frames,
+        host_resname,
+        guest_resname,
+        output_names=None,
+        restart_format="inpcrd",
+        **kwargs,
+    ):
+        """
+        Convert a topology once, then write the coordinates of many frames (e.g., one per APR window) for the
+        converted topology. The first frame goes through `convert()`; every frame is then only reordered into
+        the atom order of the converted system (see `frames.atom_order()`) and written as a restart file.
+        Parameters
+        ----------
+        source : str
+            Directory where existing files will be read
+        destination : str
+            Directory where new files will be written
+        reference_prmtop : str
+            Name of existing AMBER parameter file (shared by every frame)
+        frames : str or list
+            Restart files (ASCII or NetCDF), or one `mdcrd` or NetCDF trajectory, in the atom order of
+            `reference_prmtop`
+        host_resname : str
+            Residue name of the host molecule (*not* the mask)
+        guest_resname : str
+            Residue name of the guest molecule (*not* the mask)
+        output_names : list
+            File names of the restart files (in `destination`), one per frame (defaults to `smirnoff.0000.inpcrd`,
+            `smirnoff.0001.inpcrd`, ...)
+        restart_format : str
+            Format of the restart files: "inpcrd" (ASCII) or "ncrst" (NetCDF)
+        kwargs
+            Other keyword arguments of `convert()` (e.g., `dummy`, `in_memory`, or `compact`)
+
+        Returns
+        -------
+        merged : parmed.Structure or smirnovert.compact.CompactSystem
+            The SMIRNOFF99Frosst parameters and the coordinates of the first frame
+        restarts : list
+            The restart files, in the order of the frames
+        """
+        # `convert()` joins `source` to the reference files again, which leaves absolute paths unchanged.
+        reference_prmtop = os.path.abspath(os.path.join(source, reference_prmtop))
+        if isinstance(frames, str):
+            frames = os.path.abspath(os.path.join(source, frames))
+        else:
+            frames = [os.path.abspath(os.path.join(source, frame)) for frame in frames]
+        natom = PrmtopReader(reference_prmtop).pointers["NATOM"]
+        os.makedirs(destination, exist_ok=True)
+        if isinstance(frames, str):
+            reference_inpcrd = os.path.abspath(os.path.join(destination, "reference.inpcrd"))
+            coordinates, box = first_frame(frames, natom)
+            write_inpcrd(reference_inpcrd, coordinates, box=box, overwrite=True)
+        else:
+            reference_inpcrd = frames[0]
+
+        kwargs.setdefault("prefix", "smirnoff")
+        merged = self.convert(
+            source,
+            destination,
+            reference_prmtop=reference_prmtop,
+            reference_inpcrd=reference_inpcrd,
+            host_resname=host_resname,
+            guest_resname=guest_resname,
+            restart_format=restart_format,
+            **kwargs,
+        )
+
+        order = atom_order(reference_prmtop, host_resname, guest_resname)
+        coordinates, _ = first_frame(reference_inpcrd, natom)
+        if not np.allclose(merged.coordinates, coordinates[order], atol=1e-3):
+            raise ValueError("The converted atoms are not in the order of the reference (host, guest, and the rest).")
+
+        logging.info(f"Writing the frames of {frames}...")
+        restarts = []
+        for index, (coordinates, box) in enumerate(read_frames(frames, natom)):
+            if output_names is None:
+                name = f"smirnoff.{index:04d}{RESTART_FORMATS[restart_format]}"
+            elif index < len(output_names):
+                name = output_names[index]
+            else:
+                raise ValueError(f"There are more frames than the {len(output_names)} output names.")
+            restarts.append(os.path.join(destination, name))
+            write_restart(
+                restarts[-1],
+                coordinates[order],
+                box=merged.box if box is None else box,
+                format=restart_format,
+                overwrite=True,
+            )
+        return merged, restarts
 
 
 def convert(
@@ -22,9 +632,20 @@ def convert(
     guest_resname,
     dummy=False,
     debug=False,
+    cache=None,
+    in_memory=False,
+    solvent_templates=False,
+    concurrent=True,
+    incremental=False,
+    profile=False,
+    compact=False,
+    restart_format="inpcrd",
+    streaming=False,
+    persistent_tleap=False,
 ):
     """
-    Convert from an existing parameter set to SMIRNOFF99Frosst.
+    Convert from an existing parameter set to SMIRNOFF99Frosst. This creates a new `Converter` for each call;
+    use a `Converter` directly to convert several systems without reloading the force field.
     Parameters
     ----------
     source : str
@@ -45,155 +666,254 @@ def convert(
         Whether the reference structures include dummy atoms
     debug : bool
         If True, intermediary files will be kept
+    in_memory : bool
+        If True, pass structures between stages in memory and only write the files needed by `antechamber`
+        and `tleap` (plus `hg.prmtop` and `hg.inpcrd` when `debug` is set)
+    solvent_templates : bool
+        If True, parameterize the water, ions, and dummy atoms in-process from templates (TIP3P water and
+        Joung-Cheatham ions) instead of running `tleap`; residues without a template still go through `tleap`
+    concurrent : bool
+        If True, run independent stages (e.g., the host and guest `antechamber` runs) at the same time
+    incremental : bool
+        If True, keep the intermediary files and only repeat the stages whose inputs changed since the last run
+    profile : bool
+        If True, write the wall time, CPU time, peak memory, and I/O of every stage and external program to
+        `destination/prefix.profile.json`
+    compact : bool
+        If True, keep the water and ions as blocks of repeated templates and write `smirnoff.prmtop` and
+        `smirnoff.inpcrd` straight from arrays, without building ParmEd objects for the whole system
+    restart_format : str
+        Format of the coordinate files: "inpcrd" (ASCII) or "ncrst" (NetCDF, which is faster to read and write and
+        keeps the full precision), written as `smirnoff.inpcrd` or `smirnoff.ncrst`
+    streaming : bool
+        If True, read the reference `prmtop` and `inpcrd` in chunks instead of loading the whole system (see
+        `Converter.convert()`)
+    persistent_tleap : bool
+        If True, build the water and ion parameters in a persistent `tleap` process, which is closed when the
+        conversion ends (use a `Converter` to keep it between conversions)
+    cache : str or smirnovert.cache.StructureCache
+        If set, the host and guest are parameterized separately and the results are stored in (and reused
+        from) this on-disk cache
 
     Returns
     -------
-    merged : parmed.Structure
-        A ParmEd structure containing the SMIRNOFF99Frosst parameters and coordinates
-    """
-
-    clean_up(
-        destination=destination, host_resname=host_resname, guest_resname=guest_resname
-    )
-    reference = pmd.load_file(
-        os.path.join(source, reference_prmtop),
-        xyz=os.path.join(source, reference_inpcrd),
-    )
-
-    create_pdb_with_conect(
-        solvated_pdb=os.path.join(source, reference_inpcrd),
-        amber_prmtop=os.path.join(source, reference_prmtop),
-        output_pdb=os.path.join(destination, prefix) + ".pdb",
-    )
-
-    prune_conect(
-        input_pdb=prefix + ".pdb", output_pdb=prefix + ".pruned.pdb", path=destination
-    )
-
-    components = split_topology(
-        file_name=os.path.join(destination, prefix) + ".pruned.pdb"
-    )
-    hg_topology = create_host_guest_topology(
-        components, host_resname=host_resname, guest_resname=guest_resname
-    )
-
-    create_host_mol2(
-        solvated_pdb=os.path.join(destination, prefix) + ".pruned.pdb",
-        amber_prmtop=os.path.join(source, reference_prmtop),
-        mask=host_resname.upper(),
-        output_mol2=os.path.join(destination, host_resname) + ".mol2",
-    )
-
-    create_host_mol2(
-        solvated_pdb=os.path.join(destination, prefix) + ".pdb",
-        amber_prmtop=os.path.join(source, reference_prmtop),
-        mask=guest_resname.upper(),
-        output_mol2=os.path.join(destination, guest_resname) + ".mol2",
-    )
-
-    convert_mol2_to_sybyl_antechamber(
-        input_mol2=os.path.join(destination, host_resname) + ".mol2",
-        output_mol2=os.path.join(destination, host_resname) + "-sybyl.mol2",
-        ac_doctor=False,
-    )
-
-    convert_mol2_to_sybyl_antechamber(
-        input_mol2=os.path.join(destination, guest_resname) + ".mol2",
-        output_mol2=os.path.join(destination, guest_resname) + "-sybyl.mol2",
-        ac_doctor=False,
-    )
-
-    extract_water_and_ions(
-        amber_prmtop=os.path.join(source, reference_prmtop),
-        amber_inpcrd=os.path.join(source, reference_inpcrd),
-        host_residue=":" + host_resname.upper(),
-        guest_residue=":" + guest_resname.upper(),
-        dummy_atoms=True,
-        output_pdb="water_ions.pdb",
-        path=destination,
-    )
-
-    if not dummy:
-        create_water_and_ions_parameters(
-            input_pdb="water_ions.pdb",
-            output_prmtop="water_ions.prmtop",
-            output_inpcrd="water_ions.inpcrd",
-            dummy_atoms=False,
-            path=destination,
+    merged : parmed.Structure or smirnovert.compact.CompactSystem
+        The SMIRNOFF99Frosst parameters and coordinates (a `CompactSystem` if `compact` is set)
+    """
+    converter = Converter(cache=cache)
+    try:
+        return converter.convert(
+            source=source,
+            destination=destination,
+            prefix=prefix,
+            reference_prmtop=reference_prmtop,
+            reference_inpcrd=reference_inpcrd,
+            host_resname=host_resname,
+            guest_resname=guest_resname,
+            dummy=dummy,
+            debug=debug,
+            in_memory=in_memory,
+            solvent_templates=solvent_templates,
+            concurrent=concurrent,
+            incremental=incremental,
+            profile=profile,
+            compact=compact,
+            restart_format=restart_format,
+            streaming=streaming,
+            persistent_tleap=persistent_tleap,
         )
-    else:
-        create_water_and_ions_parameters(
-            input_pdb="water_ions.pdb",
-            output_prmtop="water_ions.prmtop",
-            output_inpcrd="water_ions.inpcrd",
-            dummy_atoms=True,
-            path=destination,
+    finally:
+        converter.close()
+
+
+def water_and_ions_from_templates(build, fallback, **kwargs):
+    """
+    Build the water and ions from templates, or with `tleap` if any residue or model has no template.
+    Parameters
+    ----------
+    build : callable
+        Function that builds the water and ions from templates (e.g., `create_water_and_ions_structure()`),
+        called with `kwargs`
+    fallback : callable
+        Function without arguments that builds the water and ions with `tleap` and returns them as a structure
+
+    Returns
+    -------
+    water_and_ions : parmed.Structure or list of smirnovert.compact.SolventBlock
+        The result of `build`, or of `fallback` if `build` raised `MissingTemplate`
+    """
+    try:
+        return build(**kwargs)
+    except MissingTemplate as error:
+        logging.warning(f"{error} Building the water and ions with tleap...")
+        return fallback()
+
+
+@profiled()
+def parameterize_molecule(ff, component, molecule, cache, forcefield=FORCEFIELD):
+    """
+    Assign SMIRNOFF99Frosst parameters to a single molecule, reusing a cached result when the same molecule
+    has already been parameterized with the same force field and options.
+    Parameters
+    ----------
+    ff : openforcefield.typing.engines.smirnoff.ForceField
+        Force field (loaded from `FORCEFIELD`)
+    component : pmd.Structure
+        Topology and coordinates of the molecule
+    molecule : openeye.oechem.OEMol
+        Molecule used to assign parameters
+    cache : smirnovert.cache.StructureCache
+        Cache of parameterized structures
+    forcefield : str
+        SMIRNOFF `offxml` file that `ff` was loaded from
+
+    Returns
+    -------
+    structure : parmed.Structure
+        A ParmEd structure with the parameters and the coordinates of `component`
+    """
+    key = molecule_key(molecule, component, forcefield, SYSTEM_OPTIONS)
+    structure = cache.get(key)
+    if structure is None:
+        logging.info(f"Parameterizing {molecule.GetTitle()}...")
+        system = ff.createSystem(component.topology, [molecule], **SYSTEM_OPTIONS)
+        structure = pmd.openmm.topsystem.load_topology(
+            component.topology, system, component.positions
         )
+        structure.box = None
+        cache.put(key, structure)
+    else:
+        logging.info(f"Using cached parameters for {molecule.GetTitle()}...")
+        structure.coordinates = component.coordinates
+    return structure
 
-    host = load_mol2(
-        filename=os.path.join(destination, host_resname) + "-sybyl.mol2",
-        name=host_resname,
-        add_tripos=True,
-    )
 
-    guest = load_mol2(
-        filename=os.path.join(destination, guest_resname) + "-sybyl.mol2",
-        name=guest_resname,
-        add_tripos=False,
-    )
+def offset_numeric_atom_types(structure, offset):
+    """
+    Shift the numeric atom types of a structure that was parameterized on its own, so they do not collide
+    with the types of the molecules it is combined with.
+    Parameters
+    ----------
+    structure : parmed.Structure
+        A ParmEd structure with SMIRNOFF99Frosst numeric atom types
+    offset : int
+        Number of atoms (and thus types) that precede this structure
+    """
+    renamed = set()
+    for atom in structure.atoms:
+        if atom.type.isdigit():
+            atom.type = str(int(atom.type) + offset)
+        atom_type = atom.atom_type
+        if isinstance(atom_type, pmd.AtomType) and id(atom_type) not in renamed:
+            renamed.add(id(atom_type))
+            if atom_type.name.isdigit():
+                atom_type.name = str(int(atom_type.name) + offset)
 
-    check_unique_atom_names(host)
-    check_unique_atom_names(guest)
-    molecules = [host, guest]
 
-    ff = ForceField("forcefield/smirnoff99Frosst.offxml")
-    system = ff.createSystem(
-        hg_topology.topology,
-        molecules,
-        nonbondedCutoff=1.1 * unit.nanometer,
-        ewaldErrorTolerance=1e-4,
-    )
+def convert_many(systems, workers=None, scratch=None):
+    """
+    Convert many host-guest systems in parallel, each in its own working directory.
+    `antechamber` and `tleap` drop scratch files (e.g., `ANTECHAMBER_AC.AC`, `leap.log`) into the current
+    directory, so each system is converted in a separate process that first moves into a fresh directory.
+    Parameters
+    ----------
+    systems : list of dict
+        Keyword arguments for `convert()`, one dictionary per system. An optional `name` key labels the
+        system in the results; otherwise the destination is used.
+    workers : int
+        Number of worker processes (defaults to the number of CPUs)
+    scratch : str
+        Directory in which the per-system working directories are created (defaults to the system
+        temporary directory)
 
-    hg_structure = pmd.openmm.topsystem.load_topology(
-        hg_topology.topology, system, hg_topology.positions
-    )
+    Returns
+    -------
+    results : list of dict
+        Name, destination, output files and elapsed time (s) of each converted system, in input order
+    failures : list of dict
+        Name, destination, error and traceback of each system that could not be converted
+    """
+    destinations = [os.path.abspath(system["destination"]) for system in systems]
+    if len(set(destinations)) != len(destinations):
+        raise ValueError("Each system must be converted into its own destination directory.")
 
-    check_bond_lengths(hg_structure, threshold=4)
+    records = [None] * len(systems)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {
+            executor.submit(_convert_in_scratch, system, scratch): index
+            for index, system in enumerate(systems)
+        }
+        for future in as_completed(futures):
+            record = future.result()
+            if record["error"] is None:
+                logging.info(f"Converted {record['name']} in {record['elapsed']:.1f} s.")
+            else:
+                logging.error(f"Failed to convert {record['name']}: {record['error']}")
+            records[futures[future]] = record
 
-    try:
-        hg_structure.save(os.path.join(destination, "hg.prmtop"))
-    except OSError:
-        print("Check if the host-guest parameter file already exists...")
+    results = [record for record in records if record["error"] is None]
+    failures = [record for record in records if record["error"] is not None]
+    return results, failures
 
-    try:
-        hg_structure.save(os.path.join(destination, "hg.inpcrd"))
-    except OSError:
-        print("Check if the host-guest coordinate file already exists...")
 
-    water_and_ions = pmd.amber.AmberParm(
-        os.path.join(destination, "water_ions.prmtop"),
-        xyz=os.path.join(destination, "water_ions.inpcrd"),
-    )
+def _convert_in_scratch(system, scratch=None):
+    """
+    Run `convert()` for a single system from inside a private working directory.
+    This runs in a worker process, so changing the working directory does not affect other systems.
+    Parameters
+    ----------
+    system : dict
+        Keyword arguments for `convert()`, with an optional `name`
+    scratch : str
+        Directory in which the working directory is created
 
-    merged = mergeStructure(hg_structure, water_and_ions)
-    merged.box = reference.box
-    try:
-        merged.save(os.path.join(destination, "smirnoff.prmtop"))
-    except:
-        print("Check if solvated parameter file already exists...")
+    Returns
+    -------
+    record : dict
+        Outcome of the conversion; `error` is None on success
+    """
+    system = dict(system)
+    name = system.pop("name", None) or system["destination"]
+    cache = system.pop("cache", None)
+    system["source"] = os.path.abspath(system["source"])
+    system["destination"] = os.path.abspath(system["destination"])
+    os.makedirs(system["destination"], exist_ok=True)
+
+    record = dict(name=name, destination=system["destination"], error=None)
+    cwd = os.getcwd()
+    work = tempfile.mkdtemp(prefix="smirnovert-", dir=scratch)
+    start = time.time()
     try:
-        merged.save(os.path.join(destination, "smirnoff.inpcrd"))
-    except:
-        print("Check if solvated coordinate file already exists...")
+        os.chdir(work)
+        converter = _worker_converter(cache)
+        converter.convert(**system)
+        if system.get("profile"):
+            record["profile"] = converter.profile.to_dict()
+        record["prmtop"] = os.path.join(system["destination"], "smirnoff.prmtop")
+        restart_extension = RESTART_FORMATS[system.get("restart_format", "inpcrd")]
+        record["inpcrd"] = os.path.join(system["destination"], "smirnoff" + restart_extension)
+    except Exception as error:
+        record["error"] = repr(error)
+        record["traceback"] = traceback.format_exc()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+    record["elapsed"] = time.time() - start
+    return record
 
-    if not debug:
-        clean_up(
-            destination=destination,
-            host_resname=host_resname,
-            guest_resname=guest_resname,
-        )
 
-    return merged
+_worker_converters = dict()
+
+
+def _worker_converter(cache=None):
+    """
+    Return the `Converter` of this worker process, so the force field is only parsed once per worker.
+    """
+    if cache not in _worker_converters:
+        _worker_converters[cache] = Converter(cache=cache)
+        # Worker processes skip `atexit` handlers, so the persistent `tleap` processes are closed on exit here.
+        multiprocessing.util.Finalize(_worker_converters[cache], _worker_converters[cache].close, exitpriority=0)
+    return _worker_converters[cache]
 
 
 def clean_up(destination, host_resname, guest_resname, verbose=False):
@@ -214,8 +934,9 @@ def clean_up(destination, host_resname, guest_resname, verbose=False):
     inpt = glob.glob(os.path.join(destination) + "*.pdb.in")
     outp = glob.glob(os.path.join(destination) + "*.pdb.out")
     host = glob.glob(os.path.join(destination, host_resname) + "*")
+    cpptraj = glob.glob(os.path.join(destination, "cpptraj") + ".*")
     guest = glob.glob(os.path.join(destination, guest_resname) + "*")
-    for file in water + host + guest + inpt + outp:
+    for file in water + host + guest + cpptraj + inpt + outp:
         try:
             if verbose:
                 print(f"Removing {file}...")
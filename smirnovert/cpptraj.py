@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Builds `cpptraj` input scripts that write several files from a single run, so the topology and coordinates are
+only read once. Each file is written by `outtraj` between a `strip` of the atoms it leaves out and an `unstrip`,
+so every file gets exactly the name it was given (`mask ... maskmol2` appends the frame number instead).
+"""
+
+import logging as logging
+import os as os
+import subprocess as sp
+
+# `cpptraj` output formats by file extension.
+FORMATS = {
+    '.pdb': 'pdb',
+    '.mol2': 'mol2',
+    '.rst7': 'restart',
+    '.inpcrd': 'restart',
+    '.ncrst': 'ncrestart'
+}
+
+
+class CpptrajScript(object):
+    """
+    A `cpptraj` script that loads one topology and one set of coordinates and writes any number of files.
+
+    Parameters
+    ----------
+    amber_prmtop : str
+        AMBER (or other) parameters
+    coordinates : str
+        Coordinates for the parameters (e.g., an `inpcrd` or a PDB file)
+    """
+
+    def __init__(self, amber_prmtop, coordinates):
+        self.amber_prmtop = amber_prmtop
+        self.coordinates = coordinates
+        self.outputs = []
+
+    def add(self, file_name, strip=None, format=None, conect=False):
+        """
+        Write the structure to a file, after removing the atoms matching `strip`.
+
+        Parameters
+        ----------
+        file_name : str
+            Output file name (relative to the directory the script runs in)
+        strip : str
+            AMBER mask of the atoms left out of the file (e.g., `!:CB7` to only write the host)
+        format : str
+            `cpptraj` output format (defaults to the format of the extension, see `FORMATS`)
+        conect : bool
+            Whether to write CONECT records (PDB only)
+
+        Returns
+        -------
+        CpptrajScript
+            This script, so calls can be chained
+        """
+        if format is None:
+            extension = os.path.splitext(file_name)[1].lower()
+            if extension not in FORMATS:
+                raise ValueError(
+                    f'No cpptraj format for {file_name}; pass `format`.')
+            format = FORMATS[extension]
+        self.outputs.append((file_name, strip, format, conect))
+        return self
+
+    @property
+    def output_files(self):
+        return [file_name for file_name, _, _, _ in self.outputs]
+
+    def script(self):
+        """
+        The text of the `cpptraj` input.
+        """
+        lines = [
+            f'parm {self.amber_prmtop}', f'trajin {self.coordinates}'
+        ]
+        for file_name, strip, format, conect in self.outputs:
+            outtraj = f'outtraj {file_name} {format}'
+            if conect:
+                outtraj += ' conect'
+            if strip is None:
+                lines.append(outtraj)
+            else:
+                lines += [f'strip {strip}', outtraj, 'unstrip']
+        return '\n'.join(lines) + '\n'
+
+    def run(self, name, path='./'):
+        """
+        Write the script to `name.in` and run it with `cpptraj`, which must be in your PATH. The output of
+        `cpptraj` goes to `name.out`.
+
+        Parameters
+        ----------
+        name : str
+            Base name of the input and output files of `cpptraj`
+        path : str
+            Directory for input and output files
+
+        Returns
+        -------
+        bool
+            Whether `cpptraj` succeeded and wrote every file
+        """
+        cpptraj_input = name + '.in'
+        cpptraj_output = name + '.out'
+        for file_name in self.output_files:
+            if os.path.exists(os.path.join(path, file_name)):
+                os.remove(os.path.join(path, file_name))
+
+        with open(os.path.join(path, cpptraj_input), 'w') as file:
+            file.write(self.script())
+        with open(os.path.join(path, cpptraj_output), 'w') as file:
+            p = sp.Popen(
+                ['cpptraj', '-i', cpptraj_input],
+                cwd=path,
+                stdout=file,
+                stderr=file)
+            output, error = p.communicate()
+        if p.returncode == 0:
+            logging.debug(
+                f'{", ".join(self.output_files)} written by cpptraj.')
+        elif p.returncode == 1:
+            logging.error('Error returned by cpptraj.')
+            logging.error(f'Output: {output}')
+            logging.error(f'Error: {error}')
+            with open(os.path.join(path, cpptraj_output), 'r') as file:
+                for line in file:
+                    logging.error(line.strip())
+        else:
+            logging.error(f'Output: {output}')
+            logging.error(f'Error: {error}')
+
+        missing = [
+            file_name for file_name in self.output_files
+            if not os.path.exists(os.path.join(path, file_name))
+        ]
+        for file_name in missing:
+            logging.error(f'Unable to find {file_name} written by cpptraj...')
+        return p.returncode == 0 and not missing
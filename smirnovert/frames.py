@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Reads the frames of AMBER coordinate files (a list of restart files, or one `mdcrd` or NetCDF trajectory) and
+reorders their atoms for a converted topology, so every window of an APR calculation can reuse one conversion.
+Trajectories are memory-mapped and read one frame at a time.
+"""
+
+import os as os
+
+import numpy as np
+from parmed.amber import NetCDFTraj
+from scipy.io import netcdf_file
+
+from .restart import NETCDF_MAGIC, read_restart
+from .stream import PrmtopReader, residue_table
+
+MDCRD_EXTENSIONS = ('.mdcrd', '.crd', '.x', '.trj')
+NETCDF_EXTENSIONS = ('.nc', '.netcdf', '.ncdf')
+
+
+def atom_order(amber_prmtop, host_resname, guest_resname):
+    """
+    The order in which `convert()` writes the atoms of the reference: the host, then the guest, then everything
+    else (water, ions, and dummy atoms), each in the order of the reference.
+
+    Parameters
+    ----------
+    amber_prmtop : str
+        The reference AMBER parameter file (only the residue sections are read)
+    host_resname : str
+        Residue name of the host molecule
+    guest_resname : str
+        Residue name of the guest molecule
+
+    Returns
+    -------
+    numpy.ndarray
+        Index of the reference atom at each position of the converted structure
+    """
+    names, _, sizes = residue_table(PrmtopReader(amber_prmtop))
+    resnames = np.repeat(np.array(names), sizes)
+    host = resnames == host_resname.upper()
+    guest = resnames == guest_resname.upper()
+    return np.concatenate([
+        np.flatnonzero(host),
+        np.flatnonzero(guest),
+        np.flatnonzero(~(host | guest))
+    ])
+
+
+def _mdcrd_frames(file_name, natom):
+    """
+    Frames of an ASCII trajectory (`10F8.3`, with an optional box line per frame), parsed from a memory map.
+    """
+    # The title line is read from the file, so the memory map is never scanned as a whole.
+    with open(file_name, 'rb') as file:
+        start = len(file.readline())
+    data = np.memmap(file_name, dtype=np.uint8, mode='r')
+    # Every line but the last of a frame holds 10 fields; the line ending is that of the first line.
+    ending = 2 if data[start - 2] == ord('\r') else 1
+    full_lines, rest = divmod(3 * natom, 10)
+    coordinate_bytes = full_lines * (80 + ending) + (8 * rest + ending if rest else 0)
+    # A box line (3 fields) follows the coordinates of each frame, if there is a box.
+    end = start + coordinate_bytes
+    box = len(bytes(data[end:end + 81]).split(b'\n')[0].rstrip(b'\r')) == 24
+    frame_bytes = coordinate_bytes + (24 + ending if box else 0)
+    if (len(data) - start) % frame_bytes:
+        raise ValueError(
+            f'{file_name} does not hold whole frames of {natom} atoms.')
+
+    for offset in range(start, len(data), frame_bytes):
+        frame = bytes(data[offset:offset + frame_bytes]).replace(b'\r', b'')
+        lines = frame.split(b'\n')
+        coordinates = b''.join(line.ljust(80) for line in lines[:-2 if box else -1])
+        coordinates = np.frombuffer(
+            coordinates[:24 * natom], dtype='S8').astype(np.float64)
+        frame_box = None
+        if box:
+            frame_box = np.concatenate([
+                np.frombuffer(lines[-2][:24], dtype='S8').astype(np.float64),
+                [90.0, 90.0, 90.0]
+            ])
+        yield coordinates.reshape(natom, 3), frame_box
+
+
+def _netcdf_frames(file_name):
+    """
+    Frames of an AMBER NetCDF trajectory. NetCDF-3 files are memory-mapped; NetCDF-4 files need `netCDF4`.
+    """
+    with open(file_name, 'rb') as file:
+        netcdf4 = file.read(4).startswith(b'\x89HDF')
+    if netcdf4:
+        trajectory = NetCDFTraj.open_old(file_name)
+        try:
+            for index in range(trajectory.frame):
+                box = trajectory.box[index] if trajectory.hasbox else None
+                yield np.array(trajectory.coordinates[index]), box
+        finally:
+            trajectory.close()
+        return
+    trajectory = netcdf_file(file_name, 'r', mmap=True)
+    try:
+        variables = trajectory.variables
+        # A restart holds a single frame without the frame dimension.
+        coordinates = variables['coordinates'][:]
+        coordinates = coordinates.reshape((-1, ) + coordinates.shape[-2:])
+        boxes = None
+        if 'cell_lengths' in variables:
+            boxes = np.hstack([
+                variables['cell_lengths'][:].reshape(-1, 3),
+                variables['cell_angles'][:].reshape(-1, 3)
+            ])
+        for index in range(len(coordinates)):
+            box = None if boxes is None else boxes[index].astype(np.float64)
+            yield np.array(coordinates[index], dtype=np.float64), box
+    finally:
+        # The memory map can only be closed once nothing refers to it.
+        coordinates = boxes = variables = None
+        trajectory.close()
+
+
+def read_frames(frames, natom):
+    """
+    Read the frames of a list of restart files (ASCII or NetCDF), or of one trajectory (`mdcrd` or NetCDF).
+
+    Parameters
+    ----------
+    frames : str or list
+        A trajectory or restart file, or a list of restart files
+    natom : int
+        Number of atoms
+
+    Yields
+    ------
+    coordinates : numpy.ndarray
+        Coordinates (Å) of each frame, shape `(natom, 3)`
+    box : numpy.ndarray
+        Box lengths and angles of the frame, or None
+    """
+    if isinstance(frames, str):
+        extension = os.path.splitext(frames)[1].lower()
+        with open(frames, 'rb') as file:
+            netcdf = file.read(4).startswith(NETCDF_MAGIC)
+        if extension in MDCRD_EXTENSIONS and not netcdf:
+            yield from _mdcrd_frames(frames, natom)
+            return
+        if extension in NETCDF_EXTENSIONS and netcdf:
+            for coordinates, box in _netcdf_frames(frames):
+                if len(coordinates) != natom:
+                    raise ValueError(
+                        f'{frames} has {len(coordinates)} atoms, not {natom}.')
+                yield coordinates, box
+            return
+        frames = [frames]
+    for file_name in frames:
+        coordinates, box = read_restart(file_name)
+        if len(coordinates) != natom:
+            raise ValueError(
+                f'{file_name} has {len(coordinates)} atoms, not {natom}.')
+        yield coordinates, box
+
+
+def first_frame(frames, natom):
+    """
+    The coordinates and box of the first frame (see `read_frames()`).
+    """
+    for coordinates, box in read_frames(frames, natom):
+        return coordinates, box
+    raise ValueError(f'No frames in {frames}.')
@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+"""
+Provides atom mapping between two versions of the same (solvated) system, one connected component at a time.
+"""
+
+import logging as logging
+from collections import Counter, defaultdict
+
+import networkx as nx
+import numpy as np
+from networkx.algorithms import isomorphism
+
+
+class IndexMap(object):
+    """
+    A mapping between (atom or residue) indices, stored as an `int32` array in which entry `i` is the target
+    index of reference index `i`, or -1 if `i` is not mapped. It can be used like the dictionaries that
+    `map_atoms()` and `map_residues()` used to return (`mapping[i]`, `items()`, ...), but also applies to
+    whole index arrays at once.
+
+    Parameters
+    ----------
+    targets : array_like
+        Target index of each reference index (-1 for unmapped indices)
+    """
+
+    def __init__(self, targets=()):
+        self.targets = np.asarray(targets, dtype=np.int32)
+
+    @classmethod
+    def from_dict(cls, mapping, size=None):
+        """
+        Create a mapping from a dictionary of non-negative integer indices.
+
+        Parameters
+        ----------
+        mapping : dict
+            Target index of each reference index
+        size : int
+            Number of reference indices (defaults to the largest key plus one)
+
+        Returns
+        -------
+        IndexMap
+        """
+        keys = np.fromiter(mapping.keys(), dtype=np.int64, count=len(mapping))
+        values = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+        if size is None:
+            size = int(keys.max()) + 1 if len(keys) else 0
+        targets = np.full(size, -1, dtype=np.int32)
+        targets[keys] = values
+        return cls(targets)
+
+    @classmethod
+    def load(cls, file_name):
+        """
+        Load a mapping saved with `save()`.
+
+        Parameters
+        ----------
+        file_name : str
+            `.npy` file
+        """
+        return cls(np.load(file_name, allow_pickle=False))
+
+    def save(self, file_name):
+        """
+        Save the mapping as a `.npy` file.
+
+        Parameters
+        ----------
+        file_name : str
+            `.npy` file
+        """
+        np.save(file_name, self.targets, allow_pickle=False)
+
+    @property
+    def reference_indices(self):
+        return np.flatnonzero(self.targets >= 0)
+
+    @property
+    def target_indices(self):
+        return self.targets[self.targets >= 0]
+
+    def map(self, indices):
+        """
+        Map an array of reference indices.
+
+        Parameters
+        ----------
+        indices : array_like
+            Reference indices
+
+        Returns
+        -------
+        numpy.ndarray
+            Target indices
+
+        Raises
+        ------
+        KeyError
+            If any of the indices is not mapped
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        outside = (indices < 0) | (indices >= len(self.targets))
+        if outside.any():
+            raise KeyError(int(indices[outside][0]))
+        mapped = self.targets[indices]
+        if (mapped < 0).any():
+            raise KeyError(int(indices[mapped < 0][0]))
+        return mapped
+
+    def inverse(self):
+        """
+        Return the target to reference mapping.
+
+        Raises
+        ------
+        ValueError
+            If two reference indices map to the same target index
+        """
+        self.validate()
+        targets = self.target_indices
+        inverse = np.full(int(targets.max()) + 1 if len(targets) else 0, -1, dtype=np.int32)
+        inverse[targets] = self.reference_indices
+        return IndexMap(inverse)
+
+    def compose(self, other):
+        """
+        Chain two mappings, e.g., reference → intermediate (this mapping) and intermediate → target (`other`).
+
+        Parameters
+        ----------
+        other : IndexMap
+            Mapping applied after this one
+
+        Returns
+        -------
+        IndexMap
+            The reference → target mapping; indices that are lost in either step are unmapped
+        """
+        composed = np.full(len(self.targets), -1, dtype=np.int32)
+        mapped = (self.targets >= 0) & (self.targets < len(other.targets))
+        composed[mapped] = other.targets[self.targets[mapped]]
+        return IndexMap(composed)
+
+    def validate(self, size=None):
+        """
+        Check that no two reference indices map to the same target index. If `size` is given, also check that
+        the mapping is a permutation of `range(size)`, i.e., a bijection with no unmapped indices.
+
+        Parameters
+        ----------
+        size : int
+            Number of atoms (or residues) in both structures
+
+        Raises
+        ------
+        ValueError
+            If the mapping is not one-to-one (or not a permutation)
+        """
+        targets = self.target_indices
+        if len(np.unique(targets)) != len(targets):
+            raise ValueError('Two indices map to the same target index.')
+        if size is not None:
+            if len(self.targets) != size or len(targets) != size:
+                raise ValueError(
+                    f'The mapping covers {len(targets)} of {size} indices.')
+            if len(targets) and (targets.min() < 0 or targets.max() >= size):
+                raise ValueError(f'The mapping has target indices outside of 0-{size - 1}.')
+
+    def to_dict(self):
+        return dict(zip(self.reference_indices.tolist(), self.target_indices.tolist()))
+
+    def __getitem__(self, index):
+        if 0 <= index < len(self.targets) and self.targets[index] >= 0:
+            return int(self.targets[index])
+        raise KeyError(index)
+
+    def get(self, index, default=None):
+        try:
+            return self[index]
+        except KeyError:
+            return default
+
+    def __contains__(self, index):
+        return 0 <= index < len(self.targets) and self.targets[index] >= 0
+
+    def __len__(self):
+        return int(np.count_nonzero(self.targets >= 0))
+
+    def __iter__(self):
+        return iter(self.reference_indices.tolist())
+
+    def keys(self):
+        return self.reference_indices.tolist()
+
+    def values(self):
+        return self.target_indices.tolist()
+
+    def items(self):
+        return zip(self.reference_indices.tolist(), self.target_indices.tolist())
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        if isinstance(other, IndexMap):
+            return self.to_dict() == other.to_dict()
+        return NotImplemented
+
+    def __repr__(self):
+        return f'<IndexMap {len(self)} of {len(self.targets)} indices mapped>'
+
+
+def map_indices(reference_to_target_mapping, indices):
+    """
+    Map an array of reference indices with either an `IndexMap` or a dictionary.
+
+    Parameters
+    ----------
+    reference_to_target_mapping : IndexMap or dict
+        Mapping between reference and target indices
+    indices : array_like
+        Reference indices
+
+    Returns
+    -------
+    numpy.ndarray
+        Target indices
+    """
+    if isinstance(reference_to_target_mapping, IndexMap):
+        return reference_to_target_mapping.map(indices)
+    return np.array([reference_to_target_mapping[index] for index in indices], dtype=np.int64)
+
+
+def create_molecule_graph(mol):
+    """
+    Create a graph of an `OEMol`, with atom indices as nodes and the atomic number as a node attribute.
+
+    Parameters
+    ----------
+    mol : openeye.oechem.OEMol
+        Molecule (or whole system)
+
+    Returns
+    -------
+    networkx.Graph
+    """
+    graph = nx.Graph()
+    for atom in mol.GetAtoms():
+        graph.add_node(atom.GetIdx(), element=atom.GetAtomicNum())
+    for bond in mol.GetBonds():
+        graph.add_edge(bond.GetBgnIdx(), bond.GetEndIdx())
+    return graph
+
+
+def split_components(graph):
+    """
+    Split a graph into connected components, ordered by their lowest atom index (i.e., by residue order).
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        Molecular graph
+
+    Returns
+    -------
+    list of list
+        Sorted atom indices of each component
+    """
+    components = [sorted(nodes) for nodes in nx.connected_components(graph)]
+    return sorted(components, key=lambda nodes: nodes[0])
+
+
+def component_invariant(graph, elements, nodes):
+    """
+    Hash a connected component by the multiset of (element, degree, ring membership, neighbor elements)
+    labels of its atoms. Isomorphic components always have the same invariant.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        Molecular graph
+    elements : dict
+        Atomic number of each atom index
+    nodes : list
+        Atom indices of the component
+
+    Returns
+    -------
+    tuple
+        Hashable invariant
+    """
+    subgraph = graph.subgraph(nodes)
+    ring_atoms = set()
+    if subgraph.number_of_edges() >= subgraph.number_of_nodes():
+        for cycle in nx.cycle_basis(subgraph):
+            ring_atoms.update(cycle)
+    labels = Counter()
+    for node in nodes:
+        neighbors = tuple(sorted(elements[neighbor] for neighbor in graph[node]))
+        labels[(elements[node], len(neighbors), node in ring_atoms, neighbors)] += 1
+    return (len(nodes), subgraph.number_of_edges(), tuple(sorted(labels.items())))
+
+
+def component_signature(graph, elements, nodes):
+    """
+    Describe a component by the elements and bonds of its atoms in index order. Two components with the
+    same signature are identical up to an offset, so an atom mapping found for one applies to the other.
+
+    Parameters
+    ----------
+    graph : networkx.Graph
+        Molecular graph
+    elements : dict
+        Atomic number of each atom index
+    nodes : list
+        Sorted atom indices of the component
+
+    Returns
+    -------
+    tuple
+        Hashable signature
+    """
+    position = {node: index for index, node in enumerate(nodes)}
+    bonds = tuple(sorted(
+        tuple(sorted((position[u], position[v]))) for u, v in graph.subgraph(nodes).edges()))
+    return tuple(elements[node] for node in nodes), bonds
+
+
+def match_component(reference_graph, reference_nodes, target_graph, target_nodes):
+    """
+    Map the atoms of two components with VF2, matching elements.
+
+    Parameters
+    ----------
+    reference_graph : networkx.Graph
+        Molecular graph of the reference system
+    reference_nodes : list
+        Atom indices of the reference component
+    target_graph : networkx.Graph
+        Molecular graph of the target system
+    target_nodes : list
+        Atom indices of the target component
+
+    Returns
+    -------
+    dict or None
+        Mapping between reference and target atom indices, or None if the components are not isomorphic
+    """
+    matcher = isomorphism.GraphMatcher(
+        reference_graph.subgraph(reference_nodes),
+        target_graph.subgraph(target_nodes),
+        node_match=isomorphism.categorical_node_match('element', None))
+    if not matcher.is_isomorphic():
+        return None
+    return dict(matcher.mapping)
+
+
+def map_atoms_by_component(reference_mol, target_mol):
+    """
+    Map atoms between a reference and a target system without running a graph isomorphism search over the
+    whole system. Both systems are split into connected components, which are bucketed by
+    `component_invariant()`. Components in each bucket are paired in residue order; VF2 runs once per
+    distinct component layout (e.g., once for all the waters) and on the host and guest.
+
+    Parameters
+    ----------
+    reference_mol : openeye.oechem.OEMol
+        Reference system
+    target_mol : openeye.oechem.OEMol
+        Target system
+
+    Returns
+    -------
+    IndexMap
+        The mapping between atom numbers in each system (empty if the systems differ)
+    """
+    reference_graph = create_molecule_graph(reference_mol)
+    target_graph = create_molecule_graph(target_mol)
+    reference_elements = nx.get_node_attributes(reference_graph, 'element')
+    target_elements = nx.get_node_attributes(target_graph, 'element')
+
+    reference_buckets = defaultdict(list)
+    for nodes in split_components(reference_graph):
+        invariant = component_invariant(reference_graph, reference_elements, nodes)
+        reference_buckets[invariant].append(nodes)
+    target_buckets = defaultdict(list)
+    for nodes in split_components(target_graph):
+        invariant = component_invariant(target_graph, target_elements, nodes)
+        target_buckets[invariant].append(nodes)
+
+    if {key: len(value) for key, value in reference_buckets.items()} != \
+            {key: len(value) for key, value in target_buckets.items()}:
+        logging.error('Graph is not isomorphic.')
+        return IndexMap()
+
+    reference_to_target_mapping = np.full(reference_mol.GetMaxAtomIdx(), -1, dtype=np.int32)
+    for invariant, reference_components in reference_buckets.items():
+        templates = dict()
+        for reference_nodes, target_nodes in zip(reference_components, target_buckets[invariant]):
+            signatures = (
+                component_signature(reference_graph, reference_elements, reference_nodes),
+                component_signature(target_graph, target_elements, target_nodes))
+            if signatures not in templates:
+                mapping = match_component(reference_graph, reference_nodes, target_graph,
+                                          target_nodes)
+                if mapping is None:
+                    logging.error('Graph is not isomorphic.')
+                    return IndexMap()
+                reference_position = {node: index for index, node in enumerate(reference_nodes)}
+                target_position = {node: index for index, node in enumerate(target_nodes)}
+                templates[signatures] = (
+                    np.array([reference_position[atom] for atom in mapping.keys()], dtype=np.int64),
+                    np.array([target_position[atom] for atom in mapping.values()], dtype=np.int64))
+            reference_positions, target_positions = templates[signatures]
+            reference_to_target_mapping[np.asarray(reference_nodes)[reference_positions]] = \
+                np.asarray(target_nodes)[target_positions]
+    return IndexMap(reference_to_target_mapping)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+Provides a parser for AMBER atom masks (e.g., `:1-3 | :10@C4`, `(:WAT & !@H=) | @1200-1210`) and
+translates the residue and atom numbers in them to a new numbering. Names, types, elements, wildcards, and
+distance cutoffs are left unchanged.
+"""
+
+import functools as functools
+import logging as logging
+import re as re
+
+import numpy as np
+
+from .mapping import map_indices
+
+MASK_TOKENS = re.compile(
+    r'''
+    (?P<space>\s+)
+    |(?P<operator>[&|!()])
+    |(?P<distance>[<>][:@^]\s*(?:\d+\.?\d*|\.\d+))
+    |(?P<selector>[:@^][^\s&|!()<>]*)
+    |(?P<all>\*)
+    ''', re.VERBOSE)
+
+NUMBER = re.compile(r'\d+$')
+RANGE = re.compile(r'(\d+)-(\d+)$')
+
+
+def _parse_list(text):
+    """
+    Split a comma-separated selection list into `number`, `range`, and `name` items.
+    """
+    items = []
+    for item in text.split(','):
+        if NUMBER.match(item):
+            items.append(('number', int(item)))
+        elif RANGE.match(item):
+            first, last = (int(number) for number in RANGE.match(item).groups())
+            if last < first:
+                raise ValueError(f'Decreasing range `{item}` in mask.')
+            items.append(('range', (first, last)))
+        elif item:
+            items.append(('name', item))
+        else:
+            raise ValueError(f'Empty item in selection list `{text}`.')
+    return tuple(items)
+
+
+def _parse_selector(text):
+    if text.startswith(':'):
+        residues, separator, atoms = text[1:].partition('@')
+        return ('residues', _parse_list(residues),
+                _parse_atoms(atoms) if separator else None)
+    if text.startswith('@'):
+        return ('atoms', _parse_atoms(text[1:]))
+    return ('molecules', text)
+
+
+def _parse_atoms(text):
+    # Atom types (`@%CT`) and elements (`@/N`) are never renumbered.
+    if text.startswith(('%', '/')):
+        return (('name', text), )
+    return _parse_list(text)
+
+
+def _check_syntax(tokens, mask):
+    operand = True
+    depth = 0
+    for kind, text in ((token[0], token[-1]) for token in tokens):
+        if kind == 'space':
+            continue
+        if operand:
+            if kind in ('residues', 'atoms', 'molecules', 'all'):
+                operand = False
+            elif kind == 'operator' and text == '(':
+                depth += 1
+            elif not (kind == 'operator' and text == '!'):
+                raise ValueError(f'Expected a selection at `{text}` in mask `{mask}`.')
+        elif kind == 'operator' and text in '&|':
+            operand = True
+        elif kind == 'operator' and text == ')':
+            depth -= 1
+            if depth < 0:
+                raise ValueError(f'Unbalanced parentheses in mask `{mask}`.')
+        elif kind != 'distance':
+            raise ValueError(f'Expected an operator at `{text}` in mask `{mask}`.')
+    if operand or depth:
+        raise ValueError(f'Incomplete mask `{mask}`.')
+
+
+@functools.lru_cache(maxsize=None)
+def parse_mask(mask):
+    """
+    Parse an AMBER mask. Masks are cached, so the same mask in many input files (or windows) is parsed
+    once.
+
+    Parameters
+    ----------
+    mask : str
+        AMBER mask (without quotes)
+
+    Returns
+    -------
+    tuple
+        Tokens: `('residues', items, atom items or None)`, `('atoms', items)`, `('molecules', text)`, and
+        `(kind, text)` for `operator`, `distance`, `all`, and `space`, where the items are `('number', n)`,
+        `('range', (first, last))`, or `('name', text)`
+    """
+    tokens = []
+    position = 0
+    while position < len(mask):
+        match = MASK_TOKENS.match(mask, position)
+        if match is None:
+            raise ValueError(
+                f'Cannot parse `{mask[position:]}` in mask `{mask}`.')
+        if match.lastgroup == 'selector':
+            tokens.append(_parse_selector(match.group()) + (match.group(), ))
+        else:
+            tokens.append((match.lastgroup, match.group()))
+        position = match.end()
+    if any(token[0] != 'space' for token in tokens):
+        _check_syntax(tokens, mask)
+    return tuple(tokens)
+
+
+def _format_numbers(numbers):
+    """
+    Write numbers as a comma-separated list, joining consecutive numbers into ranges.
+    """
+    numbers = np.unique(numbers)
+    breaks = np.flatnonzero(np.diff(numbers) != 1) + 1
+    runs = []
+    for run in np.split(numbers, breaks):
+        runs.append(f'{run[0]}' if len(run) == 1 else f'{run[0]}-{run[-1]}')
+    return ','.join(runs)
+
+
+def _translate_list(items, renumber):
+    translated = []
+    for kind, value in items:
+        if kind == 'name':
+            translated.append(value)
+        elif kind == 'number':
+            translated.append(_format_numbers(renumber(np.array([value]))))
+        else:
+            translated.append(
+                _format_numbers(renumber(np.arange(value[0], value[1] + 1))))
+    return ','.join(translated)
+
+
+def translate_mask(mask, residue_mapping=None, atom_mapping=None):
+    """
+    Rewrite the residue and atom numbers of an AMBER mask for a new structure. A residue range is mapped
+    residue by residue, so it may become several ranges if the residues are no longer consecutive.
+
+    Parameters
+    ----------
+    mask : str
+        AMBER mask (without quotes)
+    residue_mapping : IndexMap or dict
+        Mapping between residue numbers in the reference and target structures (needed if the mask selects
+        residues by number)
+    atom_mapping : IndexMap or dict
+        Mapping between (0-based) atom indices in the reference and target structures (needed if the mask
+        selects atoms by number)
+
+    Returns
+    -------
+    str
+        The mask with target residue and atom numbers
+    """
+
+    def residues(numbers):
+        if residue_mapping is None:
+            raise ValueError(
+                f'Mask `{mask}` selects residues by number, which needs a residue mapping.'
+            )
+        try:
+            return map_indices(residue_mapping, numbers)
+        except KeyError:
+            raise ValueError(
+                f'Mask `{mask}` selects residues that are not in the residue mapping.'
+            )
+
+    def atoms(numbers):
+        if atom_mapping is None:
+            raise ValueError(
+                f'Mask `{mask}` selects atoms by number, which needs an atom mapping.'
+            )
+        try:
+            return map_indices(atom_mapping, numbers - 1) + 1
+        except KeyError:
+            raise ValueError(
+                f'Mask `{mask}` selects atoms that are not in the atom mapping.')
+
+    translated = []
+    for token in parse_mask(mask):
+        kind = token[0]
+        if kind == 'residues':
+            text = ':' + _translate_list(token[1], residues)
+            if token[2] is not None:
+                text += '@' + _translate_list(token[2], atoms)
+        elif kind == 'atoms':
+            text = '@' + _translate_list(token[1], atoms)
+        elif kind == 'molecules':
+            logging.warning(
+                f'Molecule numbers are not renumbered; check `{token[1]}` in mask `{mask}`.'
+            )
+            text = token[1]
+        else:
+            text = token[1]
+        translated.append(text)
+    return ''.join(translated)
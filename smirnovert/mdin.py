@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Rewrites the atom masks of AMBER simulation input files (`mdin`) for a new atom and residue numbering, for
+one file or the input files of every APR window in a directory tree.
+"""
+
+import logging as logging
+import re as re
+
+from .masks import translate_mask
+from .restraints import rewrite_tree, stream_namelists, tokenize
+
+# Namelist keys (in `&cntrl`, `&ewald`, etc.) whose value is an AMBER mask.
+MASK_KEYS = {
+    'restraintmask', 'bellymask', 'timask1', 'timask2', 'scmask1', 'scmask2',
+    'noshakemask', 'crgmask', 'tgtfitmask', 'tgtrmsmask', 'noeexpmask'
+}
+
+MDIN_PATTERNS = ('mini.in', 'therm*.in', 'eqnpt.in', 'mdin')
+
+
+def rewrite_mdin_text(text, residue_mapping, atom_mapping=None):
+    """
+    Rewrite every mask-valued key (see `MASK_KEYS`) of the namelists in an input file. Everything else is
+    copied verbatim.
+
+    Parameters
+    ----------
+    text : str
+        Contents of an AMBER input file (or a part of it that ends outside of a namelist group)
+    residue_mapping : IndexMap or dict
+        Mapping between residue numbers in the reference and target structures
+    atom_mapping : IndexMap or dict
+        Mapping between (0-based) atom indices, needed only if a mask selects atoms by number
+
+    Returns
+    -------
+    str
+        The rewritten contents
+    """
+    output = []
+    key = None
+    for kind, token in tokenize(text):
+        if kind == 'key':
+            key = re.sub(r'[\s=(].*', '', token, flags=re.DOTALL).lower()
+        elif kind == 'string' and key in MASK_KEYS:
+            mask = translate_mask(token[1:-1], residue_mapping, atom_mapping)
+            logging.debug(f'{key}: {token[1:-1]} → {mask}')
+            token = token[0] + mask + token[-1]
+        elif kind != 'space':
+            key = None
+        output.append(token)
+    return ''.join(output)
+
+
+def rewrite_mdin(reference_input,
+                 target_input,
+                 residue_mapping,
+                 atom_mapping=None):
+    """
+    Rewrite the masks of an AMBER input file. The file is streamed one namelist group at a time, and
+    `target_input` is only written once every mask is translated (see `restraints.stream_namelists()`).
+
+    Parameters
+    ----------
+    reference_input : str
+        File name of the reference input file
+    target_input : str
+        File name of the target input file
+    residue_mapping : IndexMap or dict
+        Mapping between residue numbers in the reference and target structures
+    atom_mapping : IndexMap or dict
+        Mapping between (0-based) atom indices, needed only if a mask selects atoms by number
+    """
+    stream_namelists(
+        reference_input, target_input,
+        lambda text: rewrite_mdin_text(text, residue_mapping, atom_mapping))
+
+
+def rewrite_mdin_tree(reference_root,
+                      target_root,
+                      residue_mapping,
+                      atom_mapping=None,
+                      patterns=MDIN_PATTERNS,
+                      workers=None):
+    """
+    Rewrite the masks of every AMBER input file in a directory tree (e.g., `mini.in`, `therm1.in`, ...,
+    `mdin` in each APR window), writing each to the same relative path under `target_root`. Files are
+    processed in parallel.
+
+    Parameters
+    ----------
+    reference_root : str
+        Top directory of the reference windows
+    target_root : str
+        Top directory of the target windows
+    residue_mapping : IndexMap or dict
+        Mapping between residue numbers in the reference and target structures
+    atom_mapping : IndexMap or dict
+        Mapping between (0-based) atom indices, needed only if a mask selects atoms by number
+    patterns : list
+        Shell-style patterns of the input file names
+    workers : int
+        Number of worker processes (`1` rewrites the files one after another)
+
+    Returns
+    -------
+    list
+        The rewritten files
+    """
+    return rewrite_tree(reference_root, target_root, patterns, rewrite_mdin,
+                        (residue_mapping, atom_mapping), workers)
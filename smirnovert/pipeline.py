@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+Provides a small dependency-graph scheduler for the stages of a conversion.
+"""
+
+import asyncio as asyncio
+import contextvars as contextvars
+import functools as functools
+import hashlib as hashlib
+import json as json
+import logging as logging
+import os as os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Stage(object):
+    """
+    A single step of the conversion, e.g., one `cpptraj`, `antechamber`, or `tleap` run.
+
+    Parameters
+    ----------
+    name : str
+        Unique name of the stage
+    function : callable
+        Function that performs the stage
+    kwargs : dict
+        Keyword arguments for `function`
+    requires : list
+        Names of the stages that must finish before this one starts
+    inputs : list
+        Files read by the stage, including any that are passed in memory (e.g., the reference `prmtop` a slice
+        was taken from)
+    outputs : list
+        Files written by the stage; stages without outputs always run
+    """
+
+    def __init__(self, name, function, kwargs=None, requires=(), inputs=(), outputs=()):
+        self.name = name
+        self.function = function
+        self.kwargs = kwargs or dict()
+        self.requires = list(requires)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+    def __repr__(self):
+        return f'<Stage {self.name}; requires={self.requires}>'
+
+
+def sort_stages(stages):
+    """
+    Order stages so that every stage comes after the stages it requires.
+
+    Parameters
+    ----------
+    stages : list of Stage
+        Stages of the pipeline
+
+    Returns
+    -------
+    list of Stage
+        The stages, in dependency order
+    """
+    by_name = {stage.name: stage for stage in stages}
+    if len(by_name) != len(stages):
+        raise ValueError('Stage names must be unique.')
+    for stage in stages:
+        for requirement in stage.requires:
+            if requirement not in by_name:
+                raise ValueError(
+                    f'Stage {stage.name} requires unknown stage {requirement}.')
+
+    ordered = []
+    state = dict()
+
+    def visit(stage):
+        if state.get(stage.name) == 'done':
+            return
+        if state.get(stage.name) == 'visiting':
+            raise ValueError(f'Stage {stage.name} is part of a dependency cycle.')
+        state[stage.name] = 'visiting'
+        for requirement in stage.requires:
+            visit(by_name[requirement])
+        state[stage.name] = 'done'
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
+
+
+def stage_key(stage):
+    """
+    Hash the function, options, and input file contents of a stage. Only plain keyword arguments (strings,
+    numbers, and lists of them) are part of the key; objects passed in memory must be covered by `inputs`.
+
+    Parameters
+    ----------
+    stage : Stage
+        Stage of the pipeline
+
+    Returns
+    -------
+    str
+        Hexadecimal key
+    """
+    digest = hashlib.sha256()
+    function = stage.function
+    digest.update(
+        getattr(function, '__qualname__', getattr(function, '__name__',
+                                                  repr(function))).encode())
+    options = {
+        key: value
+        for key, value in stage.kwargs.items()
+        if _is_plain(value)
+    }
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    for file_name in stage.inputs:
+        digest.update(file_name.encode())
+        with open(file_name, 'rb') as file:
+            for block in iter(lambda: file.read(2**20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def _is_plain(value):
+    if isinstance(value, (list, tuple)):
+        return all(_is_plain(item) for item in value)
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+def run_stage(stage, stamps=None):
+    """
+    Run a single stage. If `stamps` is set, the stage is skipped when its key matches the one recorded the last
+    time it ran and all of its outputs still exist; otherwise the new key is recorded after it runs. Because
+    the key covers the contents of the input files, a stage whose upstream stage was re-run but produced the
+    same files is still skipped.
+
+    Parameters
+    ----------
+    stage : Stage
+        Stage of the pipeline
+    stamps : str
+        Directory of the recorded stage keys
+
+    Returns
+    -------
+    object
+        The return value of the stage function, or None if the stage was skipped
+    """
+    if stamps is None or not stage.outputs:
+        return stage.function(**stage.kwargs)
+
+    stamp = os.path.join(stamps, stage.name + '.json')
+    key = stage_key(stage)
+    try:
+        with open(stamp, 'r') as file:
+            previous = json.load(file).get('key')
+    except (OSError, ValueError):
+        previous = None
+    if previous == key and all(os.path.exists(output) for output in stage.outputs):
+        logging.info(f'Skipping stage {stage.name}; its inputs have not changed.')
+        return None
+
+    result = stage.function(**stage.kwargs)
+    os.makedirs(stamps, exist_ok=True)
+    with open(stamp + '.tmp', 'w') as file:
+        json.dump(dict(key=key, outputs=stage.outputs), file)
+    os.replace(stamp + '.tmp', stamp)
+    return result
+
+
+def run_stages(stages, workers=None, stamps=None):
+    """
+    Run the stages of a pipeline. Each stage starts as soon as the stages it requires have finished, so
+    independent stages (e.g., the host and guest `antechamber` runs) run concurrently. The stages wrap
+    external programs, so they run on a thread pool driven by an `asyncio` event loop while the programs
+    do the work.
+
+    Parameters
+    ----------
+    stages : list of Stage
+        Stages of the pipeline
+    workers : int
+        Maximum number of stages that run at once (`1` runs the stages one after another)
+    stamps : str
+        If set, skip stages whose inputs have not changed since they last ran (see `run_stage()`)
+
+    Returns
+    -------
+    dict
+        The return value of each stage, by name
+    """
+    ordered = sort_stages(stages)
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers=workers or max(len(stages), 1))
+    try:
+        return loop.run_until_complete(_run_stages(ordered, loop, executor, stamps))
+    finally:
+        executor.shutdown(wait=True)
+        loop.close()
+
+
+async def _run_stages(ordered, loop, executor, stamps):
+    tasks = dict()
+
+    async def run(stage):
+        for requirement in stage.requires:
+            await tasks[requirement]
+        logging.debug(f'Starting stage {stage.name}...')
+        # The stage runs in the context of the pipeline, so profiled stages know what encloses them.
+        result = await loop.run_in_executor(
+            executor,
+            functools.partial(contextvars.copy_context().run, run_stage, stage,
+                              stamps))
+        logging.debug(f'Finished stage {stage.name}.')
+        return result
+
+    for stage in ordered:
+        tasks[stage.name] = loop.create_task(run(stage))
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        raise
+    return {name: task.result() for name, task in tasks.items()}
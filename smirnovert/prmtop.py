@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+"""
+Merges AMBER topologies section by section and writes `prmtop` files straight from NumPy arrays,
+so a solvated system never has to exist as ParmEd atom, bond, and angle objects. A block that is repeated (e.g.,
+one water molecule times the number of waters) is stored once and tiled when the sections are merged.
+"""
+
+import datetime as datetime
+import os as os
+
+import numpy as np
+import parmed as pmd
+from parmed.amber import FortranFormat
+from parmed.constants import AMBER_ELECTROSTATIC
+from parmed.residue import SOLVENT_NAMES
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+POINTERS = [
+    'NATOM', 'NTYPES', 'NBONH', 'MBONA', 'NTHETH', 'MTHETA', 'NPHIH', 'MPHIA',
+    'NHPARM', 'NPARM', 'NNB', 'NRES', 'NBONA', 'NTHETA', 'NPHIA', 'NUMBND',
+    'NUMANG', 'NPTRA', 'NATYP', 'NPHB', 'IFPERT', 'NBPER', 'NGPER', 'NDPER',
+    'MBPER', 'MGPER', 'MDPER', 'IFBOX', 'NMXRS', 'IFCAP', 'NUMEXTRA'
+]
+
+# Sections with one value per atom.
+ATOM_SECTIONS = [
+    'ATOM_NAME', 'CHARGE', 'ATOMIC_NUMBER', 'MASS', 'ATOM_TYPE_INDEX',
+    'NUMBER_EXCLUDED_ATOMS', 'AMBER_ATOM_TYPE', 'TREE_CHAIN_CLASSIFICATION',
+    'JOIN_ARRAY', 'IROTAT', 'RADII', 'SCREEN'
+]
+
+# Parameter tables, which are stored once per block however many copies it has, and the pointer that counts
+# their entries.
+PARAMETER_SECTIONS = {
+    'BOND_FORCE_CONSTANT': 'NUMBND',
+    'BOND_EQUIL_VALUE': 'NUMBND',
+    'ANGLE_FORCE_CONSTANT': 'NUMANG',
+    'ANGLE_EQUIL_VALUE': 'NUMANG',
+    'DIHEDRAL_FORCE_CONSTANT': 'NPTRA',
+    'DIHEDRAL_PERIODICITY': 'NPTRA',
+    'DIHEDRAL_PHASE': 'NPTRA',
+    'SCEE_SCALE_FACTOR': 'NPTRA',
+    'SCNB_SCALE_FACTOR': 'NPTRA',
+}
+
+# Bonded terms: entries per term (atoms, then the parameter index), the pointer that counts the parameters,
+# and the pointer that counts the terms.
+TERM_SECTIONS = {
+    'BONDS_INC_HYDROGEN': (3, 'NUMBND', 'NBONH'),
+    'BONDS_WITHOUT_HYDROGEN': (3, 'NUMBND', 'MBONA'),
+    'ANGLES_INC_HYDROGEN': (4, 'NUMANG', 'NTHETH'),
+    'ANGLES_WITHOUT_HYDROGEN': (4, 'NUMANG', 'MTHETA'),
+    'DIHEDRALS_INC_HYDROGEN': (5, 'NPTRA', 'NPHIH'),
+    'DIHEDRALS_WITHOUT_HYDROGEN': (5, 'NPTRA', 'MPHIA'),
+}
+
+# Sections that are rebuilt for the merged system.
+MERGED_SECTIONS = {
+    'TITLE', 'POINTERS', 'NONBONDED_PARM_INDEX', 'RESIDUE_LABEL',
+    'RESIDUE_POINTER', 'LENNARD_JONES_ACOEF', 'LENNARD_JONES_BCOEF',
+    'EXCLUDED_ATOMS_LIST', 'HBOND_ACOEF', 'HBOND_BCOEF', 'HBCUT', 'RADIUS_SET',
+    'IPOL', 'SOLTY', 'SOLVENT_POINTERS', 'ATOMS_PER_MOLECULE', 'BOX_DIMENSIONS'
+}
+
+TRUNCATED_OCTAHEDRON_ANGLE = 109.4712206
+
+
+def amber_parm(structure):
+    """
+    Return `structure` as an `AmberParm` (ParmEd builds the `prmtop` sections of other structures).
+
+    Parameters
+    ----------
+    structure : pmd.Structure or pmd.amber.AmberParm
+        A parameterized structure
+
+    Returns
+    -------
+    pmd.amber.AmberParm
+    """
+    if isinstance(structure, pmd.amber.AmberParm):
+        return structure
+    return pmd.amber.AmberParm.from_structure(structure)
+
+
+def molecule_sizes(parm):
+    """
+    Find the molecules (bonded clusters) of a topology from its bond sections.
+
+    Parameters
+    ----------
+    parm : pmd.amber.AmberParm
+        Topology
+
+    Returns
+    -------
+    numpy.ndarray
+        Number of atoms in each molecule, in order
+    """
+    natom = parm.parm_data['POINTERS'][0]
+    pairs = np.concatenate([
+        np.asarray(parm.parm_data[flag], dtype=np.int64).reshape(-1, 3)[:, :2] // 3
+        for flag in ('BONDS_INC_HYDROGEN', 'BONDS_WITHOUT_HYDROGEN')
+    ])
+    graph = coo_matrix(
+        (np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(natom, natom))
+    _, labels = connected_components(graph, directed=False)
+    # Components are labeled in the order of their first atom, so contiguous molecules never decrease.
+    if np.any(np.diff(labels) < 0):
+        raise ValueError('The atoms of each molecule must be contiguous.')
+    return np.bincount(labels)
+
+
+def _check(parm, flags):
+    pointers = dict(zip(POINTERS, parm.parm_data['POINTERS']))
+    if pointers['IFPERT'] or pointers['NPHB']:
+        raise ValueError(
+            'Perturbed topologies and 10-12 hydrogen bond terms cannot be merged.'
+        )
+    if len(parm.parm_data['POINTERS']) > len(POINTERS) and parm.parm_data[
+            'POINTERS'][len(POINTERS)] > 1:
+        raise ValueError('Topologies with alternate locations cannot be merged.')
+    unknown = set(parm.flag_list) - set(ATOM_SECTIONS) - set(
+        PARAMETER_SECTIONS) - set(TERM_SECTIONS) - MERGED_SECTIONS
+    if unknown:
+        raise ValueError(f'Cannot merge the {sorted(unknown)} sections.')
+    if flags is not None and set(flags) - MERGED_SECTIONS != set(
+            parm.flag_list) - MERGED_SECTIONS:
+        raise ValueError('The topologies do not have the same sections.')
+    return pointers
+
+
+def _lennard_jones(parm):
+    """
+    The A and B coefficients of every pair of atom types, as full matrices.
+    """
+    ntypes = parm.parm_data['POINTERS'][1]
+    index = np.asarray(
+        parm.parm_data['NONBONDED_PARM_INDEX'], dtype=np.int64).reshape(
+            ntypes, ntypes) - 1
+    return (np.asarray(parm.parm_data['LENNARD_JONES_ACOEF'])[index],
+            np.asarray(parm.parm_data['LENNARD_JONES_BCOEF'])[index])
+
+
+def merge_topologies(blocks, box=None, title=''):
+    """
+    Merge topologies at the level of their `prmtop` sections. Atom, residue, and bonded term sections are tiled
+    for the copies of each block with array operations; parameter tables are stored once per template, however
+    many blocks use it. The Lennard-Jones tables of each template are kept (including any NBFIX terms), and the
+    pairs of types from different templates use the Lorentz-Berthelot combining rules. The molecule sections are
+    recomputed from the bonds.
+
+    Parameters
+    ----------
+    blocks : list of tuple
+        `(parm, count)` for each block, where `parm` is a `pmd.amber.AmberParm` (or a `pmd.Structure` with
+        parameters) and `count` the number of consecutive copies; blocks with the same `parm` object share
+        its parameters
+    box : array_like
+        Box lengths and angles (no box sections are written if None)
+    title : str
+        Title of the topology
+
+    Returns
+    -------
+    list of tuple
+        `(flag, format, values)` of each section, in `prmtop` order
+    """
+    flags = None
+    formats = dict()
+    sections = {flag: [] for flag in ATOM_SECTIONS}
+    sections.update({flag: [] for flag in PARAMETER_SECTIONS})
+    sections.update({flag: [] for flag in TERM_SECTIONS})
+    sections.update(
+        RESIDUE_LABEL=[], RESIDUE_POINTER=[], EXCLUDED_ATOMS_LIST=[])
+    lennard_jones = []
+    molecules = []
+    radius_set = ''
+    natom = nres = nnb = 0
+    offsets = dict(NTYPES=0, NUMBND=0, NUMANG=0, NPTRA=0)
+    counts = {pointer: 0 for _, _, pointer in TERM_SECTIONS.values()}
+    numextra = 0
+
+    # Blocks that share a template (e.g., runs of water split by ions) share its types and parameter tables:
+    # `(parm, pointers, offsets of its types and parameters, molecule sizes)` for each template.
+    templates = dict()
+    for structure, count in blocks:
+        if id(structure) in templates:
+            parm, pointers, block_offsets, sizes = templates[id(structure)]
+        else:
+            parm = amber_parm(structure)
+            pointers = _check(parm, flags)
+            if flags is None:
+                flags = [
+                    flag for flag in parm.flag_list
+                    if flag not in ('SOLVENT_POINTERS', 'ATOMS_PER_MOLECULE',
+                                    'BOX_DIMENSIONS')
+                ]
+                radius_set = parm.parm_data.get('RADIUS_SET', [''])[0]
+            formats.update(parm.formats)
+            for flag in PARAMETER_SECTIONS:
+                sections[flag].append(np.asarray(parm.parm_data[flag]))
+            lennard_jones.append((parm.LJ_radius, parm.LJ_depth) +
+                                 _lennard_jones(parm))
+            block_offsets = dict(offsets)
+            for pointer in offsets:
+                offsets[pointer] += pointers[pointer]
+            sizes = molecule_sizes(parm)
+            templates[id(structure)] = (parm, pointers, block_offsets, sizes)
+        data = parm.parm_data
+        n = pointers['NATOM']
+        # The first atom of each copy.
+        starts = natom + n * np.arange(count)
+
+        for flag in ATOM_SECTIONS:
+            if flag not in data:
+                continue
+            values = np.tile(np.asarray(data[flag]), count)
+            if flag == 'ATOM_TYPE_INDEX':
+                values += block_offsets['NTYPES']
+            elif flag == 'CHARGE':
+                # ParmEd keeps charges in electrons; the file has them in AMBER units.
+                values *= AMBER_ELECTROSTATIC
+            sections[flag].append(values)
+        sections['RESIDUE_LABEL'].append(
+            np.tile(np.asarray(data['RESIDUE_LABEL']), count))
+        sections['RESIDUE_POINTER'].append(
+            (np.asarray(data['RESIDUE_POINTER'])[None, :] +
+             starts[:, None]).ravel())
+        # Atom numbers are 1-based; zero means that an atom has no exclusions.
+        excluded = np.asarray(data['EXCLUDED_ATOMS_LIST'], dtype=np.int64)
+        sections['EXCLUDED_ATOMS_LIST'].append(
+            np.where(excluded > 0, excluded[None, :] + starts[:, None],
+                     0).ravel())
+
+        for flag, (width, parameters, pointer) in TERM_SECTIONS.items():
+            terms = np.asarray(data[flag], dtype=np.int64).reshape(-1, width)
+            # Atoms are stored as coordinate indices (3 * atom index); negative third and fourth dihedral atoms
+            # flag improper torsions and skipped 1-4 pairs, so the sign is kept.
+            shift = 3 * starts[:, None, None]
+            atoms = terms[None, :, :-1]
+            atoms = np.where(atoms < 0, atoms - shift, atoms + shift)
+            types = np.broadcast_to(
+                terms[None, :, -1:] + block_offsets[parameters],
+                atoms.shape[:2] + (1, ))
+            sections[flag].append(np.concatenate([atoms, types], axis=2).ravel())
+            counts[pointer] += count * len(terms)
+
+        molecules.append(np.tile(sizes, count))
+        natom += n * count
+        nres += pointers['NRES'] * count
+        nnb += pointers['NNB'] * count
+        numextra += pointers['NUMEXTRA'] * count
+
+    merged = {
+        flag: np.concatenate(values)
+        for flag, values in sections.items() if values
+    }
+
+    # Lorentz-Berthelot for every pair of types, then the original tables of each block.
+    radius = np.concatenate([np.asarray(lj[0]) for lj in lennard_jones])
+    depth = np.concatenate([np.asarray(lj[1]) for lj in lennard_jones])
+    rmin = radius[:, None] + radius[None, :]
+    epsilon = np.sqrt(depth[:, None] * depth[None, :])
+    acoef = epsilon * rmin**12
+    bcoef = 2 * epsilon * rmin**6
+    first = 0
+    for _, _, block_acoef, block_bcoef in lennard_jones:
+        last = first + len(block_acoef)
+        acoef[first:last, first:last] = block_acoef
+        bcoef[first:last, first:last] = block_bcoef
+        first = last
+    ntypes = len(radius)
+    lower = np.tril_indices(ntypes)
+    index = np.zeros((ntypes, ntypes), dtype=np.int64)
+    index[lower] = np.arange(1, len(lower[0]) + 1)
+    index = np.maximum(index, index.T)
+    merged['NONBONDED_PARM_INDEX'] = index.ravel()
+    merged['LENNARD_JONES_ACOEF'] = acoef[lower]
+    merged['LENNARD_JONES_BCOEF'] = bcoef[lower]
+    # SOLTY is not used by AMBER; like ParmEd, write a single zero.
+    merged.update(
+        TITLE=[title[first:first + 4] for first in range(0, len(title), 4)],
+        HBOND_ACOEF=[],
+        HBOND_BCOEF=[],
+        HBCUT=[],
+        SOLTY=[0.0],
+        RADIUS_SET=[radius_set],
+        IPOL=[0])
+
+    residue_sizes = np.diff(
+        np.append(merged['RESIDUE_POINTER'], natom + 1))
+    pointers = dict.fromkeys(POINTERS, 0)
+    pointers.update(counts)
+    pointers.update(
+        NATOM=natom,
+        NTYPES=ntypes,
+        NNB=nnb,
+        NRES=nres,
+        NBONA=counts['MBONA'],
+        NTHETA=counts['MTHETA'],
+        NPHIA=counts['MPHIA'],
+        NUMBND=offsets['NUMBND'],
+        NUMANG=offsets['NUMANG'],
+        NPTRA=offsets['NPTRA'],
+        NATYP=1,
+        NMXRS=int(residue_sizes.max()) if nres else 0,
+        NUMEXTRA=numextra)
+
+    if box is not None:
+        box = np.asarray(box, dtype=np.float64)
+        if np.allclose(box[3:], 90):
+            pointers['IFBOX'] = 1
+        elif np.allclose(box[3:], TRUNCATED_OCTAHEDRON_ANGLE, atol=0.02):
+            pointers['IFBOX'] = 2
+        else:
+            pointers['IFBOX'] = 3
+        molecules = np.concatenate(molecules)
+        # Like ParmEd, count ions as solute: the solvent starts at the first water (or other solvent) residue.
+        solvent = np.flatnonzero(
+            np.isin(merged['RESIDUE_LABEL'], list(SOLVENT_NAMES)))
+        if len(solvent):
+            first_atom = merged['RESIDUE_POINTER'][solvent[0]] - 1
+            first_molecule = np.searchsorted(
+                np.cumsum(molecules), first_atom, side='right') + 1
+            merged['SOLVENT_POINTERS'] = [
+                solvent[0], len(molecules), first_molecule
+            ]
+        else:
+            merged['SOLVENT_POINTERS'] = [nres, len(molecules), len(molecules) + 1]
+        merged['ATOMS_PER_MOLECULE'] = molecules
+        merged['BOX_DIMENSIONS'] = [box[3], box[0], box[1], box[2]]
+        formats.update(
+            SOLVENT_POINTERS=FortranFormat('3I8'),
+            ATOMS_PER_MOLECULE=FortranFormat('10I8'),
+            BOX_DIMENSIONS=FortranFormat('5E16.8'))
+        flags.insert(
+            flags.index('IROTAT') + 1 if 'IROTAT' in flags else len(flags),
+            'SOLVENT_POINTERS')
+        flags.insert(flags.index('SOLVENT_POINTERS') + 1, 'ATOMS_PER_MOLECULE')
+        flags.insert(flags.index('ATOMS_PER_MOLECULE') + 1, 'BOX_DIMENSIONS')
+    merged['POINTERS'] = [pointers[pointer] for pointer in POINTERS]
+
+    return [(flag, formats[flag], merged[flag]) for flag in flags]
+
+
+def format_section(values, fortran_format):
+    """
+    Format the values of a `prmtop` section. The whole section is formatted with one `%` operation, instead of
+    one call per value.
+
+    Parameters
+    ----------
+    values : array_like
+        Values of the section
+    fortran_format : parmed.amber.FortranFormat
+        Format of the section (e.g., `10I8` or `5E16.8`)
+
+    Returns
+    -------
+    str
+        The formatted lines (a single empty line for an empty section)
+    """
+    values = values.tolist() if isinstance(values, np.ndarray) else list(values)
+    if not values:
+        return '\n'
+    fmt = fortran_format.fmt
+    if fortran_format.type is str:
+        width = fortran_format.itemlen
+        # Like ParmEd, write placeholders (e.g., the 0 of a `RADIUS_SET` that was never set) as text.
+        values = [str(value)[:width] for value in values]
+        fmt = f'%-{width}s'
+    lines, remainder = divmod(len(values), fortran_format.nitems)
+    template = (fmt * fortran_format.nitems + '\n') * lines
+    if remainder:
+        template += fmt * remainder + '\n'
+    return template % tuple(values)
+
+
+def write_prmtop(file_name, sections, overwrite=False):
+    """
+    Write an AMBER `prmtop` file.
+
+    Parameters
+    ----------
+    file_name : str
+        Output file
+    sections : list of tuple
+        `(flag, format, values)` of each section, e.g., from `merge_topologies()`
+    overwrite : bool
+        Whether to overwrite an existing file
+    """
+    if os.path.exists(file_name) and not overwrite:
+        raise OSError(f'{file_name} exists; not overwriting.')
+    stamp = datetime.datetime.now().strftime('%m/%d/%y  %H:%M:%S')
+    with open(file_name, 'w') as file:
+        file.write(f'%VERSION  VERSION_STAMP = V0001.000  DATE = {stamp}\n')
+        for flag, fortran_format, values in sections:
+            file.write(f'%FLAG {flag}\n%FORMAT({fortran_format.format})\n')
+            file.write(format_section(values, fortran_format))
+
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+Provides opt-in timing, memory, and I/O instrumentation for the conversion stages and external tools.
+"""
+
+import contextlib as contextlib
+import contextvars as contextvars
+import functools as functools
+import itertools as itertools
+import json as json
+import logging as logging
+import resource as resource
+import threading as threading
+import time as time
+
+# Profiles that are currently recording; records are added to all of them, so profiles can be nested.
+_active = []
+_lock = threading.Lock()
+# The stage that encloses the running code. Threads that run stages for it (e.g., `pipeline.run_stages()`) copy
+# the context, so their stages get the right parent.
+_parent = contextvars.ContextVar('parent', default=None)
+_ids = itertools.count()
+
+
+class Profile(object):
+    """
+    A list of records, one per profiled stage or external tool invocation. Each record is a dictionary with
+    the stage `name`, the `tool` (e.g., `cpptraj`, `tleap`, `antechamber`, or `python`), the `start` time
+    relative to the start of the profile, its `id`, the `id` of the enclosing stage (`parent`, or None) and the
+    following measurements:
+
+    - `wall`: wall time (s)
+    - `cpu`: CPU time of the calling thread (s)
+    - `children_cpu`: CPU time of the subprocesses that finished during the stage (s)
+    - `peak_rss`: peak resident set size of this process or its largest subprocess so far (bytes)
+    - `read_bytes`, `write_bytes`: bytes read and written by this process and its subprocesses
+
+    Subprocess and I/O counters are per process, so they are only attributed exactly when stages run one
+    after another (e.g., `convert(..., concurrent=False)`).
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.records = []
+
+    def add(self, record):
+        with _lock:
+            self.records.append(record)
+
+    def summary(self, field='wall'):
+        """
+        Sum a measurement over the records of each tool. Only stages that enclose no other recorded stage count,
+        so nested stages (e.g., a whole `convert()` and the tool runs inside it) are not counted twice.
+
+        Parameters
+        ----------
+        field : str
+            Name of the measurement (e.g., `wall` or `children_cpu`)
+
+        Returns
+        -------
+        dict
+            Total of `field` for each tool
+        """
+        parents = {record['parent'] for record in self.records}
+        totals = dict()
+        for record in self.records:
+            if record['id'] in parents:
+                continue
+            totals[record['tool']] = totals.get(record['tool'], 0) + record[field]
+        return totals
+
+    def to_dict(self):
+        return dict(records=list(self.records), summary=self.summary())
+
+    def to_json(self, file_name=None):
+        """
+        Export the records as JSON.
+
+        Parameters
+        ----------
+        file_name : str
+            If set, the JSON is also written to this file
+
+        Returns
+        -------
+        str
+            JSON document
+        """
+        document = json.dumps(self.to_dict(), indent=2)
+        if file_name is not None:
+            with open(file_name, 'w') as file:
+                file.write(document)
+        return document
+
+
+@contextlib.contextmanager
+def profile():
+    """
+    Record every profiled stage that runs inside the `with` block.
+
+    Returns
+    -------
+    Profile
+        The records (filled in as the stages finish)
+    """
+    current = Profile()
+    with _lock:
+        _active.append(current)
+    try:
+        yield current
+    finally:
+        with _lock:
+            _active.remove(current)
+
+
+def _read_io():
+    try:
+        with open('/proc/self/io', 'r') as file:
+            counters = dict(line.split(':') for line in file)
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_inblock * 512, usage.ru_oublock * 512
+
+
+def _snapshot():
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    read, written = _read_io()
+    return dict(
+        wall=time.perf_counter(),
+        cpu=time.thread_time(),
+        children_cpu=children.ru_utime + children.ru_stime,
+        read_bytes=read + children.ru_inblock * 512,
+        write_bytes=written + children.ru_oublock * 512)
+
+
+@contextlib.contextmanager
+def stage(name, tool='python'):
+    """
+    Profile a block of code, if a profile is recording.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage
+    tool : str
+        External program run by the stage, or `python`
+    """
+    if not _active:
+        yield
+        return
+    identifier = next(_ids)
+    parent = _parent.get()
+    token = _parent.set(identifier)
+    before = _snapshot()
+    error = None
+    try:
+        yield
+    except BaseException as exception:
+        error = type(exception).__name__
+        raise
+    finally:
+        _parent.reset(token)
+        after = _snapshot()
+        # `ru_maxrss` is in kilobytes on Linux.
+        peak_rss = 1024 * max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        record = dict(
+            name=name,
+            tool=tool,
+            id=identifier,
+            parent=parent,
+            peak_rss=peak_rss,
+            error=error)
+        for key in before:
+            record[key] = after[key] - before[key]
+        logging.debug(f'{name} ({tool}) took {record["wall"]:.3f} s.')
+        with _lock:
+            profiles = list(_active)
+        for current in profiles:
+            record = dict(record, start=before['wall'] - current.start)
+            current.add(record)
+
+
+def profiled(tool='python'):
+    """
+    Decorate a function so each call is recorded as a stage named after the function.
+
+    Parameters
+    ----------
+    tool : str
+        External program run by the function, or `python`
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _active:
+                return function(*args, **kwargs)
+            with stage(function.__name__, tool=tool):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
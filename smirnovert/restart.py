@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Reads and writes AMBER restart (coordinate) files from NumPy arrays: ASCII `inpcrd` files and binary NetCDF
+restarts (`ncrst`), which are faster to read and write and keep the full precision of the coordinates.
+"""
+
+import os as os
+
+import numpy as np
+from parmed.amber import FortranFormat, NetCDFRestart
+
+from .prmtop import format_section
+
+# Restart formats and their file extensions.
+RESTART_FORMATS = {'inpcrd': '.inpcrd', 'ncrst': '.ncrst'}
+
+# The first bytes of NetCDF (classic and 64-bit offset) and NetCDF-4 (HDF5) files.
+NETCDF_MAGIC = (b'CDF', b'\x89HDF')
+
+
+def restart_format(file_name):
+    """
+    Guess the format of a restart file from its extension.
+
+    Parameters
+    ----------
+    file_name : str
+        Restart file
+
+    Returns
+    -------
+    str
+        `ncrst` for `.ncrst` and `.nc` files, `inpcrd` otherwise
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    return 'ncrst' if extension in ('.ncrst', '.nc') else 'inpcrd'
+
+
+def write_inpcrd(file_name,
+                 coordinates,
+                 box=None,
+                 title='',
+                 overwrite=False):
+    """
+    Write an AMBER `inpcrd` (ASCII restart) file with coordinates only.
+
+    Parameters
+    ----------
+    file_name : str
+        Output file
+    coordinates : numpy.ndarray
+        Coordinates (Å), shape `(natom, 3)`
+    box : array_like
+        Box lengths and angles
+    title : str
+        Title line
+    overwrite : bool
+        Whether to overwrite an existing file
+    """
+    if os.path.exists(file_name) and not overwrite:
+        raise OSError(f'{file_name} exists; not overwriting.')
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+    with open(file_name, 'w') as file:
+        file.write(f'{title}\n{len(coordinates):5d}{0:15.7e}\n')
+        file.write(
+            format_section(coordinates.ravel(), FortranFormat('6F12.7')))
+        if box is not None:
+            file.write(format_section(np.asarray(box), FortranFormat('6F12.7')))
+
+
+def write_ncrst(file_name, coordinates, box=None, title='', overwrite=False):
+    """
+    Write an AMBER NetCDF restart file with coordinates only.
+
+    Parameters
+    ----------
+    file_name : str
+        Output file
+    coordinates : numpy.ndarray
+        Coordinates (Å), shape `(natom, 3)`
+    box : array_like
+        Box lengths and angles
+    title : str
+        Title of the file
+    overwrite : bool
+        Whether to overwrite an existing file
+    """
+    if os.path.exists(file_name) and not overwrite:
+        raise OSError(f'{file_name} exists; not overwriting.')
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+    restart = NetCDFRestart.open_new(
+        file_name, len(coordinates), box=box is not None, vels=False, title=title)
+    try:
+        restart.coordinates = coordinates
+        if box is not None:
+            restart.box = np.asarray(box, dtype=np.float64)
+    finally:
+        restart.close()
+
+
+def write_restart(file_name,
+                  coordinates,
+                  box=None,
+                  format=None,
+                  title='',
+                  overwrite=False):
+    """
+    Write a restart file in either format.
+
+    Parameters
+    ----------
+    file_name : str
+        Output file
+    coordinates : numpy.ndarray
+        Coordinates (Å), shape `(natom, 3)`
+    box : array_like
+        Box lengths and angles
+    format : str
+        `inpcrd` or `ncrst` (guessed from the extension if None)
+    title : str
+        Title of the file
+    overwrite : bool
+        Whether to overwrite an existing file
+    """
+    format = format or restart_format(file_name)
+    if format not in RESTART_FORMATS:
+        raise ValueError(
+            f'Unknown restart format {format}; choose from {sorted(RESTART_FORMATS)}.'
+        )
+    writer = write_ncrst if format == 'ncrst' else write_inpcrd
+    writer(file_name, coordinates, box=box, title=title, overwrite=overwrite)
+
+
+def _read_inpcrd(file_name):
+    with open(file_name, 'r') as file:
+        file.readline()
+        natom = int(file.readline().split()[0])
+        # Every line holds whole 12-character fields, so the lines can be joined and cut into fields at once.
+        text = ''.join(line.rstrip('\r\n') for line in file).encode('ascii')
+    if len(text) % 12:
+        text = text.ljust(len(text) + 12 - len(text) % 12)
+    values = np.frombuffer(text, dtype='S12').astype(np.float64)
+    box = None
+    if len(values) in (3 * natom + 6, 6 * natom + 6):
+        box = values[-6:]
+    elif len(values) in (3 * natom + 3, 6 * natom + 3):
+        box = np.concatenate([values[-3:], [90.0, 90.0, 90.0]])
+    elif len(values) not in (3 * natom, 6 * natom):
+        raise ValueError(
+            f'{file_name} has {len(values)} values, which does not match {natom} atoms.'
+        )
+    return values[:3 * natom].reshape(natom, 3), box
+
+
+def read_restart(file_name):
+    """
+    Read the coordinates and box of an ASCII or NetCDF restart file (the format is detected from the
+    contents).
+
+    Parameters
+    ----------
+    file_name : str
+        Restart file
+
+    Returns
+    -------
+    coordinates : numpy.ndarray
+        Coordinates (Å), shape `(natom, 3)`
+    box : numpy.ndarray
+        Box lengths and angles, or None if the file has no box
+    """
+    with open(file_name, 'rb') as file:
+        magic = file.read(4)
+    if not magic.startswith(NETCDF_MAGIC):
+        return _read_inpcrd(file_name)
+    restart = NetCDFRestart.open_old(file_name)
+    try:
+        coordinates = np.array(restart.coordinates).reshape(-1, 3)
+        box = None if restart.box is None else np.array(restart.box)
+    finally:
+        restart.close()
+    return coordinates, box
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+"""
+Provides a tokenizer for AMBER `&rst` namelists (e.g., `disang.rest` files) and rewrites the restraint atoms
+and anchor atom masks for a new atom and residue numbering, for one file or a whole tree of APR windows.
+"""
+
+import fnmatch as fnmatch
+import logging as logging
+import os as os
+import re as re
+import shutil as shutil
+import tempfile as tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .mapping import map_indices
+from .masks import translate_mask
+
+# Namelist keys that hold (1-based) atom numbers.
+ATOM_KEYS = {'iat', 'igr1', 'igr2'}
+
+TOKENS = re.compile(
+    r'''
+    (?P<start>&[A-Za-z]\w*)
+    |(?P<stop>/)
+    |(?P<comment>[!#][^\n]*)
+    |(?P<string>'[^']*'|"[^"]*")
+    |(?P<key>[A-Za-z_]\w*(?:\([^)]*\))?\s*=)
+    |(?P<comma>,)
+    |(?P<space>\s+)
+    |(?P<value>[^\s,=/&!#'"]+)
+    ''', re.VERBOSE)
+
+
+class IncompleteGroup(ValueError):
+    """ Raised by `tokenize()` when the text ends inside a namelist group. """
+
+
+def tokenize(text):
+    """
+    Split the text of a restraint file into tokens. Text outside of namelist groups is returned as `text` and
+    `comment` tokens; inside a group (from `&rst` to `&end` or `/`) the tokens are `start`, `key` (including
+    the `=`), `value`, `string`, `comma`, `space`, `comment`, and `end`.
+
+    Parameters
+    ----------
+    text : str
+        Contents of the restraint file (or a part of it that ends outside of a group)
+
+    Returns
+    -------
+    list of tuple
+        Kind and text of each token
+
+    Raises
+    ------
+    IncompleteGroup
+        If the text ends inside a group
+    ValueError
+        If a group holds text that is not a token (e.g., a stray `&`)
+    """
+    tokens = []
+    position = 0
+    inside = False
+    while position < len(text):
+        if not inside:
+            match = re.search(r'&[A-Za-z]\w*|[!#][^\n]*', text[position:])
+            if match is None:
+                tokens.append(('text', text[position:]))
+                break
+            if match.start():
+                tokens.append(('text', text[position:position + match.start()]))
+            if match.group().startswith('&'):
+                tokens.append(('start', match.group()))
+                inside = True
+            else:
+                tokens.append(('comment', match.group()))
+            position += match.end()
+            continue
+        match = TOKENS.match(text, position)
+        if match is None:
+            line = text.count('\n', 0, position) + 1
+            column = position - text.rfind('\n', 0, position)
+            raise ValueError(
+                f'Unexpected {text[position]!r} at line {line}, column {column} of a namelist group.'
+            )
+        kind = match.lastgroup
+        token = match.group()
+        if kind == 'start' and token.lower() == '&end' or kind == 'stop':
+            kind = 'end'
+            inside = False
+        tokens.append((kind, token))
+        position = match.end()
+    if inside:
+        raise IncompleteGroup('Unterminated namelist group.')
+    return tokens
+
+
+def _map_atoms(numbers, atom_mapping):
+    numbers = np.array(numbers, dtype=np.int64)
+    mapped = numbers.copy()
+    # Zero and negative atom numbers (e.g., `iat(1)=-1` for groups) are not atoms.
+    atoms = numbers > 0
+    mapped[atoms] = map_indices(atom_mapping, numbers[atoms] - 1) + 1
+    return mapped.tolist()
+
+
+def rewrite_mask(mask, residue_mapping):
+    """
+    Renumber the residues of an anchor atom mask, e.g., `:4@O3` or `:1-3` (see `masks.translate_mask()`).
+
+    Parameters
+    ----------
+    mask : str
+        AMBER mask
+    residue_mapping : IndexMap or dict
+        Mapping between residue numbers
+
+    Returns
+    -------
+    str
+        The mask with target residue numbers
+    """
+    return translate_mask(mask, residue_mapping)
+
+
+def _rewrite_comment(comment, residue_mapping):
+    if residue_mapping is None or not comment.startswith('#AnchorAtoms'):
+        return comment
+    return re.sub(r'(?<!\S):\S+',
+                  lambda match: rewrite_mask(match.group(), residue_mapping),
+                  comment)
+
+
+def _rewrite_atom_list(tokens, atom_mapping):
+    """
+    Rewrite the tokens of one atom list (values, commas, and spaces). The width of the list plus its trailing
+    spaces is kept when possible, so the columns after it stay aligned.
+    """
+    trailing = []
+    while tokens and tokens[-1][0] == 'space':
+        trailing.insert(0, tokens.pop())
+    numbers = [int(token) for kind, token in tokens if kind == 'value']
+    mapped = iter(_map_atoms(numbers, atom_mapping))
+    rewritten = ''.join(
+        str(next(mapped)) if kind == 'value' else token for kind, token in tokens)
+    spaces = ''.join(token for _, token in trailing)
+    if spaces and '\n' not in spaces:
+        width = len(''.join(token for _, token in tokens)) + len(spaces)
+        spaces = ' ' * max(1, width - len(rewritten))
+    return rewritten + spaces
+
+
+def rewrite_restraints_text(text, atom_mapping, residue_mapping=None):
+    """
+    Rewrite the atom numbers (`iat`, `igr1`, and `igr2`) of every `&rst` group and, if a residue mapping is
+    given, the masks in `#AnchorAtoms` comments. Everything else is copied verbatim.
+
+    Parameters
+    ----------
+    text : str
+        Contents of a restraint file
+    atom_mapping : IndexMap or dict
+        Mapping between (0-based) atom indices in the reference and target structures
+    residue_mapping : IndexMap or dict
+        Mapping between residue numbers in the reference and target structures
+
+    Returns
+    -------
+    str
+        The rewritten contents
+    """
+    output = []
+    atom_list = None
+    for kind, token in tokenize(text):
+        if atom_list is not None:
+            if kind in ('value', 'comma', 'space'):
+                atom_list.append((kind, token))
+                continue
+            output.append(_rewrite_atom_list(atom_list, atom_mapping))
+            atom_list = None
+        if kind == 'key' and re.sub(r'[\s=(].*', '', token,
+                                    flags=re.DOTALL).lower() in ATOM_KEYS:
+            atom_list = []
+        if kind == 'comment':
+            token = _rewrite_comment(token, residue_mapping)
+        output.append(token)
+    if atom_list is not None:
+        output.append(_rewrite_atom_list(atom_list, atom_mapping))
+    return ''.join(output)
+
+
+def stream_namelists(source, destination, rewrite):
+    """
+    Copy a namelist file through `rewrite`, one complete group at a time, so groups may span several lines
+    without reading the whole file. The output is written to a temporary file that replaces `destination`
+    once every group is rewritten, so an error leaves no partial output.
+
+    Parameters
+    ----------
+    source : str
+        File name of the input
+    destination : str
+        File name of the output
+    rewrite : callable
+        Takes text that ends outside of a group and returns the rewritten text; raises `IncompleteGroup` if a
+        group is unterminated (see `tokenize()`). Any other error stops the copy.
+    """
+    descriptor, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(destination)),
+        prefix='.',
+        suffix='.tmp')
+    try:
+        with open(source, 'r') as reference, os.fdopen(descriptor,
+                                                      'w') as target:
+            buffer = ''
+            for line in reference:
+                buffer += line
+                try:
+                    target.write(rewrite(buffer))
+                except IncompleteGroup:
+                    # The group continues on the next line.
+                    continue
+                buffer = ''
+            if buffer:
+                # Raises an error for the unterminated group.
+                target.write(rewrite(buffer))
+        shutil.copymode(source, temporary)
+        os.replace(temporary, destination)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def rewrite_tree(reference_root,
+                 target_root,
+                 patterns,
+                 rewrite,
+                 arguments=(),
+                 workers=None):
+    """
+    Apply `rewrite(source, destination, *arguments)` to every file in a directory tree whose name matches one
+    of `patterns`, writing each to the same relative path under `target_root`. Files are processed in
+    parallel.
+
+    Parameters
+    ----------
+    reference_root : str
+        Top directory of the reference windows
+    target_root : str
+        Top directory of the target windows
+    patterns : list
+        Shell-style patterns of the file names
+    rewrite : callable
+        Module-level function (so it can be sent to the worker processes)
+    arguments : tuple
+        Extra arguments of `rewrite`
+    workers : int
+        Number of worker processes (`1` rewrites the files one after another)
+
+    Returns
+    -------
+    list
+        The rewritten files
+    """
+    jobs = []
+    for directory, directories, files in os.walk(reference_root):
+        directories.sort()
+        for file_name in sorted(files):
+            if not any(
+                    fnmatch.fnmatch(file_name, pattern) for pattern in patterns):
+                continue
+            source = os.path.join(directory, file_name)
+            destination = os.path.join(
+                target_root, os.path.relpath(source, reference_root))
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            jobs.append((source, destination))
+    logging.info(f'Rewriting {len(jobs)} files with {rewrite.__name__}()...')
+
+    if workers == 1 or len(jobs) < 2:
+        for source, destination in jobs:
+            rewrite(source, destination, *arguments)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(rewrite, source, destination, *arguments)
+                for source, destination in jobs
+            ]
+            for future in futures:
+                future.result()
+    return [destination for _, destination in jobs]
+
+
+def rewrite_restraints(reference_restraints,
+                       target_restraints,
+                       atom_mapping,
+                       residue_mapping=None):
+    """
+    Rewrite a restraint file for the target structure. The file is streamed: each group is rewritten as
+    soon as it is complete, so groups may span several lines.
+
+    Parameters
+    ----------
+    reference_restraints : str
+        File name of reference restraints file
+    target_restraints : str
+        File name of target restraints file
+    atom_mapping : IndexMap or dict
+        Mapping between (0-based) atom indices in the reference and target structures
+    residue_mapping : IndexMap or dict
+        Mapping between residue numbers, used for the `#AnchorAtoms` masks (left unchanged if None)
+    """
+    stream_namelists(
+        reference_restraints, target_restraints, lambda text:
+        rewrite_restraints_text(text, atom_mapping, residue_mapping))
+
+
+def rewrite_restraints_tree(reference_root,
+                            target_root,
+                            atom_mapping,
+                            residue_mapping=None,
+                            pattern='disang.rest',
+                            workers=None):
+    """
+    Rewrite every restraint file in a directory tree (e.g., one `disang.rest` per APR window), writing each
+    to the same relative path under `target_root`. Files are processed in parallel.
+
+    Parameters
+    ----------
+    reference_root : str
+        Top directory of the reference windows
+    target_root : str
+        Top directory of the target windows (may be the same as `reference_root` only if `pattern` does not
+        match the output names)
+    atom_mapping : IndexMap or dict
+        Mapping between (0-based) atom indices in the reference and target structures
+    residue_mapping : IndexMap or dict
+        Mapping between residue numbers, used for the `#AnchorAtoms` masks
+    pattern : str
+        Shell-style pattern of the restraint file names
+    workers : int
+        Number of worker processes (`1` rewrites the files one after another)
+
+    Returns
+    -------
+    list
+        The rewritten files
+    """
+    return rewrite_tree(reference_root, target_root, [pattern],
+                        rewrite_restraints, (atom_mapping, residue_mapping),
+                        workers)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""
+Provides in-process parameters for water, ions, and dummy atoms, built from single-residue templates instead
+of running `tleap` on every solvent molecule.
+"""
+
+import logging as logging
+
+import numpy as np
+import parmed as pmd
+
+from .compact import SolventBlock
+
+# Atom type, atomic number, mass, charge, Rmin/2, and epsilon for each atom of the water models, and the
+# O-H and H-H bonds (force constant, equilibrium length) that `tleap` writes for rigid water.
+WATER_MODELS = {
+    'tip3p': {
+        'atoms': {
+            'O': ('OW', 8, 16.00, -0.834, 1.7683, 0.1520),
+            'H1': ('HW', 1, 1.008, 0.417, 0.0, 0.0),
+            'H2': ('HW', 1, 1.008, 0.417, 0.0, 0.0),
+        },
+        'OH': (553.0, 0.9572),
+        'HH': (553.0, 1.5136),
+    },
+    'spce': {
+        'atoms': {
+            'O': ('OW', 8, 16.00, -0.8476, 1.7767, 0.1553),
+            'H1': ('HW', 1, 1.008, 0.4238, 0.0, 0.0),
+            'H2': ('HW', 1, 1.008, 0.4238, 0.0, 0.0),
+        },
+        'OH': (553.0, 1.0000),
+        'HH': (553.0, 1.6330),
+    },
+}
+
+# Atomic number, mass, charge, Rmin/2, and epsilon of the Joung-Cheatham monovalent ions, as in the AmberTools
+# `frcmod.ionsjc_*` files. The residue, atom name, and atom type are all the ion name.
+ION_MODELS = {
+    'ionsjc_tip3p': {
+        'Li+': (3, 6.94, 1.0, 1.025, 0.0279896),
+        'Na+': (11, 22.99, 1.0, 1.369, 0.0874393),
+        'K+': (19, 39.10, 1.0, 1.705, 0.1936829),
+        'Rb+': (37, 85.47, 1.0, 1.813, 0.3278219),
+        'Cs+': (55, 132.91, 1.0, 1.976, 0.4065394),
+        'F-': (9, 19.00, -1.0, 2.303, 0.0033640),
+        'Cl-': (17, 35.45, -1.0, 2.513, 0.0355910),
+        'Br-': (35, 79.90, -1.0, 2.608, 0.0586554),
+        'I-': (53, 126.9, -1.0, 2.860, 0.0536816),
+    },
+    'ionsjc_spce': {
+        'Li+': (3, 6.94, 1.0, 0.791, 0.3367344),
+        'Na+': (11, 22.99, 1.0, 1.212, 0.3526418),
+        'K+': (19, 39.10, 1.0, 1.593, 0.4297054),
+        'Rb+': (37, 85.47, 1.0, 1.737, 0.4451036),
+        'Cs+': (55, 132.91, 1.0, 2.021, 0.0898565),
+        'F-': (9, 19.00, -1.0, 2.257, 0.0074005),
+        'Cl-': (17, 35.45, -1.0, 2.711, 0.0127850),
+        'Br-': (35, 79.90, -1.0, 2.751, 0.0269586),
+        'I-': (53, 126.9, -1.0, 2.919, 0.0427845),
+    },
+}
+
+# The "lead-like" dummy atom of `utils.write_dummy_atom_frcmod()` and `utils.write_dummy_atom_mol2()`.
+DUMMY_ATOM = ('Pb', 82, 210.00, 0.0, 0.0, 0.0)
+
+WATER_RESNAMES = {'WAT', 'HOH'}
+
+
+class MissingTemplate(ValueError):
+    """ Raised by `create_solvent_template()` when a residue or model has no template. """
+
+
+def _add_atom(structure, name, resname, parameters, atom_types):
+    type_name, atomic_number, mass, charge, rmin, epsilon = parameters
+    if type_name not in atom_types:
+        atom_type = pmd.AtomType(type_name, None, mass, atomic_number)
+        atom_type.set_lj_params(epsilon, rmin)
+        atom_types[type_name] = atom_type
+    atom = pmd.Atom(
+        name=name,
+        type=type_name,
+        charge=charge,
+        mass=mass,
+        atomic_number=atomic_number)
+    atom.atom_type = atom_types[type_name]
+    structure.add_atom(atom, resname, 1)
+
+
+def create_solvent_template(resname,
+                            atom_names,
+                            water_model='tip3p',
+                            ion_model='ionsjc_tip3p',
+                            dummy_atoms=False):
+    """
+    Create a parameterized, single-residue structure for a water, ion, or dummy atom residue.
+
+    Parameters
+    ----------
+    resname : str
+        Residue name (e.g., `WAT`, `Na+`, or `DUM`)
+    atom_names : list
+        Atom names of the residue, in the order they appear in the system
+    water_model : str
+        Water model, one of `WATER_MODELS`
+    ion_model : str
+        Ion model, one of `ION_MODELS`
+    dummy_atoms : bool
+        Whether dummy atom residues (`DUM`) are allowed
+
+    Returns
+    -------
+    pmd.Structure
+        The residue with parameters
+
+    Raises
+    ------
+    MissingTemplate
+        If there is no template for the residue, its atom names, or the models
+    """
+    if water_model not in WATER_MODELS:
+        raise MissingTemplate(
+            f'No template for water model {water_model}; use `tleap` instead.')
+    if ion_model not in ION_MODELS:
+        raise MissingTemplate(
+            f'No template for ion model {ion_model}; use `tleap` instead.')
+
+    template = pmd.Structure()
+    atom_types = dict()
+    if resname in WATER_RESNAMES:
+        water = WATER_MODELS[water_model]
+        if sorted(atom_names) != sorted(water['atoms']):
+            raise MissingTemplate(
+                f'Unexpected atom names {atom_names} in water residue {resname}.')
+        for name in atom_names:
+            _add_atom(template, name, resname, water['atoms'][name], atom_types)
+        atoms = {atom.name: atom for atom in template.atoms}
+        bond_types = dict()
+        for key in ('OH', 'HH'):
+            bond_types[key] = pmd.BondType(*water[key])
+            template.bond_types.append(bond_types[key])
+        for atom1, atom2, key in [('O', 'H1', 'OH'), ('O', 'H2', 'OH'),
+                                  ('H1', 'H2', 'HH')]:
+            template.bonds.append(
+                pmd.Bond(atoms[atom1], atoms[atom2], type=bond_types[key]))
+    elif resname in ION_MODELS[ion_model]:
+        if len(atom_names) != 1:
+            raise MissingTemplate(
+                f'Unexpected atom names {atom_names} in ion residue {resname}.')
+        _add_atom(template, atom_names[0], resname,
+                  (resname, ) + ION_MODELS[ion_model][resname], atom_types)
+    elif resname == 'DUM' and dummy_atoms:
+        if len(atom_names) != 1:
+            raise MissingTemplate(
+                f'Unexpected atom names {atom_names} in dummy atom residue {resname}.')
+        _add_atom(template, atom_names[0], resname, DUMMY_ATOM, atom_types)
+    else:
+        raise MissingTemplate(
+            f'No template for residue {resname}; use `tleap` instead.')
+    template.bond_types.claim()
+    return template
+
+
+def create_water_and_ions_blocks(structure,
+                                 water_model='tip3p',
+                                 ion_model='ionsjc_tip3p',
+                                 dummy_atoms=False):
+    """
+    Parameterize the water, ions, and dummy atoms (if present) as blocks of consecutive, identical residues.
+    Each block holds one template and the coordinates of all of its copies, so no ParmEd objects are created
+    for the copies.
+
+    Parameters
+    ----------
+    structure : pmd.Structure
+        Everything except the host and guest, with coordinates (e.g., a slice of the reference structure)
+    water_model : str
+        Water model, one of `WATER_MODELS`
+    ion_model : str
+        Ion model, one of `ION_MODELS`
+    dummy_atoms : bool
+        Whether to include dummy atom parameters
+
+    Returns
+    -------
+    list of compact.SolventBlock
+        The blocks, in the order of `structure`
+    """
+    logging.info('Creating parameters for the waters and ions from templates...')
+    templates = dict()
+    runs = []
+    for residue in structure.residues:
+        key = (residue.name, tuple(atom.name for atom in residue.atoms))
+        if runs and runs[-1][0] == key:
+            runs[-1][1] += 1
+        else:
+            runs.append([key, 1])
+
+    coordinates = structure.coordinates
+    blocks = []
+    first = 0
+    for (resname, atom_names), count in runs:
+        if (resname, atom_names) not in templates:
+            templates[(resname, atom_names)] = create_solvent_template(
+                resname, atom_names, water_model, ion_model, dummy_atoms)
+        last = first + count * len(atom_names)
+        blocks.append(
+            SolventBlock(templates[(resname, atom_names)], count,
+                         coordinates[first:last]))
+        first = last
+    return blocks
+
+
+def create_water_and_ions_structure(structure,
+                                    water_model='tip3p',
+                                    ion_model='ionsjc_tip3p',
+                                    dummy_atoms=False):
+    """
+    Parameterize the water, ions, and dummy atoms (if present) without `tleap`. Each residue type is
+    parameterized once from a template; consecutive residues of the same type are created by replicating the
+    template, and all coordinates are copied in a single array assignment.
+
+    Parameters
+    ----------
+    structure : pmd.Structure
+        Everything except the host and guest, with coordinates (e.g., a slice of the reference structure)
+    water_model : str
+        Water model, one of `WATER_MODELS`
+    ion_model : str
+        Ion model, one of `ION_MODELS`
+    dummy_atoms : bool
+        Whether to include dummy atom parameters
+
+    Returns
+    -------
+    pmd.Structure
+        Parameterized water, ions, and dummy atoms, in the order of `structure`
+    """
+    return structure_from_blocks(
+        create_water_and_ions_blocks(structure, water_model, ion_model,
+                                     dummy_atoms))
+
+
+def structure_from_blocks(blocks):
+    """
+    Build one ParmEd structure from blocks of solvent by replicating each template, and copy all coordinates in
+    a single array assignment.
+
+    Parameters
+    ----------
+    blocks : list of compact.SolventBlock
+        The blocks, in order
+
+    Returns
+    -------
+    pmd.Structure
+        Parameterized water, ions, and dummy atoms
+    """
+    water_and_ions = pmd.Structure()
+    for block in blocks:
+        logging.debug(f'Replicating {block}...')
+        water_and_ions += block.template * block.count
+    water_and_ions.coordinates = np.concatenate(
+        [block.coordinates for block in blocks])
+    return water_and_ions
@@ -0,0 +1,630 @@
+#!/usr/bin/env python
+"""
+Reads AMBER `prmtop` and `inpcrd` files in fixed-size chunks, so the water and ions of a very large box can be
+extracted without loading the whole system into ParmEd. Each `prmtop` section is located once by its `%FLAG`
+line; the values of a section (or of an `inpcrd` file) are fixed-width fields on lines of equal length, so any
+range of atoms is read by seeking straight to it.
+"""
+
+import logging as logging
+import os as os
+
+import numpy as np
+import parmed as pmd
+from parmed.amber import FortranFormat
+from parmed.constants import AMBER_ELECTROSTATIC
+
+from .compact import SolventBlock
+from .prmtop import ATOM_SECTIONS, PARAMETER_SECTIONS, POINTERS, TERM_SECTIONS
+from .solvent import create_solvent_template, structure_from_blocks
+
+# Atoms per chunk.
+CHUNK_SIZE = 100000
+
+
+class FixedWidthSection(object):
+    """
+    Values in fixed-width fields, `nitems` to a line, starting at byte `offset` of a file.
+
+    Parameters
+    ----------
+    file_name : str
+        File
+    offset : int
+        Byte offset of the first line of values
+    end : int
+        Byte offset after the last line of values
+    count : int
+        Number of values
+    fortran_format : FortranFormat
+        Format of the values
+    """
+
+    def __init__(self, file_name, offset, end, count, fortran_format):
+        self.file_name = file_name
+        self.offset = offset
+        self.end = end
+        self.count = count
+        self.format = fortran_format
+        with open(file_name, 'rb') as file:
+            file.seek(offset)
+            first = file.readline()
+        # The length of a full line, including the line ending.
+        self.line_length = len(first) if count > fortran_format.nitems else None
+
+    def __len__(self):
+        return self.count
+
+    def _parse(self, text, count):
+        itemlen = self.format.itemlen
+        text = text.ljust(count * itemlen)[:count * itemlen]
+        fields = np.frombuffer(text, dtype=f'S{itemlen}')
+        if self.format.type is str:
+            return [field.decode().strip() for field in fields]
+        if self.format.type is int:
+            return fields.astype(np.int64)
+        return fields.astype(np.float64)
+
+    def read(self, start=0, stop=None):
+        """
+        Read the values `start` to `stop` (like a slice).
+
+        Parameters
+        ----------
+        start : int
+            First value
+        stop : int
+            Value after the last one (defaults to the end of the section)
+
+        Returns
+        -------
+        numpy.ndarray or list
+            Numbers as an array, strings as a list
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        if stop <= start:
+            return self._parse(b'', 0)
+        nitems = self.format.nitems
+        first_line = start // nitems
+        last_line = (stop - 1) // nitems
+        with open(self.file_name, 'rb') as file:
+            if self.line_length is None:
+                file.seek(self.offset)
+                lines = [file.readline()]
+            else:
+                file.seek(self.offset + first_line * self.line_length)
+                lines = [
+                    file.readline() for _ in range(last_line - first_line + 1)
+                ]
+        text = b''.join(
+            line.rstrip(b'\r\n').ljust(nitems * self.format.itemlen)
+            for line in lines)
+        skip = (start - first_line * nitems) * self.format.itemlen
+        return self._parse(text[skip:], stop - start)
+
+    def chunks(self, size=CHUNK_SIZE):
+        """
+        Read the section `size` values at a time.
+
+        Parameters
+        ----------
+        size : int
+            Values per chunk
+
+        Yields
+        ------
+        numpy.ndarray or list
+            The values of each chunk, in order
+        """
+        for start in range(0, self.count, size):
+            yield self.read(start, start + size)
+
+
+class PrmtopReader(object):
+    """
+    Random access to the sections of a `prmtop` file. The file is scanned once to find the sections; values are
+    only read when they are asked for.
+
+    Parameters
+    ----------
+    file_name : str
+        AMBER parameter file
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.flag_list = []
+        self.formats = dict()
+        self._bounds = dict()
+        flag = None
+        with open(file_name, 'rb') as file:
+            offset = 0
+            for line in iter(file.readline, b''):
+                if line.startswith(b'%FLAG'):
+                    if flag is not None:
+                        self._bounds[flag][1] = offset
+                    flag = line[5:].strip().decode()
+                    self.flag_list.append(flag)
+                elif line.startswith(b'%FORMAT'):
+                    fmt = line.decode().strip()[8:-1]
+                    self.formats[flag] = FortranFormat(fmt)
+                    self._bounds[flag] = [offset + len(line), None]
+                offset += len(line)
+            if flag is not None:
+                self._bounds[flag][1] = offset
+        if 'POINTERS' not in self.formats:
+            raise ValueError(f'{file_name} is not an AMBER parameter file.')
+        self.pointers = dict(zip(POINTERS, self._section('POINTERS', None).read()))
+        self._sections = dict()
+
+    def _count(self, flag, start, end):
+        """
+        The number of values in a section, from the lines between its `%FORMAT` line and the next `%FLAG`.
+        """
+        fortran_format = self.formats[flag]
+        with open(self.file_name, 'rb') as file:
+            file.seek(start)
+            first = file.readline()
+            # Every line but the last is full.
+            full_lines = 0 if end - start <= len(first) else (
+                end - start) // len(first)
+            file.seek(start + full_lines * len(first))
+            last = file.read(end - start - full_lines * len(first))
+        # Trailing blanks of the last string (e.g., of the title) may be missing, as ParmEd reads them.
+        last = last.rstrip() if fortran_format.type is str else last.rstrip(
+            b'\r\n')
+        return full_lines * fortran_format.nitems + -(
+            -len(last) // fortran_format.itemlen)
+
+    def _section(self, flag, count):
+        start, end = self._bounds[flag]
+        if count is None:
+            count = self._count(flag, start, end)
+        return FixedWidthSection(self.file_name, start, end, count,
+                                 self.formats[flag])
+
+    def __contains__(self, flag):
+        return flag in self.formats
+
+    def __getitem__(self, flag):
+        """
+        The section `flag`, as a `FixedWidthSection`.
+        """
+        if flag not in self._sections:
+            self._sections[flag] = self._section(flag, None)
+        return self._sections[flag]
+
+
+def _inpcrd_sections(file_name):
+    """
+    The coordinates of an `inpcrd` file, and the box (or None).
+    """
+    fortran_format = FortranFormat('6F12.7')
+    with open(file_name, 'rb') as file:
+        file.readline()
+        header = file.readline()
+        offset = file.tell()
+        natom = int(header.split()[0])
+        first = file.readline()
+        size = os.path.getsize(file_name)
+        # The last line holds the box, if it is there.
+        file.seek(max(offset, size - 2 * len(first)))
+        last = file.read().rstrip(b'\r\n\t ').rsplit(b'\n', 1)[-1] + b'\n'
+    count = 3 * natom
+    full_lines, rest = divmod(count, fortran_format.nitems)
+    coordinates_end = offset + full_lines * len(first) + (
+        rest * fortran_format.itemlen + len(first) - 72 if rest else 0)
+    coordinates = FixedWidthSection(file_name, offset, coordinates_end, count,
+                                    fortran_format)
+    # Only the coordinates (and velocities, which take the same space) can precede the box.
+    remaining = size - coordinates_end - len(last)
+    box = None
+    if 0 <= remaining and remaining in (0, coordinates_end - offset) and len(
+            last.split()) in (3, 6):
+        box = np.array([
+            float(last[index:index + 12])
+            for index in range(0, len(last.rstrip(b'\r\n')), 12)
+        ])
+        if len(box) == 3:
+            box = np.concatenate([box, [90.0, 90.0, 90.0]])
+    return coordinates, box
+
+
+class InpcrdReader(object):
+    """
+    Random access to the coordinates of an AMBER `inpcrd` file. The box is read from the last line.
+
+    Parameters
+    ----------
+    file_name : str
+        AMBER coordinate file
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._coordinates, self.box = _inpcrd_sections(file_name)
+
+    def __len__(self):
+        return len(self._coordinates) // 3
+
+    def read(self, start=0, stop=None):
+        """
+        Read the coordinates of atoms `start` to `stop` (like a slice).
+
+        Returns
+        -------
+        numpy.ndarray
+            Coordinates (Å), shape `(natom, 3)`
+        """
+        stop = len(self) if stop is None else stop
+        return self._coordinates.read(3 * start, 3 * stop).reshape(-1, 3)
+
+    def chunks(self, size=CHUNK_SIZE):
+        """
+        Read the coordinates `size` atoms at a time.
+        """
+        for start in range(0, len(self), size):
+            yield self.read(start, start + size)
+
+
+def residue_table(prmtop):
+    """
+    The residue names, first atoms, and sizes of a topology (these take a few bytes per residue).
+
+    Parameters
+    ----------
+    prmtop : PrmtopReader
+        Topology
+
+    Returns
+    -------
+    names : list
+        Residue names
+    starts : numpy.ndarray
+        Index of the first atom of each residue
+    sizes : numpy.ndarray
+        Number of atoms in each residue
+    """
+    names = prmtop['RESIDUE_LABEL'].read()
+    starts = prmtop['RESIDUE_POINTER'].read() - 1
+    sizes = np.diff(np.append(starts, prmtop.pointers['NATOM']))
+    return names, starts, sizes
+
+
+def _residue_chunks(starts, sizes, size):
+    """
+    Split the residues into runs of whole residues with about `size` atoms each.
+    """
+    first = 0
+    while first < len(starts):
+        stop = np.searchsorted(starts, starts[first] + size, side='left')
+        last = max(stop, first + 1)
+        yield first, last
+        first = last
+
+
+def _solute_residues(names, resnames):
+    """
+    The indices of the residues named in `resnames`, wherever they are in the system.
+    """
+    resnames = set(resnames)
+    residues = np.flatnonzero([name in resnames for name in names])
+    if not len(residues):
+        raise ValueError(f'There are no {sorted(resnames)} residues.')
+    return residues
+
+
+def _take(values, index):
+    if isinstance(values, list):
+        return [values[i] for i in index]
+    return values[index]
+
+
+def _reindex_terms(chunk, remap):
+    """
+    Keep the bonded terms whose atoms are all in the solute and number their atoms as in the solute. The atom
+    entries are three times the atom index, and their signs (on the last two atoms of a dihedral) are kept.
+    """
+    atoms = np.abs(chunk[:, :-1]) // 3
+    inside = (atoms < len(remap)).all(axis=1)
+    chunk, atoms = chunk[inside], atoms[inside]
+    new = remap[atoms]
+    keep = (new >= 0).all(axis=1)
+    chunk, new = chunk[keep], new[keep]
+    if chunk.shape[1] == 5:
+        # A negative zero cannot mark the last two atoms of a dihedral, so dihedrals that now end on the first
+        # atom are written backwards (the angle is the same), as ParmEd does.
+        backwards = (new[:, 2] == 0) | (new[:, 3] == 0)
+        new[backwards] = new[backwards, ::-1]
+    signs = np.where(chunk[:, :-1] < 0, -1, 1)
+    return np.column_stack([signs * 3 * new, chunk[:, -1]])
+
+
+def read_solute(amber_prmtop, amber_inpcrd, resnames, chunk_size=CHUNK_SIZE):
+    """
+    Load only some residues of a system (e.g., the host and guest) as a ParmEd structure. Sections with one value
+    per atom are read from the first to the last solute atom, and the bonded terms are filtered in chunks, so the
+    solvent is never loaded. Other residues between the solute residues (e.g., dummy atoms in front of the host)
+    are left out.
+
+    Parameters
+    ----------
+    amber_prmtop : str
+        AMBER parameter file
+    amber_inpcrd : str
+        AMBER coordinate file
+    resnames : list
+        Residue names of the solute
+    chunk_size : int
+        Values per chunk of the bonded terms
+
+    Returns
+    -------
+    pmd.Structure
+        The solute, with coordinates (and without a box)
+    """
+    prmtop = PrmtopReader(amber_prmtop)
+    names, starts, sizes = residue_table(prmtop)
+    residues = _solute_residues(names, resnames)
+    nres = len(residues)
+    # The solute atoms lie between `first` and `last`; `index` picks them out of that span.
+    first = int(starts[residues[0]])
+    last = int(starts[residues[-1]] + sizes[residues[-1]])
+    index = np.concatenate([
+        np.arange(starts[residue], starts[residue] + sizes[residue])
+        for residue in residues
+    ]) - first
+    natom = len(index)
+    remap = np.full(last, -1, dtype=np.int64)
+    remap[index + first] = np.arange(natom)
+    logging.info(
+        f'Reading {nres} residues ({natom} atoms) of {amber_prmtop}...')
+
+    total = prmtop.pointers['NATOM']
+    raw = pmd.amber.AmberFormat()
+    pointers = dict(prmtop.pointers)
+    excluded = None
+    for flag in prmtop.flag_list:
+        if flag in ('SOLVENT_POINTERS', 'ATOMS_PER_MOLECULE', 'BOX_DIMENSIONS'):
+            continue
+        section = prmtop[flag]
+        if flag == 'CHARGE':
+            # ParmEd keeps the charges in units of the electron charge.
+            values = section.read(first, last)[index] / AMBER_ELECTROSTATIC
+        elif flag in ATOM_SECTIONS or (flag not in PARAMETER_SECTIONS
+                                     and len(section) == total
+                                     and flag != 'POINTERS'):
+            values = _take(section.read(first, last), index)
+        elif flag == 'RESIDUE_POINTER':
+            values = np.cumsum(np.append(0, sizes[residues][:-1])) + 1
+        elif flag in ('RESIDUE_LABEL', 'RESIDUE_NUMBER', 'RESIDUE_CHAINID',
+                      'RESIDUE_ICODE'):
+            values = _take(section.read(), residues)
+        elif flag in TERM_SECTIONS:
+            width = TERM_SECTIONS[flag][0]
+            terms = []
+            for chunk in section.chunks(chunk_size - chunk_size % width):
+                terms.append(_reindex_terms(chunk.reshape(-1, width), remap))
+            values = np.concatenate(terms).ravel() if terms else np.zeros(
+                0, dtype=np.int64)
+            pointers[TERM_SECTIONS[flag][2]] = len(values) // width
+        elif flag == 'EXCLUDED_ATOMS_LIST':
+            excluded = flag
+            continue
+        else:
+            values = section.read()
+        raw.add_flag(
+            flag,
+            str(prmtop.formats[flag]),
+            data=values if isinstance(values, list) else values.tolist())
+    if excluded is not None:
+        # The excluded atoms are numbered from 1, and an atom without any lists a single 0.
+        counts = prmtop['NUMBER_EXCLUDED_ATOMS'].read(0, last)
+        offsets = np.append(0, np.cumsum(counts))
+        atoms = prmtop[excluded].read(offsets[first], offsets[last])
+        counts, data = [], []
+        for atom in index + first:
+            atom_excluded = atoms[offsets[atom] - offsets[first]:
+                                  offsets[atom + 1] - offsets[first]]
+            atom_excluded = atom_excluded[(atom_excluded > 0)
+                                          & (atom_excluded <= last)]
+            atom_excluded = remap[atom_excluded - 1]
+            atom_excluded = atom_excluded[atom_excluded >= 0] + 1
+            if not len(atom_excluded):
+                atom_excluded = [0]
+            counts.append(len(atom_excluded))
+            data.extend(int(value) for value in atom_excluded)
+        raw.parm_data['NUMBER_EXCLUDED_ATOMS'] = counts
+        raw.add_flag(
+            excluded,
+            str(prmtop.formats[excluded]),
+            data=data,
+            after='DIHEDRALS_WITHOUT_HYDROGEN')
+        pointers['NNB'] = len(data)
+
+    pointers.update(
+        NATOM=natom,
+        NRES=nres,
+        NBONA=pointers['MBONA'],
+        NTHETA=pointers['MTHETA'],
+        NPHIA=pointers['MPHIA'],
+        IFBOX=0,
+        NMXRS=int(sizes[residues].max()))
+    raw.parm_data['POINTERS'] = [
+        int(pointers[key]) for key in POINTERS
+    ] + [int(value) for value in raw.parm_data['POINTERS'][len(POINTERS):]]
+
+    solute = pmd.amber.AmberParm.from_rawdata(raw)
+    solute.coordinates = InpcrdReader(amber_inpcrd).read(first, last)[index]
+    # The Lennard-Jones tables still hold every type of the system, which `AmberParm` slices and copies do not
+    # expect, so the solute is returned as a plain structure.
+    return solute.copy(pmd.Structure)
+
+
+def write_solvent_pdb(amber_prmtop,
+                      amber_inpcrd,
+                      output_pdb,
+                      exclude_resnames,
+                      chunk_size=CHUNK_SIZE):
+    """
+    Write every residue except `exclude_resnames` (e.g., the water, ions, and dummy atoms around the host and
+    guest) to a PDB file, `chunk_size` atoms at a time. This replaces `extract_water_and_ions()` without
+    `cpptraj` and without loading the system; the residues are renumbered from 1 and get no CONECT records.
+
+    Parameters
+    ----------
+    amber_prmtop : str
+        AMBER parameter file
+    amber_inpcrd : str
+        AMBER coordinate file
+    output_pdb : str
+        Output PDB file name
+    exclude_resnames : list
+        Residue names to leave out
+    chunk_size : int
+        Atoms per chunk
+    """
+    logging.info(f'Streaming the solvent of {amber_prmtop} to {output_pdb}...')
+    prmtop = PrmtopReader(amber_prmtop)
+    inpcrd = InpcrdReader(amber_inpcrd)
+    names, starts, sizes = residue_table(prmtop)
+    exclude_resnames = set(exclude_resnames)
+    atom_names = prmtop['ATOM_NAME']
+    atomic_numbers = prmtop[
+        'ATOMIC_NUMBER'] if 'ATOMIC_NUMBER' in prmtop else None
+
+    serial = resnum = 0
+    with open(output_pdb, 'w') as file:
+        if inpcrd.box is not None:
+            file.write('CRYST1{:9.3f}{:9.3f}{:9.3f}{:7.2f}{:7.2f}{:7.2f}               1\n'.format(
+                *inpcrd.box))
+        for first, last in _residue_chunks(starts, sizes, chunk_size):
+            start = int(starts[first])
+            stop = int(starts[last - 1] + sizes[last - 1])
+            chunk_names = atom_names.read(start, stop)
+            coordinates = inpcrd.read(start, stop)
+            elements = atomic_numbers.read(
+                start, stop) if atomic_numbers is not None else np.zeros(
+                    stop - start, dtype=np.int64)
+            lines = []
+            for residue in range(first, last):
+                if names[residue] in exclude_resnames:
+                    continue
+                resnum += 1
+                resname = names[residue][:3]
+                begin = int(starts[residue]) - start
+                for index in range(begin, begin + int(sizes[residue])):
+                    serial += 1
+                    element = pmd.periodic_table.Element[
+                        elements[index]] if elements[index] > 0 else ''
+                    name = chunk_names[index]
+                    if len(name) < 4 and len(element) < 2:
+                        name = ' ' + name
+                    x, y, z = coordinates[index]
+                    lines.append(
+                        f'ATOM  {serial % 100000:5d} {name:<4} {resname:>3}  {resnum % 10000:4d}    '
+                        f'{x:8.3f}{y:8.3f}{z:8.3f}{1.0:6.2f}{0.0:6.2f}          {element.upper():>2}  \n'
+                    )
+                lines.append(
+                    f'TER   {(serial + 1) % 100000:5d}      {resname:>3}  {resnum % 10000:4d} \n'
+                )
+            file.writelines(lines)
+        file.write('END\n')
+
+
+def read_solvent_blocks(amber_prmtop,
+                        amber_inpcrd,
+                        exclude_resnames,
+                        water_model='tip3p',
+                        ion_model='ionsjc_tip3p',
+                        dummy_atoms=False,
+                        chunk_size=CHUNK_SIZE):
+    """
+    Parameterize every residue except `exclude_resnames` from templates (see
+    `solvent.create_water_and_ions_blocks()`), reading the residues and coordinates `chunk_size` atoms at a time.
+    Only the coordinates of the solvent are kept in memory, as one array per block.
+
+    Parameters
+    ----------
+    amber_prmtop : str
+        AMBER parameter file
+    amber_inpcrd : str
+        AMBER coordinate file
+    exclude_resnames : list
+        Residue names to leave out (e.g., the host and guest)
+    water_model : str
+        Water model, one of `solvent.WATER_MODELS`
+    ion_model : str
+        Ion model, one of `solvent.ION_MODELS`
+    dummy_atoms : bool
+        Whether to include dummy atom parameters
+    chunk_size : int
+        Atoms per chunk
+
+    Returns
+    -------
+    list of compact.SolventBlock
+        The blocks, in order
+    """
+    logging.info(f'Streaming the solvent of {amber_prmtop}...')
+    prmtop = PrmtopReader(amber_prmtop)
+    inpcrd = InpcrdReader(amber_inpcrd)
+    names, starts, sizes = residue_table(prmtop)
+    exclude_resnames = set(exclude_resnames)
+    atom_names = prmtop['ATOM_NAME']
+
+    # Runs of identical residues: [key, count, spans of coordinates as [chunk, first, last]].
+    runs = []
+    for first, last in _residue_chunks(starts, sizes, chunk_size):
+        start = int(starts[first])
+        stop = int(starts[last - 1] + sizes[last - 1])
+        chunk_names = atom_names.read(start, stop)
+        coordinates = inpcrd.read(start, stop)
+        for residue in range(first, last):
+            if names[residue] in exclude_resnames:
+                continue
+            begin = int(starts[residue]) - start
+            end = begin + int(sizes[residue])
+            key = (names[residue], tuple(chunk_names[begin:end]))
+            if not runs or runs[-1][0] != key:
+                runs.append([key, 0, []])
+            runs[-1][1] += 1
+            # Consecutive residues of a run are contiguous in the chunk, so only the slice bounds are stored.
+            spans = runs[-1][2]
+            if spans and spans[-1][0] is coordinates and spans[-1][2] == begin:
+                spans[-1][2] = end
+            else:
+                spans.append([coordinates, begin, end])
+
+    templates = dict()
+    blocks = []
+    for key, count, spans in runs:
+        if key not in templates:
+            templates[key] = create_solvent_template(
+                key[0], key[1], water_model, ion_model, dummy_atoms)
+        blocks.append(
+            SolventBlock(
+                templates[key], count,
+                np.concatenate([array[begin:end] for array, begin, end in spans])))
+    return blocks
+
+
+def read_solvent_structure(amber_prmtop,
+                           amber_inpcrd,
+                           exclude_resnames,
+                           water_model='tip3p',
+                           ion_model='ionsjc_tip3p',
+                           dummy_atoms=False,
+                           chunk_size=CHUNK_SIZE):
+    """
+    Like `read_solvent_blocks()`, but return the solvent as one ParmEd structure (see
+    `solvent.structure_from_blocks()`).
+
+    Returns
+    -------
+    pmd.Structure
+        Parameterized water, ions, and dummy atoms
+    """
+    return structure_from_blocks(
+        read_solvent_blocks(amber_prmtop, amber_inpcrd, exclude_resnames,
+                            water_model, ion_model, dummy_atoms, chunk_size))
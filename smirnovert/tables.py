@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Provides a bulk, NumPy view of the atoms in an `OEMol`, so mappings can be applied to whole arrays instead of
+looking up one atom at a time.
+"""
+
+import numpy as np
+
+from .mapping import IndexMap
+
+# One row per atom index. Atom indices that are not in use (e.g., after atoms were deleted) keep `element`
+# set to zero.
+ATOM_DTYPE = np.dtype([
+    ('name', 'U16'),
+    ('element', np.int16),
+    ('type', 'U16'),
+    ('charge', np.float64),
+    ('xyz', np.float64, (3, )),
+    ('resname', 'U16'),
+    ('resnum', np.int32),
+])
+
+
+def read_atoms(mol):
+    """
+    Extract the atoms of a molecule in a single pass.
+
+    Parameters
+    ----------
+    mol : openeye.oechem.OEMol
+        Molecule (or whole system)
+
+    Returns
+    -------
+    table : numpy.ndarray
+        Structured array with `ATOM_DTYPE`, indexed by atom index
+    atoms : list
+        The `OEAtomBase` of each atom index (or None), used to write the table back
+    """
+    # OpenEye is only needed for molecules, so the mapping arrays work without it.
+    from openeye.oechem import OEAtomGetResidue
+
+    size = mol.GetMaxAtomIdx()
+    table = np.zeros(size, dtype=ATOM_DTYPE)
+    atoms = [None] * size
+    coordinates = mol.GetCoords()
+    for atom in mol.GetAtoms():
+        index = atom.GetIdx()
+        residue = OEAtomGetResidue(atom)
+        atoms[index] = atom
+        table[index] = (atom.GetName(), atom.GetAtomicNum(), atom.GetType(),
+                        atom.GetPartialCharge(), coordinates[index],
+                        residue.GetName(), residue.GetResidueNumber())
+    return table, atoms
+
+
+def write_atoms(mol, atoms, table, fields, indices=None):
+    """
+    Write (some of) the columns of an atom table back to a molecule.
+
+    Parameters
+    ----------
+    mol : openeye.oechem.OEMol
+        Molecule that `table` was read from
+    atoms : list
+        The `OEAtomBase` of each atom index, from `read_atoms()`
+    table : numpy.ndarray
+        Structured array with `ATOM_DTYPE`
+    fields : list
+        Columns to write (`xyz` is written for all atoms at once)
+    indices : numpy.ndarray
+        Atom indices to write (defaults to all atoms)
+    """
+    from openeye.oechem import OEAtomGetResidue, OEAtomSetResidue
+
+    if 'xyz' in fields:
+        mol.SetCoords(np.ascontiguousarray(table['xyz']).flatten())
+    per_atom = [field for field in fields if field != 'xyz']
+    if not per_atom:
+        return
+    if indices is None:
+        indices = np.arange(len(table))
+    residue_fields = {'resname', 'resnum'}.intersection(per_atom)
+    for index, row in zip(indices.tolist(), table[indices].tolist()):
+        atom = atoms[index]
+        if atom is None:
+            continue
+        values = dict(zip(ATOM_DTYPE.names, row))
+        if 'name' in per_atom:
+            atom.SetName(values['name'])
+        if 'type' in per_atom:
+            atom.SetType(values['type'])
+        if 'charge' in per_atom:
+            atom.SetPartialCharge(values['charge'])
+        if residue_fields:
+            residue = OEAtomGetResidue(atom)
+            if 'resname' in residue_fields:
+                residue.SetName(values['resname'])
+            if 'resnum' in residue_fields:
+                residue.SetResidueNumber(values['resnum'])
+            OEAtomSetResidue(atom, residue)
+
+
+def mapping_arrays(reference_to_target_mapping):
+    """
+    Split an atom mapping into aligned arrays of reference and target indices.
+
+    Parameters
+    ----------
+    reference_to_target_mapping : IndexMap or dict
+        The mapping between atoms in the reference and target molecules
+
+    Returns
+    -------
+    reference_indices : numpy.ndarray
+    target_indices : numpy.ndarray
+    """
+    if isinstance(reference_to_target_mapping, IndexMap):
+        return (reference_to_target_mapping.reference_indices,
+                reference_to_target_mapping.target_indices)
+    reference_indices = np.fromiter(
+        reference_to_target_mapping.keys(),
+        dtype=np.int64,
+        count=len(reference_to_target_mapping))
+    target_indices = np.fromiter(
+        reference_to_target_mapping.values(),
+        dtype=np.int64,
+        count=len(reference_to_target_mapping))
+    return reference_indices, target_indices
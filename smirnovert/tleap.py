@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+"""
+Provides a long-lived `tleap` process that is driven over its standard input, so the force field files are
+sourced once instead of on every call. Each job writes its own log with `logFile` and ends by opening a marker
+log file: `tleap` runs commands in order, so the job is done once the marker exists.
+"""
+
+import collections as collections
+import itertools as itertools
+import logging as logging
+import os as os
+import shutil as shutil
+import subprocess as sp
+import tempfile as tempfile
+import threading as threading
+import time as time
+import weakref as weakref
+
+
+class TleapError(RuntimeError):
+    """ Raised when a `tleap` job fails or the process exits. """
+
+
+class TleapTimeout(TleapError):
+    """ Raised when a `tleap` job takes longer than the timeout of the worker. """
+
+
+def _terminate(process, directory):
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def quote(file_name):
+    """
+    Quote a file name for `tleap`, as an absolute path.
+    """
+    return '"' + os.path.abspath(file_name) + '"'
+
+
+class TleapWorker(object):
+    """
+    A `tleap` process that runs jobs sent to its standard input. The process is started on the first job, and
+    restarted (with the preamble sourced again) if it exits, in which case the job is sent again, or if a job times
+    out.
+
+    Parameters
+    ----------
+    preamble : list
+        Commands that run once, when the process starts (e.g., `source leaprc.gaff`)
+    timeout : float
+        Seconds a job may take before the process is killed
+    executable : str
+        The `tleap` program
+    retries : int
+        How many times a job is sent again after the process exits during the job
+    setup : callable
+        Called with the working directory of the process before it starts (e.g., to write files that the
+        preamble loads)
+    """
+
+    def __init__(self,
+                 preamble=(),
+                 timeout=600,
+                 executable='tleap',
+                 retries=1,
+                 setup=None):
+        self.preamble = list(preamble)
+        self.timeout = timeout
+        self.executable = executable
+        self.retries = retries
+        self.setup = setup
+        self.process = None
+        self.directory = None
+        self._finalizer = None
+        self._output = collections.deque(maxlen=200)
+        self._jobs = itertools.count()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """
+        Start the process and run the preamble.
+        """
+        self._stop()
+        directory = tempfile.mkdtemp(prefix='smirnovert-tleap-')
+        logging.debug(f'Starting {self.executable} in {directory}...')
+        try:
+            if self.setup is not None:
+                self.setup(directory)
+            self.process = sp.Popen([self.executable, '-s', '-f', '-'],
+                                    cwd=directory,
+                                    stdin=sp.PIPE,
+                                    stdout=sp.PIPE,
+                                    stderr=sp.STDOUT,
+                                    universal_newlines=True,
+                                    bufsize=1)
+        except Exception:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        self.directory = directory
+        # The process is killed and the directory removed if the worker is never closed.
+        self._finalizer = weakref.finalize(self, _terminate, self.process,
+                                           self.directory)
+        # `tleap` output is drained continuously so the pipe never fills up; the last lines are kept for errors.
+        threading.Thread(
+            target=self._drain, args=(self.process, ), daemon=True).start()
+        self._send(self.preamble,
+                   os.path.join(self.directory, 'preamble.log'))
+
+    def _drain(self, process):
+        for line in process.stdout:
+            self._output.append(line.rstrip('\n'))
+
+    def _send(self, commands, log_file):
+        marker = os.path.join(self.directory, f'done-{next(self._jobs)}.log')
+        script = [f'logFile {quote(log_file)}'] + list(commands) + [
+            f'logFile {quote(marker)}'
+        ]
+        try:
+            self.process.stdin.write('\n'.join(script) + '\n')
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise TleapError(f'{self.executable} exited.')
+        deadline = time.time() + self.timeout
+        while not os.path.exists(marker):
+            if self.process.poll() is not None:
+                raise TleapError(
+                    f'{self.executable} exited with status {self.process.returncode}:\n'
+                    + '\n'.join(self._output))
+            if time.time() > deadline:
+                self._stop()
+                raise TleapTimeout(
+                    f'{self.executable} did not finish within {self.timeout} s.'
+                )
+            time.sleep(0.005)
+        os.remove(marker)
+
+    def run(self, commands, log_file):
+        """
+        Run a job and wait for it to finish.
+
+        Parameters
+        ----------
+        commands : list
+            `tleap` commands (file names should be absolute, see `quote()`)
+        log_file : str
+            File that receives the `tleap` output of the job
+
+        Returns
+        -------
+        str
+            The `tleap` output of the job
+        """
+        with self._lock:
+            for attempt in range(self.retries + 1):
+                if not self.running:
+                    self.start()
+                try:
+                    self._send(commands, log_file)
+                    break
+                except TleapTimeout:
+                    raise
+                except TleapError as error:
+                    if self.running or attempt == self.retries:
+                        raise
+                    logging.warning(f'{error}\nRestarting {self.executable}...')
+        with open(log_file, 'r') as file:
+            return file.read()
+
+    def build(self, input_pdb, output_prmtop, output_inpcrd, log_file=None):
+        """
+        Load a PDB file and save its parameters and coordinates (`loadpdb` and `saveamberparm`).
+
+        Parameters
+        ----------
+        input_pdb : str
+            PDB file
+        output_prmtop : str
+            AMBER parameter file
+        output_inpcrd : str
+            AMBER coordinate file
+        log_file : str
+            File that receives the `tleap` output (defaults to `output_prmtop` + `.out`)
+
+        Returns
+        -------
+        str
+            The `tleap` output of the job
+        """
+        for file_name in (output_prmtop, output_inpcrd):
+            if os.path.exists(file_name):
+                os.remove(file_name)
+        output = self.run([
+            f'mol = loadpdb {quote(input_pdb)}',
+            f'saveamberparm mol {quote(output_prmtop)} {quote(output_inpcrd)}'
+        ], log_file or output_prmtop + '.out')
+        if not (os.path.exists(output_prmtop)
+                and os.path.exists(output_inpcrd)):
+            raise TleapError(
+                f'{self.executable} did not write {output_prmtop}:\n{output}')
+        return output
+
+    def _stop(self):
+        if self._finalizer is not None:
+            self._finalizer()
+        self._finalizer = None
+        self.process = None
+        self.directory = None
+
+    def close(self):
+        """
+        Quit `tleap` and remove its working directory.
+        """
+        if self.running:
+            try:
+                self.process.stdin.write('quit\n')
+                self.process.stdin.close()
+                self.process.wait(timeout=10)
+            except (OSError, sp.TimeoutExpired):
+                pass
+        self._stop()
@@ -7,20 +7,36 @@ SMIRNOFF99Frosst.
 import logging as logging
 import subprocess as sp
 import os as os
+import re as re
 import numpy as np
 
 import parmed as pmd
-from networkx.algorithms import isomorphism
 from openeye.oechem import (
     oemolistream, oemolostream, OEIFlavor_MOL2_Forcefield,
     OEIFlavor_Generic_Default, OEIFlavor_PDB_Default, OEIFlavor_PDB_ALL,
     OEFormat_MOL2, OEFormat_MOL2H, OEWriteMolecule, OETriposAtomNames, OEMol,
-    OEFormat_PDB, OESmilesToMol, OEAddExplicitHydrogens, OEHasAtomIdx,
-    OEAtomGetResidue)
+    OEFormat_PDB, OESmilesToMol, OEAddExplicitHydrogens)
 from openforcefield.typing.engines.smirnoff import (
     ForceField, generateTopologyFromOEMol, generateGraphFromTopology)
 
+from .cache import MappingCache
+from .cpptraj import CpptrajScript
+from .mapping import IndexMap, map_atoms_by_component
+from .mdin import rewrite_mdin_text
+from .profiling import profiled
+from .restraints import rewrite_restraints, stream_namelists
+from .restart import NETCDF_MAGIC, read_restart, write_restart
+from .tables import mapping_arrays, read_atoms, write_atoms
+from .tleap import TleapError, TleapWorker
 
+# Residues that are written without CONECT records (water and monatomic ions).
+SOLVENT_RESNAMES = {
+    'WAT', 'HOH', 'TIP3', 'SOL', 'Li+', 'Na+', 'K+', 'Rb+', 'Cs+', 'F-', 'Cl-',
+    'Br-', 'I-', 'Mg2+', 'Ca2+', 'Zn2+', 'NA', 'CL', 'K', 'MG', 'CA', 'ZN'
+}
+
+
+@profiled()
 def load_mol2(filename, name=None, add_tripos=True, flavor='FF'):
     """
     Converts a `mol2` file to an `OEMol` object.
@@ -79,6 +95,7 @@ def save_mol2(molecule, filename):
         logging.error(f'Unable to open {filename} for writing...')
 
 
+@profiled()
 def convert_mol2_to_sybyl_openeye(input_mol2, output_mol2):
     """
     Convert an otherwise formatted `mol2` file into a `mol2` file with SYBYL atom types.
@@ -95,6 +112,7 @@ def convert_mol2_to_sybyl_openeye(input_mol2, output_mol2):
     save_mol2(structure, output_mol2)
 
 
+@profiled()
 def check_bond_lengths(structure, threshold):
     """
     Print out any equilibrium bond lengths above a certain threshold, to make sure all the assigned parameters are sensible.
@@ -121,6 +139,7 @@ def check_bond_lengths(structure, threshold):
         logging.debug('Structure looks good.')
 
 
+@profiled(tool='antechamber')
 def convert_mol2_to_sybyl_antechamber(input_mol2,
                                       output_mol2,
                                       ac_doctor=False,
@@ -175,7 +194,7 @@ def convert_mol2_to_sybyl_antechamber(input_mol2,
                 'ATOMTYPE.INF'
         ]:
             try:
-                os.remove(temp)
+                os.remove(os.path.join(path, temp))
             except OSError:
                 pass
     elif p.returncode == 1:
@@ -190,6 +209,7 @@ def convert_mol2_to_sybyl_antechamber(input_mol2,
         logging.error(f'Error: {error}')
 
 
+@profiled()
 def load_pdb(filename, name=None, add_tripos=True):
     """
     Converts a `pdb` file to an `OEMol` object. By default, this will read dummy atoms.
@@ -234,15 +254,15 @@ def check_unique_atom_names(molecule):
     molecule : openeye.oechem.OEMol
     """
     logging.info('Checking all atoms have unique names...')
-    atoms = molecule.GetMaxAtomIdx()
-    atom_names = set()
-    for atom in range(atoms):
-        atom_names.add(molecule.GetAtom(OEHasAtomIdx(atom)).GetName())
+    table, _ = read_atoms(molecule)
+    atoms = len(table)
+    atom_names = np.unique(table['name'])
     logging.debug(
         f'{atoms} atoms in structure, {len(atom_names)} unique atom names.')
     assert atoms == len(atom_names)
 
 
+@profiled(tool='cpptraj')
 def create_pdb_with_conect(solvated_pdb, amber_prmtop, output_pdb, path='./'):
     """
     Create a PDB file containing CONECT records.
@@ -259,39 +279,12 @@ def create_pdb_with_conect(solvated_pdb, amber_prmtop, output_pdb, path='./'):
         Directory for input and output files
     """
     logging.info(f'Creating {output_pdb} with CONECT records...')
-    cpptraj = \
-        f'''
-    parm {amber_prmtop}
-    trajin {solvated_pdb}
-    trajout {output_pdb} conect
-    '''
-
-    cpptraj_input = output_pdb + '.in'
-    cpptraj_output = output_pdb + '.out'
-
-    with open(os.path.join(path, cpptraj_input), 'w') as file:
-        file.write(cpptraj)
-    with open(os.path.join(path, cpptraj_output), 'w') as file:
-        p = sp.Popen(
-            ['cpptraj', '-i', cpptraj_input],
-            cwd=path,
-            stdout=file,
-            stderr=file)
-        output, error = p.communicate()
-    if p.returncode == 0:
-        logging.debug('PDB file written by cpptraj.')
-    elif p.returncode == 1:
-        logging.error('Error returned by cpptraj.')
-        logging.error(f'Output: {output}')
-        logging.error(f'Error: {error}')
-        p = sp.Popen(['cat', cpptraj_output], cwd=path, stdout=sp.PIPE)
-        for line in p.stdout:
-            logging.error(line.decode("utf-8").strip(), )
-    else:
-        logging.error(f'Output: {output}')
-        logging.error(f'Error: {error}')
+    script = CpptrajScript(amber_prmtop, solvated_pdb)
+    script.add(output_pdb, conect=True)
+    script.run(output_pdb, path=path)
 
 
+@profiled()
 def prune_conect(input_pdb, output_pdb, path='./'):
     """
     Deletes CONECT records that correspond only to water molecules.
@@ -307,29 +300,91 @@ def prune_conect(input_pdb, output_pdb, path='./'):
     """
     logging.info(f'Pruning water-water CONECT records...')
 
-    p = sp.Popen(['grep', '-m 1', 'WAT', input_pdb], cwd=path, stdout=sp.PIPE)
-    for line in p.stdout:
-        first_water_residue = int(float(line.decode("utf-8").split()[1]))
-        logging.debug(f'First water residue = {first_water_residue}')
-
-    p = sp.Popen(
-        ['egrep', '-n', f'CONECT [ ]* {first_water_residue}', input_pdb],
-        cwd=path,
-        stdout=sp.PIPE)
-    for line in p.stdout:
-        line_to_delete_from = int(float(line.decode("utf-8").split(':')[0]))
-        logging.debug(
-            f'Found first water CONECT entry at line = {line_to_delete_from}')
-
-    with open(os.path.join(path, output_pdb), 'w') as file:
-        sp.Popen(
-            ['awk', f'NR < {line_to_delete_from}', input_pdb],
-            cwd=path,
-            stdout=file)
+    first_water_atom = None
+    with open(os.path.join(path, input_pdb), 'r') as pdb, \
+            open(os.path.join(path, output_pdb), 'w') as file:
+        for line in pdb:
+            if first_water_atom is None and line.startswith('ATOM') and \
+                    line[17:21].strip() == 'WAT':
+                first_water_atom = int(line[6:11])
+                logging.debug(f'First water atom = {first_water_atom}')
+            if line.startswith('CONECT') and first_water_atom is not None and \
+                    int(line[6:11]) >= first_water_atom:
+                logging.debug(
+                    f'Found first water CONECT entry = {line.strip()}')
+                break
+            if line.startswith('END'):
+                break
+            file.write(line)
+        file.write('END\n')
 
-        sp.Popen(['echo', 'END'], cwd=path, stdout=file)
 
+@profiled()
+def write_pdb_with_conect(structure,
+                          output_pdb,
+                          solvent_resnames=SOLVENT_RESNAMES):
+    """
+    Write a standards-compliant PDB file with CONECT records for every residue except the solvent
+    (the equivalent of `create_pdb_with_conect()` followed by `prune_conect()`, without `cpptraj`).
+    Atom serial numbers follow the atom order of the structure, as in `cpptraj` output.
+    Parameters
+    ----------
+    structure : pmd.Structure
+        Structure with bonds and coordinates (e.g., loaded from the reference `prmtop` and `inpcrd`)
+    output_pdb : str
+        Output PDB file name
+    solvent_resnames : set
+        Residue names that do not get CONECT records (water and ions)
+    """
+    logging.info(f'Writing {output_pdb} with CONECT records...')
+    coordinates = structure.coordinates
+    bonded = set()
+    for bond in structure.bonds:
+        bonded.add((bond.atom1.residue.idx, bond.atom2.residue.idx))
+        bonded.add((bond.atom2.residue.idx, bond.atom1.residue.idx))
 
+    with open(output_pdb, 'w') as file:
+        if structure.box is not None:
+            file.write('CRYST1{:9.3f}{:9.3f}{:9.3f}{:7.2f}{:7.2f}{:7.2f}               1\n'.format(
+                *structure.box))
+        lines = []
+        for residue in structure.residues:
+            resname = residue.name[:3]
+            resnum = (residue.idx + 1) % 10000
+            for atom in residue.atoms:
+                element = pmd.periodic_table.Element[atom.atomic_number] \
+                    if atom.atomic_number > 0 else ''
+                if len(atom.name) < 4 and len(element) < 2:
+                    name = ' ' + atom.name
+                else:
+                    name = atom.name
+                x, y, z = coordinates[atom.idx]
+                lines.append(
+                    f'ATOM  {(atom.idx + 1) % 100000:5d} {name:<4} {resname:>3}  {resnum:4d}    '
+                    f'{x:8.3f}{y:8.3f}{z:8.3f}{1.0:6.2f}{0.0:6.2f}          {element.upper():>2}  \n'
+                )
+            next_residue = residue.idx + 1
+            if next_residue == len(structure.residues) or \
+                    (residue.idx, next_residue) not in bonded:
+                lines.append(
+                    f'TER   {(residue.atoms[-1].idx + 2) % 100000:5d}      {resname:>3}  {resnum:4d} \n'
+                )
+            if len(lines) > 10000:
+                file.writelines(lines)
+                lines = []
+        file.writelines(lines)
+
+        for atom in structure.atoms:
+            if atom.residue.name in solvent_resnames or not atom.bond_partners:
+                continue
+            partners = sorted(partner.idx + 1 for partner in atom.bond_partners)
+            for start in range(0, len(partners), 4):
+                file.write(f'CONECT{atom.idx + 1:5d}' + ''.join(
+                    f'{partner:5d}' for partner in partners[start:start + 4]) + '\n')
+        file.write('END\n')
+
+
+@profiled(tool='cpptraj')
 def extract_dummy_atoms(amber_prmtop,
                         amber_inpcrd,
                         dummy_residue,
@@ -352,40 +407,12 @@ def extract_dummy_atoms(amber_prmtop,
 
     logging.info(f'Extracting {dummy_residue} from {amber_prmtop}...')
 
-    cpptraj = \
-        f'''
-    parm {amber_prmtop}
-    trajin {amber_inpcrd}
-    strip !{dummy_residue}
-    trajout {output_pdb}
-        '''
-
-    cpptraj_input = output_pdb + '.in'
-    cpptraj_output = output_pdb + '.out'
-
-    with open(os.path.join(path, cpptraj_input), 'w') as file:
-        file.write(cpptraj)
-    with open(os.path.join(path, cpptraj_output), 'w') as file:
-        p = sp.Popen(
-            ['cpptraj', '-i', cpptraj_input],
-            cwd=path,
-            stdout=file,
-            stderr=file)
-        output, error = p.communicate()
-    if p.returncode == 0:
-        logging.debug('Dummy atom PDB file written by cpptraj.')
-    elif p.returncode == 1:
-        logging.error('Error returned by cpptraj.')
-        logging.error(f'Output: {output}')
-        logging.error(f'Error: {error}')
-        p = sp.Popen(['cat', cpptraj_output], cwd=path, stdout=sp.PIPE)
-        for line in p.stdout:
-            logging.error(line.decode("utf-8").strip(), )
-    else:
-        logging.error(f'Output: {output}')
-        logging.error(f'Error: {error}')
+    script = CpptrajScript(amber_prmtop, amber_inpcrd)
+    script.add(output_pdb, strip=f'!{dummy_residue}')
+    script.run(output_pdb, path=path)
 
 
+@profiled(tool='cpptraj')
 def extract_water_and_ions(amber_prmtop,
                            amber_inpcrd,
                            host_residue,
@@ -415,62 +442,66 @@ def extract_water_and_ions(amber_prmtop,
     """
     logging.info(f'Extracting water and ions from {amber_prmtop}...')
 
-    if dummy_atoms is True:
-        cpptraj = \
-            f'''
-parm {amber_prmtop}
-trajin {amber_inpcrd}
-strip {host_residue}
-strip {guest_residue}
-trajout {output_pdb}
-            '''
+    script = CpptrajScript(amber_prmtop, amber_inpcrd)
+    script.add(
+        output_pdb,
+        strip=water_and_ions_strip_mask(host_residue, guest_residue,
+                                        dummy_atoms))
+    script.run(output_pdb, path=path)
 
-    else:
-        cpptraj = \
-            f'''
-parm {amber_prmtop}
-trajin {amber_inpcrd}
-strip {host_residue}
-strip {guest_residue}
-strip {dummy_atoms}
-trajout {output_pdb}
-            '''
 
-    cpptraj_input = output_pdb + '.in'
-    cpptraj_output = output_pdb + '.out'
+def water_and_ions_strip_mask(host_residue, guest_residue, dummy_atoms=True):
+    """
+    The AMBER mask of the atoms that `extract_water_and_ions()` leaves out.
+    Parameters
+    ----------
+    host_residue : str
+        Residue name of the host molecule (with colon)
+    guest_residue : str
+        Residue name of the guest molecule (with colon)
+    dummy_atoms : bool or str
+        If `True`, keep the dummy atoms; otherwise, the mask of the dummy atoms to leave out
 
-    with open(os.path.join(path, cpptraj_input), 'w') as file:
-        file.write(cpptraj)
-    with open(os.path.join(path, cpptraj_output), 'w') as file:
-        p = sp.Popen(
-            ['cpptraj', '-i', cpptraj_input],
-            cwd=path,
-            stdout=file,
-            stderr=file)
-        output, error = p.communicate()
-    if p.returncode == 0:
-        logging.debug('Water and ion PDB file written by cpptraj.')
-    elif p.returncode == 1:
-        logging.error('Error returned by cpptraj.')
-        logging.error(f'Output: {output}')
-        logging.error(f'Error: {error}')
-        p = sp.Popen(['cat', cpptraj_output], cwd=path, stdout=sp.PIPE)
-        for line in p.stdout:
-            logging.error(line.decode("utf-8").strip(), )
-    else:
-        logging.error(f'Output: {output}')
-        logging.error(f'Error: {error}')
+    Returns
+    -------
+    str
+        The mask, e.g. `:CB7|:MOL`
+    """
+    masks = [host_residue, guest_residue]
+    if dummy_atoms is not True:
+        masks.append(dummy_atoms)
+    return '|'.join(masks)
 
 
+@profiled(tool='tleap')
 def create_dummy_atom_parameters(input_pdb,
                                  output_prmtop,
                                  output_inpcrd,
-                                 path='./'):
-    """[summary]
-    
+                                 path='./',
+                                 worker=None):
+    """
+    Create AMBER coordinates and parameters for the dummy atoms.
+    `tleap` must be in your PATH.
+    Parameters
+    ----------
+    input_pdb : str
+        PDB structure containing the dummy atoms
+    output_prmtop : str
+        AMBER parameters for the dummy atoms
+    output_inpcrd : str
+        AMBER coordinates for the dummy atoms
+    path : str
+        Directory for input and output files
+    worker : tleap.TleapWorker
+        A persistent `tleap` process with the dummy atom parameters loaded (see `create_tleap_worker()`) to run the
+        job in, instead of starting `tleap`
     """
 
     logging.info('Creating parameters for dummy atoms...')
+    if worker is not None:
+        _build_with_worker(worker, input_pdb, output_prmtop, output_inpcrd,
+                           path)
+        return
     write_dummy_atom_frcmod(file_name='frcmod.dum', path=path)
     write_dummy_atom_mol2(file_name='dum.mol2', path=path)
     tleap = \
@@ -515,13 +546,72 @@ def create_dummy_atom_parameters(input_pdb,
         logging.error(f'Error: {error}')
 
 
+def create_tleap_worker(water_model='tip3p',
+                        ion_model='ionsjc_tip3p',
+                        dummy_atoms=False,
+                        timeout=600):
+    """
+    Start a persistent `tleap` process with the force field files of `create_water_and_ions_parameters()`
+    sourced once. Pass it as `worker` to `create_water_and_ions_parameters()` (or, with `dummy_atoms`, to
+    `create_dummy_atom_parameters()`) to skip the start-up of `tleap` on every call.
+
+    Parameters
+    ----------
+    water_model : str
+        Water model, must match AMBER `leaprc.water` and `frcmod`files
+    ion_model : str
+        Ion model, must match AMBER `leaprc.water` and `frcmod`files
+    dummy_atoms : bool
+        Whether to load the dummy atom parameters
+    timeout : float
+        Seconds a single job may take
+
+    Returns
+    -------
+    tleap.TleapWorker
+        The worker (the process starts with the first job)
+    """
+    preamble = [
+        'source leaprc.protein.ff14sb', f'source leaprc.water.{water_model}',
+        'source leaprc.gaff', f'loadamberparams frcmod.{water_model}',
+        f'loadamberparams frcmod.{ion_model}'
+    ]
+    if dummy_atoms:
+        preamble += ['loadamberparams frcmod.dum', 'DUM = loadmol2 dum.mol2']
+
+    def write_dummy_atom_files(directory):
+        write_dummy_atom_frcmod(file_name='frcmod.dum', path=directory)
+        write_dummy_atom_mol2(file_name='dum.mol2', path=directory)
+
+    return TleapWorker(
+        preamble,
+        timeout=timeout,
+        setup=write_dummy_atom_files if dummy_atoms else None)
+
+
+def _build_with_worker(worker, input_pdb, output_prmtop, output_inpcrd, path):
+    try:
+        worker.build(
+            os.path.join(path, input_pdb),
+            os.path.join(path, output_prmtop),
+            os.path.join(path, output_inpcrd),
+            log_file=os.path.join(path, output_prmtop + '.out'))
+        logging.debug('Parameters and coordinates written by tleap.')
+    except TleapError as error:
+        logging.error('Error returned by tleap.')
+        for line in str(error).splitlines():
+            logging.error(line)
+
+
+@profiled(tool='tleap')
 def create_water_and_ions_parameters(input_pdb,
                                      output_prmtop,
                                      output_inpcrd,
                                      water_model='tip3p',
                                      ion_model='ionsjc_tip3p',
                                      dummy_atoms=False,
-                                     path='./'):
+                                     path='./',
+                                     worker=None):
     """
     Create AMBER coordinates and parameters for just the water and ions.
     `tleap` must be in your PATH.
@@ -541,8 +631,15 @@ def create_water_and_ions_parameters(input_pdb,
         Whether to include dummy atoms parameters
     path : str
         Directory for input and output files
+    worker : tleap.TleapWorker
+        A persistent `tleap` process with the same water and ion models (see `create_tleap_worker()`) to run the
+        job in, instead of starting `tleap`
     """
     logging.info(f'Creating parameters for the waters and ions...')
+    if worker is not None:
+        _build_with_worker(worker, input_pdb, output_prmtop, output_inpcrd,
+                           path)
+        return
 
     if dummy_atoms:
         write_dummy_atom_frcmod(file_name='frcmod.dum', path=path)
@@ -705,9 +802,11 @@ def process_smiles(string, name=None, add_hydrogens=True, add_tripos=True):
     return mol
 
 
-def map_atoms(reference_mol, target_mol):
+@profiled()
+def map_atoms(reference_mol, target_mol, cache=None):
     """
     Maps between a reference molecule and target molecule using maximum common substructure. For more information, see the example here: https://github.com/openforcefield/openforcefield/blob/6229a51ad77fd5cf20299e53bc9784811cb9443a/openforcefield/typing/engines/smirnoff/forcefield.py#L350
+    The molecules are matched one connected component at a time (see `mapping.map_atoms_by_component()`), so identical water molecules do not blow up the isomorphism search.
     
     Parameters:
     ----------
@@ -715,75 +814,101 @@ def map_atoms(reference_mol, target_mol):
         Reference molecule for mapping
     target_mol : openeye.oechem.OEMol
         Target molecule for mapping
+    cache : str or cache.MappingCache
+        If set, reuse the mapping computed earlier for the same pair of topologies (e.g., by another APR
+        window) and store newly computed mappings
     Returns
     -------
-    dictionary
+    mapping.IndexMap
         The mapping between atom numbers in each molecule
     """
-    logging.info(f'Generating map between atoms...')
-    reference_topology = create_topology(reference_mol)
-    target_topology = create_topology(target_mol)
-
-    reference_graph = create_graph(reference_topology)
-    target_graph = create_graph(target_topology)
+    if cache is not None:
+        if not isinstance(cache, MappingCache):
+            cache = MappingCache(cache)
+        fingerprints = cache.fingerprints('atoms', reference_mol, target_mol)
+        reference_to_target_mapping = cache.get(fingerprints)
+        if reference_to_target_mapping is None:
+            reference_to_target_mapping = map_atoms(reference_mol, target_mol)
+            if reference_to_target_mapping:
+                cache.put(fingerprints, reference_to_target_mapping)
+        return reference_to_target_mapping
 
-    reference_to_target_mapping = dict()
-    graph_matcher = isomorphism.GraphMatcher(reference_graph, target_graph)
-    if graph_matcher.is_isomorphic():
+    logging.info(f'Generating map between atoms...')
+    reference_to_target_mapping = map_atoms_by_component(reference_mol, target_mol)
+    if reference_to_target_mapping and logging.getLogger().isEnabledFor(logging.DEBUG):
         logging.debug('Determining mapping...')
         logging.debug('Reference → Target')
-        for (reference_atom, target_atom) in graph_matcher.mapping.items():
-            reference_to_target_mapping[reference_atom] = target_atom
-            reference_name = reference_mol.GetAtom(
-                OEHasAtomIdx(reference_atom)).GetName()
-            target_name = target_mol.GetAtom(
-                OEHasAtomIdx(target_atom)).GetName()
+        reference_names = read_atoms(reference_mol)[0]['name']
+        target_names = read_atoms(target_mol)[0]['name']
+        for (reference_atom, target_atom) in reference_to_target_mapping.items():
+            reference_name = reference_names[reference_atom]
+            target_name = target_names[target_atom]
             logging.debug(f'({reference_name:5} {reference_atom:3d} → '
                           f'{target_atom:3d} ({target_name:5})')
-    else:
-        logging.error('Graph is not isomorphic.')
 
     return reference_to_target_mapping
 
 
-def map_residues(reference_to_target_mapping, reference_mol, target_mol):
+@profiled()
+def map_residues(reference_to_target_mapping,
+                 reference_mol,
+                 target_mol,
+                 cache=None):
     """
     Maps between a reference molecule and target molecule using an existing atom mapping. For more information, see the example here: https://github.com/openforcefield/openforcefield/blob/6229a51ad77fd5cf20299e53bc9784811cb9443a/openforcefield/typing/engines/smirnoff/forcefield.py#L350
     
     Parameters:
     ----------
-    reference_to_target_mapping : dict
+    reference_to_target_mapping : mapping.IndexMap
         Atom mapping calculated using `map_atoms()`
     reference_mol : openeye.oechem.OEMol
         Reference molecule for mapping
     target_mol : openeye.oechem.OEMol
         Target molecule for mapping
+    cache : str or cache.MappingCache
+        If set, reuse the mapping computed earlier for the same pair of topologies and atom mapping
     Returns
     -------
-    dictionary
+    mapping.IndexMap
         The mapping between residue numbers in each molecule
     """
-    logging.info(f'Generating map between residues...')
+    if cache is not None:
+        if not isinstance(cache, MappingCache):
+            cache = MappingCache(cache)
+        fingerprints = cache.fingerprints('residues', reference_mol,
+                                          target_mol,
+                                          reference_to_target_mapping)
+        reference_to_target_residue_mapping = cache.get(fingerprints)
+        if reference_to_target_residue_mapping is None:
+            reference_to_target_residue_mapping = map_residues(
+                reference_to_target_mapping, reference_mol, target_mol)
+            cache.put(fingerprints, reference_to_target_residue_mapping)
+        return reference_to_target_residue_mapping
 
-    reference_to_target_residue_mapping = dict()
-    logging.debug('Reference → Target')
-    for (reference_atom, target_atom) in reference_to_target_mapping.items():
-        reference = reference_mol.GetAtom(OEHasAtomIdx(reference_atom))
-        reference_name = reference.GetName()
-        reference_residue = OEAtomGetResidue(reference)
-        reference_resname = reference_residue.GetName()
-        reference_resnum = reference_residue.GetResidueNumber()
-
-        target = target_mol.GetAtom(OEHasAtomIdx(target_atom))
-        target_name = target.GetName()
-        target_residue = OEAtomGetResidue(target)
-        target_resname = target_residue.GetName()
-        target_resnum = target_residue.GetResidueNumber()
-        reference_to_target_residue_mapping[reference_resnum] = target_resnum
+    logging.info(f'Generating map between residues...')
 
-        logging.debug(
-            f'{reference_name:5} {reference_resname:5} ({reference_atom:4d}) {reference_resnum:4d} # → {target_resnum:4d} ({target_atom:4d}) {target_name:5} {target_resname:5}'
-        )
+    reference_table, _ = read_atoms(reference_mol)
+    target_table, _ = read_atoms(target_mol)
+    reference_indices, target_indices = mapping_arrays(
+        reference_to_target_mapping)
+    reference_resnums = reference_table['resnum'][reference_indices]
+    target_resnums = target_table['resnum'][target_indices]
+    reference_to_target_residue_mapping = IndexMap(
+        np.full(
+            reference_resnums.max() + 1 if len(reference_resnums) else 0, -1))
+    # If atoms of one reference residue map to different target residues, the last one wins.
+    reference_to_target_residue_mapping.targets[
+        reference_resnums] = target_resnums
+
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug('Reference → Target')
+        for reference_atom, target_atom in zip(reference_indices,
+                                               target_indices):
+            reference = reference_table[reference_atom]
+            target = target_table[target_atom]
+            logging.debug(
+                f'{reference["name"]:5} {reference["resname"]:5} ({reference_atom:4d}) {reference["resnum"]:4d} # → {target["resnum"]:4d} ({target_atom:4d}) {target["name"]:5} {target["resname"]:5}'
+            )
 
     return reference_to_target_residue_mapping
 
@@ -796,13 +921,14 @@ def create_graph(topology):
     return generateGraphFromTopology(topology)
 
 
+@profiled()
 def remap_charges(reference_to_target_mapping, reference_mol, target_mol):
     """Copies charges from a reference molecule to a target molecule.
     
     Parameters:
     ----------
-    reference_to_target_mapping : dict
-        The dictionary containing the mapping between atoms in the reference and target molecules
+    reference_to_target_mapping : mapping.IndexMap
+        The mapping between atoms in the reference and target molecules
     reference_mol : openeye.oechem.OEMol
         Reference molecule
     target_mol : openeye.oechem.OEMol
@@ -813,31 +939,21 @@ def remap_charges(reference_to_target_mapping, reference_mol, target_mol):
         The target molecule with charges from the reference molecule
     """
     logging.info('Remapping charges...')
-    logging.debug('Existing → New')
     assert reference_mol.GetMaxAtomIdx() == target_mol.GetMaxAtomIdx()
-    for (reference_atom, target_atom) in reference_to_target_mapping.items():
-        reference = reference_mol.GetAtom(OEHasAtomIdx(reference_atom))
-        reference_chg = reference.GetPartialCharge()
-
-        target = target_mol.GetAtom(OEHasAtomIdx(target_atom))
-        # This will be zero, if the target molecule was built from SMILES
-        target_chg = target.GetPartialCharge()
-        target_name = target.GetName()
-
-        target.SetPartialCharge(reference_chg)
-        logging.debug(
-            f'({target_name:4}) {target_chg:+04f} → {target.GetPartialCharge():+04f}'
-        )
+    # This will be zero, if the target molecule was built from SMILES
+    _remap_fields(reference_to_target_mapping, reference_mol, target_mol,
+                  ['charge'])
     return target_mol
 
 
+@profiled()
 def remap_names(reference_to_target_mapping, reference_mol, target_mol):
     """Copies atom names from the reference molecule to the target molecule.
     
     Parameters:
     ----------
-    reference_to_target_mapping : dict
-        The dictionary containing the mapping between atoms in the reference and target molecules
+    reference_to_target_mapping : mapping.IndexMap
+        The mapping between atoms in the reference and target molecules
     reference_mol : openeye.oechem.OEMol
         Reference molecule
     target_mol : openeye.oechem.OEMol
@@ -849,26 +965,20 @@ def remap_names(reference_to_target_mapping, reference_mol, target_mol):
     """
 
     logging.info('Remapping atom names...')
-    logging.debug('Reference → Target')
     assert reference_mol.GetMaxAtomIdx() == target_mol.GetMaxAtomIdx()
-    for (reference_atom, target_atom) in reference_to_target_mapping.items():
-        reference = reference_mol.GetAtom(OEHasAtomIdx(reference_atom))
-        reference_name = reference.GetName()
-
-        target = target_mol.GetAtom(OEHasAtomIdx(target_atom))
-        target_name = target.GetName()
-        target.SetName(reference_name)
-        logging.debug(f'{reference_name:4} → {target_name:4}')
+    _remap_fields(reference_to_target_mapping, reference_mol, target_mol,
+                  ['name'])
     return target_mol
 
 
+@profiled()
 def remap_type(reference_to_target_mapping, reference_mol, target_mol):
     """Copies atom types from the reference molecule to the target molecule.
     
     Parameters:
     ----------
-    reference_to_target_mapping : dict
-        The dictionary containing the mapping between atoms in the reference and target molecules
+    reference_to_target_mapping : mapping.IndexMap
+        The mapping between atoms in the reference and target molecules
     reference_mol : openeye.oechem.OEMol
         Reference molecule
     target_mol : openeye.oechem.OEMol
@@ -879,30 +989,21 @@ def remap_type(reference_to_target_mapping, reference_mol, target_mol):
         The target molecule with atom types from the reference molecule
     """
     logging.info('Remapping atom types...')
-    logging.debug('Existing → New')
     assert reference_mol.GetMaxAtomIdx() == target_mol.GetMaxAtomIdx()
-    for (reference_atom, target_atom) in reference_to_target_mapping.items():
-        reference = reference_mol.GetAtom(OEHasAtomIdx(reference_atom))
-        reference_type = reference.GetType()
-
-        target = target_mol.GetAtom(OEHasAtomIdx(target_atom))
-        # This will be None, if the target molecule was built from SMILES
-        target_type = target.GetType()
-        target_name = target.GetName()
-
-        target.SetType(reference_type)
-        logging.debug(
-            f'({target_name:4}) {target_type:4} → {target.GetType():4}')
+    # This will be None, if the target molecule was built from SMILES
+    _remap_fields(reference_to_target_mapping, reference_mol, target_mol,
+                  ['type'])
     return target_mol
 
 
+@profiled()
 def remap_coordinates(reference_to_target_mapping, reference_mol, target_mol):
     """Copies atom coordinates from the reference molecule to the target molecule.
     
     Parameters:
     ----------
-    reference_to_target_mapping : dict
-        The dictionary containing the mapping between atoms in the reference and target molecules
+    reference_to_target_mapping : mapping.IndexMap
+        The mapping between atoms in the reference and target molecules
     reference_mol : openeye.oechem.OEMol
         Reference molecule
     target_mol : openeye.oechem.OEMol
@@ -913,19 +1014,17 @@ def remap_coordinates(reference_to_target_mapping, reference_mol, target_mol):
         The target molecule with atom coordinates from the reference molecule
     """
     logging.info('Remapping coordinates...')
-    logging.debug('Existing → New')
     assert reference_mol.GetMaxAtomIdx() == target_mol.GetMaxAtomIdx()
-    mapped_coordinates = np.zeros((reference_mol.GetMaxAtomIdx(), 3))
-    reference_coordinates = reference_mol.GetCoords()
-    for (reference_atom, target_atom) in reference_to_target_mapping.items():
-        mapped_coordinates[target_atom] = reference_coordinates[reference_atom]
-        current_coordinates = target_mol.GetCoords()[target_atom]
-        logging.debug(
-            f'{current_coordinates} → {mapped_coordinates[target_atom]}')
-    target_mol.SetCoords(mapped_coordinates.flatten())
+    # Atoms that are not in the mapping end up at the origin.
+    _remap_fields(
+        reference_to_target_mapping,
+        reference_mol,
+        target_mol, ['xyz'],
+        clear=True)
     return target_mol
 
 
+@profiled()
 def remap_residues(reference_to_target_mapping,
                    reference_mol,
                    target_mol,
@@ -934,8 +1033,8 @@ def remap_residues(reference_to_target_mapping,
     
     Parameters:
     ----------
-    reference_to_target_mapping : dict
-        The dictionary containing the mapping between atoms in the reference and target molecules
+    reference_to_target_mapping : mapping.IndexMap
+        The mapping between atoms in the reference and target molecules
     reference_mol : openeye.oechem.OEMol
         Reference molecule
     target_mol : openeye.oechem.OEMol
@@ -948,39 +1047,50 @@ def remap_residues(reference_to_target_mapping,
         The target molecule with residue name and number from the reference molecule
     """
     logging.info('Remapping residue names and numbers...')
-    logging.debug('Existing → New')
     assert reference_mol.GetMaxAtomIdx() == target_mol.GetMaxAtomIdx()
-    # It's not clear to me that we have to loop over all the atoms in the molecule,
-    # if OpenEye knows they are connected properly, then setting the residue name
-    # and residue number for one atom should be enough, but keeping this loop
-    # seems safe and won't be a bottleneck.
-    for (reference_atom, target_atom) in reference_to_target_mapping.items():
-        reference = reference_mol.GetAtom(OEHasAtomIdx(reference_atom))
-        reference_residue = OEAtomGetResidue(reference)
-        reference_resname = reference_residue.GetName()
-        reference_resnum = reference_residue.GetResidueNumber()
-        # I believe this gets set to 'UNL' if OpenEye can't recognize the residue name.
-        # Thus, I'm adding an override to manually set the residue name.
-
-        target = target_mol.GetAtom(OEHasAtomIdx(target_atom))
-        target_name = target.GetName()
-        target_residue = OEAtomGetResidue(target)
-        target_resname = target_residue.GetName()
-        target_resnum = target_residue.GetResidueNumber()
-
-        if resname is not None:
-            target_residue.SetName(resname)
-        else:
-            target_residue.SetName(reference_resname)
-        target_residue.SetResidueNumber(reference_resnum)
-
-        logging.debug(
-            f'({target_name:4}) {target_resname:4} {target_resnum:4} → '
-            f'{target_residue.GetName():4} {target_residue.GetResidueNumber():4}'
-        )
+    # I believe the residue name gets set to 'UNL' if OpenEye can't recognize the residue name.
+    # Thus, there is an override to manually set the residue name.
+    _remap_fields(
+        reference_to_target_mapping,
+        reference_mol,
+        target_mol, ['resname', 'resnum'],
+        resname=resname)
     return target_mol
 
 
+def _remap_fields(reference_to_target_mapping,
+                  reference_mol,
+                  target_mol,
+                  fields,
+                  clear=False,
+                  resname=None):
+    """
+    Copy columns of the reference atom table to the mapped target atoms in one vectorized assignment, then
+    write the changed atoms back to the target molecule once.
+    """
+    reference_table, _ = read_atoms(reference_mol)
+    target_table, target_atoms = read_atoms(target_mol)
+    reference_indices, target_indices = mapping_arrays(
+        reference_to_target_mapping)
+    previous = target_table[target_indices].copy()
+    for field in fields:
+        if clear:
+            target_table[field] = 0
+        target_table[field][target_indices] = reference_table[field][
+            reference_indices]
+    if resname is not None:
+        target_table['resname'][target_indices] = resname
+    write_atoms(target_mol, target_atoms, target_table, fields,
+                target_indices)
+
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug('Existing → New')
+        for old, new in zip(previous, target_table[target_indices]):
+            logging.debug(f'({old["name"]:4}) ' +
+                          ' '.join(f'{old[field]}' for field in fields) +
+                          ' → ' + ' '.join(f'{new[field]}' for field in fields))
+
+
 def parse_residue_name(input_mol2, path='./'):
     """Extract the residue name from a `mol2` file.
     
@@ -1005,6 +1115,7 @@ def parse_residue_name(input_mol2, path='./'):
     return None
 
 
+@profiled()
 def split_topology(file_name):
     """Split a file into component topology using ParmEd.
     
@@ -1018,6 +1129,7 @@ def split_topology(file_name):
     return topology.split()
 
 
+@profiled()
 def create_host_guest_topology(components, host_resname, guest_resname):
     """Return the topology components belonging the host and guest only.
     
@@ -1045,6 +1157,7 @@ def create_host_guest_topology(components, host_resname, guest_resname):
     return topology
 
 
+@profiled(tool='cpptraj')
 def create_host_mol2(solvated_pdb, amber_prmtop, mask, output_mol2, path='./'):
     """
     Create a `mol2` file for the host (useful if the host is composed of multiple residues).
@@ -1063,68 +1176,85 @@ def create_host_mol2(solvated_pdb, amber_prmtop, mask, output_mol2, path='./'):
         Directory for input and output files
     """
     logging.info('Writing a `mol2` for the host molecule...')
-    cpptraj = \
-        f'''
-    parm {amber_prmtop}
-    trajin {solvated_pdb}
-    mask ":{mask}" maskmol2 {output_mol2}
-    '''
+    script = CpptrajScript(amber_prmtop, solvated_pdb)
+    script.add(output_mol2, strip=f'!:{mask}')
+    script.run(output_mol2, path=path)
 
-    cpptraj_input = output_mol2 + '.in'
-    cpptraj_output = output_mol2 + '.out'
 
-    with open(os.path.join(path, cpptraj_input), 'w') as file:
-        file.write(cpptraj)
-    with open(os.path.join(path, cpptraj_output), 'w') as file:
-        p = sp.Popen(
-            ['cpptraj', '-i', cpptraj_input],
-            cwd=path,
-            stdout=file,
-            stderr=file)
-        output, error = p.communicate()
-    if p.returncode == 0:
-        logging.debug('MOL2 file written by cpptraj.')
-    elif p.returncode == 1:
-        logging.error('Error returned by cpptraj.')
-        logging.error(f'Output: {output}')
-        logging.error(f'Error: {error}')
-        p = sp.Popen(['cat', cpptraj_output], cwd=path, stdout=sp.PIPE)
-        for line in p.stdout:
-            logging.error(line.decode("utf-8").strip(), )
-    else:
-        logging.error(f'Output: {output}')
-        logging.error(f'Error: {error}')
-    # Since `cpptraj` writes the frame number as suffix, move back to desired file name.
-    p = sp.Popen(
-        ['mv', output_mol2 + '.1', output_mol2], cwd=path, stdout=sp.PIPE)
+@profiled(tool='cpptraj')
+def extract_with_cpptraj(amber_prmtop,
+                         amber_inpcrd,
+                         outputs,
+                         name='cpptraj',
+                         path='./'):
+    """
+    Write several parts of a structure (e.g., the host and guest `mol2` files and the water and ions PDB) in a
+    single `cpptraj` run, so the parameters and coordinates are only read once (see `cpptraj.CpptrajScript`).
+    `cpptraj` must be in your PATH.
+    Parameters
+    ----------
+    amber_prmtop : str
+        Existing AMBER parameter file
+    amber_inpcrd : str
+        Existing AMBER coordinate file
+    outputs : list
+        Pairs of output file name and AMBER mask of the atoms to leave out (None to write every atom), e.g.
+        `[('CB7.mol2', '!:CB7'), ('water_ions.pdb', ':CB7|:MOL')]`; the format follows the extension
+    name : str
+        Base name of the `cpptraj` input and output files
+    path : str
+        Directory for input and output files
+    """
+    logging.info(f'Extracting {len(outputs)} files from {amber_prmtop}...')
+    script = CpptrajScript(amber_prmtop, amber_inpcrd)
+    for file_name, strip in outputs:
+        script.add(file_name, strip=strip)
+    script.run(name, path=path)
 
 
+@profiled()
 def copy_box_vectors(input_inpcrd, output_inpcrd, path='./'):
-    """    
-    Copy the last line of an existing AMBER `inpcrd` file containing the box vectors and angles to a new `inpcrd`. This helps when the box vector information has been lost. This runs with `shell=True`, so it could be dangerous; I was unable to get this to work with `sp.Popen()`.
+    """
+    Copy the box vectors and angles of an existing AMBER restart file to a new one. This helps when the box vector
+    information has been lost. Both files are read in memory (ASCII `inpcrd` or NetCDF `ncrst`, detected from the
+    contents), and the target is rewritten in its own format with the reference box, replacing any box it has.
 
     Parameters:
     ----------
     input_inpcrd : str
-        File name of reference `inpcrd`
+        File name of reference restart file
     output_inpcrd : str
-        File name of target `inpcrd`
+        File name of target restart file
+    path : str
+        Directory of both files
     """
-    logging.info(
-        f'Manually copying the last line of {input_inpcrd} to {output_inpcrd}...'
-    )
-    sp.call(
-        [f'tail -n 1 {input_inpcrd} >> {output_inpcrd}'], cwd=path, shell=True)
-
-
+    logging.info(f'Copying the box of {input_inpcrd} to {output_inpcrd}...')
+    _, box = read_restart(os.path.join(path, input_inpcrd))
+    if box is None:
+        raise ValueError(f'{input_inpcrd} has no box.')
+    target = os.path.join(path, output_inpcrd)
+    coordinates, _ = read_restart(target)
+    with open(target, 'rb') as file:
+        netcdf = file.read(4).startswith(NETCDF_MAGIC)
+    write_restart(
+        target,
+        coordinates,
+        box=box,
+        format='ncrst' if netcdf else 'inpcrd',
+        overwrite=True)
+
+
+@profiled()
 def rewrite_restraints_file(reference_restraints,
                             target_restraints,
                             reference_to_target_mapping,
+                            reference_to_target_residue_mapping=None,
                             path='./'):
     """
-    Rewrite an existing AMBER restraint file using the *atom* mapping between the two structures. Only the field `iat= ` is modified. 
-    
-    Caveat: this function assumes a fixed-width format of the restraint file (i.e., 18 characters between `iat= ` and `r1= ` -- which works well for us, here -- although I do not believe that is a firm requirement on the AMBER side of things.
+    Rewrite an existing AMBER restraint file using the *atom* mapping between the two structures. The atom numbers
+    of each `&rst` group (`iat=`, `igr1=`, and `igr2=`) are rewritten wherever they are in the group (see
+    `restraints.rewrite_restraints()`), and, if the residue mapping is given, so are the masks on the
+    `#AnchorAtoms` line. Use `restraints.rewrite_restraints_tree()` to rewrite every window at once.
 
     Parameters:
     ----------
@@ -1132,37 +1262,15 @@ def rewrite_restraints_file(reference_restraints,
         File name of reference restraints file
     target_restraits : str
         File name of target restraints file
-    reference_to_target_mapping : dict
-        The dictionary containing the mapping between atoms in the reference and target molecules
+    reference_to_target_mapping : mapping.IndexMap
+        The mapping between atoms in the reference and target molecules
+    reference_to_target_residue_mapping : mapping.IndexMap
+        The mapping between residues in the reference and target molecules
     """
     logging.info(f'Writing AMBER restraints file using atom mapping...')
-    # First, read the existing file...
-    with open(reference_restraints, 'r') as disang:
-        lines = []
-        for line in disang:
-            lines.append(line)
-
-    # Next, rewrite using the fact that Niel has a fixed width for the atom index section...
-    with open(target_restraints, 'w') as my_disang:
-        my_disang.write(lines[0])
-        for line in lines[1:]:
-            old_restraint_list = line.split()[2]
-            old_restraint_residues = [
-                int(i) for i in old_restraint_list.split(',') if i is not ''
-            ]
-
-            new_restraint_residues = []
-            for atom_index in old_restraint_residues:
-                new_restraint_residues.append(
-                    reference_to_target_mapping[atom_index - 1] + 1)
-            # Join the residues with commas
-            new_restraint_string = ','.join(
-                [str(i) for i in new_restraint_residues])
-            logging.debug(
-                f'{old_restraint_list:18} → {new_restraint_string:18}')
-            new_line = line[0:10] + '{0: <18}'.format(
-                new_restraint_string) + line[27:]
-            my_disang.write(new_line)
+    rewrite_restraints(reference_restraints, target_restraints,
+                       reference_to_target_mapping,
+                       reference_to_target_residue_mapping)
 
 
 def repartition_hydrogen_mass(prmtop):
@@ -1200,14 +1308,18 @@ def check_hydrogen_mass(prmtop):
             return atom.mass
 
 
+@profiled()
 def rewrite_amber_input_file(reference_input,
                              target_input,
                              reference_to_target_mapping,
                              dt_override=False,
                              target_prmtop=None,
-                             path='./'):
+                             path='./',
+                             reference_to_target_atom_mapping=None):
     """
-    Rewrite an existing AMBER simulation input file using the *residue* mapping between the two structures. Only the positional restraints, specified by `restraintmask` are rewritten.
+    Rewrite an existing AMBER simulation input file using the *residue* mapping between the two structures. Every
+    mask-valued key (`restraintmask`, `bellymask`, `timask1`, ...; see `mdin.MASK_KEYS`) is rewritten with
+    `masks.translate_mask()`. Use `mdin.rewrite_mdin_tree()` to rewrite the input files of every window at once.
     
     Parameters:
     ----------
@@ -1215,82 +1327,37 @@ def rewrite_amber_input_file(reference_input,
         File name of reference restraints file
     target_input : str
         File name of target restraints file
-    reference_to_target_mapping : dict
-        The dictionary containing the mapping between residues in the reference and target molecules
+    reference_to_target_mapping : mapping.IndexMap
+        The mapping between residues in the reference and target molecules
     dt_override : bool
-        Whether to rewrite the time step line with `dt = 0.002`
+        Whether to rewrite the time step with `dt = 0.002`
     target_prmtop : pmd.structure
         ParmEd structured used to repartition hydrogen masses if `dt = 0.004` is requested
+    reference_to_target_atom_mapping : mapping.IndexMap
+        The mapping between atoms in the reference and target molecules, if any mask selects atoms by number
     """
     logging.info(f'Writing AMBER input file using residue mapping...')
-    # First, read the existing file...
-    with open(reference_input, 'r') as file:
-        lines = []
-        for line in file:
-            lines.append(line)
-
-    with open(target_input, 'w') as file:
-        for line_number, line in enumerate(lines):
-            # This should gracefully just copy the reference to the target if there are no positional restraints...
-            if 'restraintmask' in line:
-                restraint_mask = line.split()[2:]
-                restraint_mask_line = line_number
-            elif dt_override and 'dt' in line:
-                lines[line_number] = '  dt = 0.002,\n'
-            elif not dt_override and 'dt = 0.004' in line:
-                h_mass = check_hydrogen_mass(target_prmtop)
-                if h_mass < 1.1:
-                    repartition_hydrogen_mass(target_prmtop)
-                else:
-                    logging.debug(
-                        f'Detected hydrogen mass of {h_mass} amu, assuming HMR...'
-                    )
+
+    def rewrite(text):
+        # Raises `IncompleteGroup` (before anything else is done) until the namelist group is complete.
+        text = rewrite_mdin_text(text, reference_to_target_mapping,
+                                 reference_to_target_atom_mapping)
+        if dt_override:
+            return re.sub(r'\bdt\s*=\s*[^,\s/]+', 'dt = 0.002', text)
+        if re.search(r'\bdt\s*=\s*0\.004\b', text):
+            h_mass = check_hydrogen_mass(target_prmtop)
+            if h_mass < 1.1:
+                repartition_hydrogen_mass(target_prmtop)
             else:
-                pass
+                logging.debug(
+                    f'Detected hydrogen mass of {h_mass} amu, assuming HMR...')
+        return text
+
+    stream_namelists(reference_input, target_input, rewrite)
 
-        new_masks = []
-        for mask in restraint_mask:
-            # Detect the residue mask by the colon...
-            if ':' in mask:
-                # Get rid of the preceeding apostrophe...
-                if "'" in mask:
-                    mask = mask.replace("'", "")
-                # Get rid of the comma...
-                if "," in mask:
-                    mask = mask.replace(",", "")
-                # Now, I expect that we should have one or more masks joined by '|'
-                # Split each mask into one ore more residues...
-                if '-' in mask[1:]:
-                    # If the mask is a range, parse each residue separately...
-                    residues = split('-', mask[1:])
-                    new_residues = []
-                    for residue in residues:
-                        new_residue = reference_to_target_mapping[int(residue)]
-                        new_residues.append(str(new_residue))
-                else:
-                    # If the mask is atom-based, we only want to modify the residue portion...
-                    residues = split('@', mask[1:])
-                    new_residues = []
-                    for residue in residues[:1]:
-                        new_residue = reference_to_target_mapping[int(residue)]
-                        new_residues.append(str(new_residue))
-                if len(new_residues) > 1:
-                    new_mask = ':' + '-'.join(new_residues)
-                else:
-                    new_mask = ':' + new_residues[0] + '@' + residues[1:][0]
-                new_masks.append(new_mask)
-
-        new_restraint_mask = '\'' + ' | '.join(new_masks) + '\'' + ','
-        logging.debug(f'{restraint_mask} → {new_restraint_mask}')
-        # Rewrite this single line in `lines` array containing the contents of the reference file...
-        lines[
-            restraint_mask_line] = '  restraintmask = ' + new_restraint_mask + '\n'
-        for line in lines:
-            file.write(line)
 
 
 def split(delimiters, string, maxsplit=0):
     # https://stackoverflow.com/a/13184791
-    import re
     regexPattern = '|'.join(map(re.escape, delimiters))
-    return re.split(regexPattern, string, maxsplit)
\ No newline at end of file
+    return re.split(regexPattern, string, maxsplit)
@@ -0,0 +1,45 @@
+import os as os
+
+import parmed as pmd
+import pytest
+
+from smirnovert.amber import create_mapping, remap_atom_types
+
+CB7 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cb7-1')
+
+
+@pytest.mark.parametrize('prmtop', ['cb7-1.prmtop', 'hg.prmtop'])
+def test_collapse_and_remap(prmtop, tmpdir):
+    structure = pmd.load_file(os.path.join(CB7, prmtop))
+    host_mapping, guest_mapping = create_mapping(
+        structure, 'CB7', 'MOL', collapse=True)
+    unique_mapping = create_mapping(structure, 'CB7', 'MOL')
+    assert len(set(host_mapping.values()) | set(guest_mapping.values())) < (
+        len(unique_mapping[0]) + len(unique_mapping[1]))
+
+    destination = str(tmpdir) + os.sep
+    remap_atom_types(structure, 'CB7', host_mapping, 'MOL', guest_mapping,
+                     destination)
+
+    # The `frcmod` holds one set of parameters per combination of types, which must match every term.
+    remapped = pmd.load_file(destination + 'smirnoff-unique.prmtop')
+    parameters = pmd.amber.AmberParameterSet(
+        destination + 'smirnoff-unique.frcmod')
+    for bond in remapped.bonds:
+        expected = parameters.bond_types[bond.atom1.type, bond.atom2.type]
+        assert (bond.type.k, bond.type.req) == pytest.approx(
+            (expected.k, expected.req), abs=1e-3)
+    for angle in remapped.angles:
+        expected = parameters.angle_types[angle.atom1.type, angle.atom2.type,
+                                          angle.atom3.type]
+        assert (angle.type.k, angle.type.theteq) == pytest.approx(
+            (expected.k, expected.theteq), abs=1e-3)
+
+    # Every guest residue, but only the first host residue, is written on its own.
+    for resname in ('MOL', 'CB7'):
+        single = pmd.load_file(destination + f'smirnoff-{resname}-unique.mol2')
+        residues = [
+            residue for residue in remapped.residues if residue.name == resname
+        ]
+        expected = residues if resname == 'MOL' else residues[:1]
+        assert len(single.atoms) == sum(len(residue) for residue in expected)
@@ -0,0 +1,37 @@
+import os as os
+import shutil as shutil
+
+import numpy as np
+
+from smirnovert.cache import MappingCache
+from smirnovert.mapping import IndexMap
+
+
+def test_mapping_cache(tmpdir):
+    cache = MappingCache(str(tmpdir))
+    fingerprints = np.array(['atoms', 'reference', 'target'])
+    mapping = IndexMap([2, 0, 1, -1])
+    assert cache.get(fingerprints) is None
+    cache.put(fingerprints, mapping)
+    assert cache.get(fingerprints).targets.tolist() == [2, 0, 1, -1]
+    assert os.listdir(str(tmpdir)) == [os.path.basename(cache.path(fingerprints))]
+
+
+def test_mapping_cache_rejects_stale_entries(tmpdir):
+    cache = MappingCache(str(tmpdir))
+    fingerprints = np.array(['atoms', 'reference', 'target'])
+    other = np.array(['atoms', 'reference', 'other target'])
+    cache.put(other, IndexMap([1, 0]))
+    # An entry for other topologies at the path of this request, e.g., after a hash collision.
+    shutil.move(cache.path(other), cache.path(fingerprints))
+    assert cache.get(fingerprints) is None
+    assert not os.path.exists(cache.path(fingerprints))
+
+
+def test_mapping_cache_removes_unreadable_entries(tmpdir):
+    cache = MappingCache(str(tmpdir))
+    fingerprints = np.array(['residues', 'reference', 'target', 'mapping'])
+    with open(cache.path(fingerprints), 'wb') as file:
+        file.write(b'not a mapping')
+    assert cache.get(fingerprints) is None
+    assert not os.path.exists(cache.path(fingerprints))
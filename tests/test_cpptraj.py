@@ -0,0 +1,33 @@
+import pytest
+
+from smirnovert.cpptraj import CpptrajScript
+
+
+def test_script():
+    script = CpptrajScript('cb7-1.prmtop', 'cb7-1.rst7')
+    script.add('CB7.mol2', strip='!:CB7').add(
+        'MOL.mol2', strip='!:MOL').add(
+            'water_ions.pdb', strip=':CB7,MOL', conect=True).add('full.ncrst')
+    assert script.output_files == [
+        'CB7.mol2', 'MOL.mol2', 'water_ions.pdb', 'full.ncrst'
+    ]
+    assert script.script() == ('parm cb7-1.prmtop\n'
+                               'trajin cb7-1.rst7\n'
+                               'strip !:CB7\n'
+                               'outtraj CB7.mol2 mol2\n'
+                               'unstrip\n'
+                               'strip !:MOL\n'
+                               'outtraj MOL.mol2 mol2\n'
+                               'unstrip\n'
+                               'strip :CB7,MOL\n'
+                               'outtraj water_ions.pdb pdb conect\n'
+                               'unstrip\n'
+                               'outtraj full.ncrst ncrestart\n')
+
+
+def test_format():
+    script = CpptrajScript('cb7-1.prmtop', 'cb7-1.rst7')
+    script.add('host.crd', format='restart')
+    assert script.script().endswith('outtraj host.crd restart\n')
+    with pytest.raises(ValueError):
+        script.add('host.xyz')
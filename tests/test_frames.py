@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from smirnovert.frames import first_frame, read_frames
+from smirnovert.restart import write_restart
+
+NATOM = 7
+
+
+def _write_mdcrd(file_name, frames, boxes, ending):
+    lines = ['Trajectory written by a test']
+    for coordinates, box in zip(frames, boxes):
+        values = coordinates.ravel()
+        for first in range(0, len(values), 10):
+            lines.append(''.join(
+                f'{value:8.3f}' for value in values[first:first + 10]))
+        if box is not None:
+            lines.append(''.join(f'{value:8.3f}' for value in box[:3]))
+    with open(file_name, 'w', newline='') as file:
+        file.write(ending.join(lines) + ending)
+
+
+@pytest.mark.parametrize('ending', ['\n', '\r\n'])
+@pytest.mark.parametrize('box', [None, [30.5, 31.25, 32.0]])
+def test_mdcrd(box, ending, tmpdir):
+    random = np.random.RandomState(0)
+    frames = [random.uniform(-99, 99, (NATOM, 3)).round(3) for _ in range(3)]
+    boxes = [box] * len(frames)
+    file_name = str(tmpdir.join('frames.mdcrd'))
+    _write_mdcrd(file_name, frames, boxes, ending)
+
+    read = list(read_frames(file_name, NATOM))
+    assert len(read) == len(frames)
+    for (coordinates, read_box), expected in zip(read, frames):
+        assert np.allclose(coordinates, expected)
+        if box is None:
+            assert read_box is None
+        else:
+            assert np.allclose(read_box, box + [90.0, 90.0, 90.0])
+    with pytest.raises(ValueError):
+        list(read_frames(file_name, NATOM + 1))
+
+
+def test_restarts(tmpdir):
+    random = np.random.RandomState(1)
+    frames = [random.uniform(-99, 99, (NATOM, 3)) for _ in range(2)]
+    file_names = []
+    for index, coordinates in enumerate(frames):
+        file_names.append(str(tmpdir.join(f'frame{index}.inpcrd')))
+        write_restart(file_names[-1], coordinates)
+    read = [coordinates for coordinates, _ in read_frames(file_names, NATOM)]
+    assert np.allclose(read, frames)
+    coordinates, box = first_frame(file_names[0], NATOM)
+    assert np.allclose(coordinates, frames[0])
+    assert box is None
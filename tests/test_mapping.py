@@ -0,0 +1,115 @@
+import os as os
+
+import networkx as nx
+import numpy as np
+import parmed as pmd
+import pytest
+
+from smirnovert.mapping import (IndexMap, component_invariant,
+                                component_signature, map_indices,
+                                match_component, split_components)
+from smirnovert.tables import mapping_arrays
+
+CB7 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cb7-1')
+
+
+def test_inverse_and_compose():
+    mapping = IndexMap.from_dict({0: 2, 1: 0, 3: 1})
+    assert mapping == {0: 2, 1: 0, 3: 1}
+    assert 2 not in mapping
+    assert mapping.map([3, 0]).tolist() == [1, 2]
+    with pytest.raises(KeyError):
+        mapping.map([2])
+
+    inverse = mapping.inverse()
+    assert inverse == {2: 0, 0: 1, 1: 3}
+    assert mapping.compose(inverse) == {0: 0, 1: 1, 3: 3}
+    assert inverse.compose(mapping) == {0: 0, 1: 1, 2: 2}
+    # Indices that are lost in either step are unmapped.
+    assert mapping.compose(IndexMap.from_dict({2: 5})) == {0: 5}
+
+
+def test_validate():
+    IndexMap([1, 2, 0]).validate(size=3)
+    IndexMap([1, -1, 0]).validate()
+    with pytest.raises(ValueError):
+        IndexMap([1, 1, 0]).validate()
+    with pytest.raises(ValueError):
+        IndexMap([1, 1, 0]).inverse()
+    with pytest.raises(ValueError):
+        IndexMap([1, -1, 0]).validate(size=3)
+    with pytest.raises(ValueError):
+        IndexMap([1, 3, 0]).validate(size=3)
+
+
+def test_save_and_load(tmpdir):
+    mapping = IndexMap.from_dict({0: 4, 2: 1, 5: 0}, size=7)
+    file_name = str(tmpdir.join('mapping.npy'))
+    mapping.save(file_name)
+    loaded = IndexMap.load(file_name)
+    assert loaded.targets.dtype == np.int32
+    assert loaded.targets.tolist() == [4, -1, 1, -1, -1, 0, -1]
+    assert loaded == mapping
+
+
+def _graph(structure, order=None):
+    # Atom `i` of the structure becomes node `order[i]`.
+    order = range(len(structure.atoms)) if order is None else order
+    graph = nx.Graph()
+    for atom in structure.atoms:
+        graph.add_node(order[atom.idx], element=atom.atomic_number)
+    for bond in structure.bonds:
+        graph.add_edge(order[bond.atom1.idx], order[bond.atom2.idx])
+    return graph
+
+
+def test_components():
+    structure = pmd.load_file(os.path.join(CB7, 'cb7-1.prmtop'))
+    reference = _graph(structure)
+    # The same system with the atoms of the guest in reverse order.
+    guest = [atom.idx for atom in structure.residues[1].atoms]
+    order = list(range(len(structure.atoms)))
+    order[guest[0]:guest[-1] + 1] = guest[::-1]
+    target = _graph(structure, order)
+
+    components = split_components(reference)
+    assert [len(nodes) for nodes in components[:3]] == [
+        len(residue.atoms) for residue in structure.residues[:3]
+    ]
+    assert components == split_components(target)
+    elements = nx.get_node_attributes(reference, 'element')
+    target_elements = nx.get_node_attributes(target, 'element')
+    waters = [
+        nodes for nodes in components
+        if structure.atoms[nodes[0]].residue.name == 'WAT'
+    ]
+    assert len({
+        component_signature(reference, elements, nodes) for nodes in waters
+    }) == 1
+    assert len({
+        component_invariant(reference, elements, nodes) for nodes in waters
+    }) == 1
+
+    host, guest = components[:2]
+    assert component_invariant(reference, elements, guest) == (
+        component_invariant(target, target_elements, guest))
+    assert component_signature(reference, elements, guest) != (
+        component_signature(target, target_elements, guest))
+    mapping = match_component(reference, guest, target, guest)
+    assert sorted(mapping) == guest
+    assert all(elements[atom] == target_elements[mapping[atom]]
+               for atom in guest)
+    assert all(
+        target.has_edge(mapping[atom1], mapping[atom2])
+        for atom1, atom2 in reference.subgraph(guest).edges())
+    assert match_component(reference, host, target, guest) is None
+
+
+def test_mapping_arrays():
+    mapping = {4: 0, 0: 2, 2: 1}
+    for reference_to_target in (mapping, IndexMap.from_dict(mapping)):
+        reference, target = mapping_arrays(reference_to_target)
+        assert dict(zip(reference.tolist(), target.tolist())) == mapping
+        assert map_indices(reference_to_target, [2, 4]).tolist() == [1, 0]
+        with pytest.raises(KeyError):
+            map_indices(reference_to_target, [1])
@@ -0,0 +1,58 @@
+import os as os
+
+import pytest
+
+from smirnovert.masks import translate_mask
+from smirnovert.mdin import MDIN_PATTERNS, rewrite_mdin, rewrite_mdin_tree
+
+A_BAM_P = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'a-bam-p', 'original')
+MDIN_FILES = ['mini.in', 'therm1.in', 'therm2.in', 'eqnpt.in', 'mdin']
+IDENTITY = {number: number for number in range(1, 1000)}
+
+
+def _read(file_name):
+    with open(file_name, 'rb') as file:
+        return file.read()
+
+
+@pytest.mark.parametrize('file_name', MDIN_FILES)
+def test_identity_is_byte_identical(file_name, tmpdir):
+    target = str(tmpdir.join(file_name))
+    rewrite_mdin(os.path.join(A_BAM_P, file_name), target, IDENTITY)
+    assert _read(target) == _read(os.path.join(A_BAM_P, file_name))
+
+
+def test_shifted_mapping(tmpdir):
+    rewritten = rewrite_mdin_tree(
+        A_BAM_P,
+        str(tmpdir), {number: number + 2
+                      for number in range(1, 1000)},
+        patterns=MDIN_PATTERNS,
+        workers=1)
+    assert sorted(os.path.basename(file_name)
+                  for file_name in rewritten) == sorted(MDIN_FILES)
+    for file_name in MDIN_FILES:
+        reference = _read(os.path.join(A_BAM_P, file_name)).decode()
+        target = _read(str(tmpdir.join(file_name))).decode()
+        if ":1-3 | :10@C4 | :10@N1" in reference:
+            expected = reference.replace(':1-3 | :10@C4 | :10@N1',
+                                         ':3-5 | :12@C4 | :12@N1')
+        else:
+            expected = reference.replace("':1-3'", "':3-5'")
+        assert target == expected
+
+
+def test_translate_mask_splits_ranges():
+    mapping = {1: 1, 2: 2, 3: 7, 4: 8, 5: 3}
+    assert translate_mask(':1-5', mapping) == ':1-3,7-8'
+    assert translate_mask(':1-2,5@C1,H2', mapping) == ':1-2,3@C1,H2'
+    assert translate_mask('(:3-4 & !@H=) | :WAT', mapping) == (
+        '(:7-8 & !@H=) | :WAT')
+    atoms = {0: 10, 1: 11, 2: 5}
+    assert translate_mask('@1-3', atom_mapping=atoms) == '@6,11-12'
+    assert translate_mask(':2@1', mapping, atoms) == ':2@11'
+    with pytest.raises(ValueError):
+        translate_mask(':1-6', mapping)
+    with pytest.raises(ValueError):
+        translate_mask('@1', mapping)
@@ -0,0 +1,72 @@
+import os as os
+
+import numpy as np
+import parmed as pmd
+import pytest
+
+from smirnovert.compact import SolventBlock
+from smirnovert.prmtop import POINTERS, merge_topologies, write_prmtop
+from smirnovert.solvent import (create_water_and_ions_blocks,
+                                structure_from_blocks)
+
+CB7 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cb7-1')
+
+
+def _lennard_jones(parm):
+    # The A coefficient of the pair of types of every two atoms (of the first atom of each type).
+    ntypes = parm.ptr('NTYPES')
+    index = np.asarray(parm.parm_data['NONBONDED_PARM_INDEX']).reshape(
+        ntypes, ntypes) - 1
+    types = np.asarray(parm.parm_data['ATOM_TYPE_INDEX']) - 1
+    _, first = np.unique(types, return_index=True)
+    atoms = types[np.sort(first)]
+    return np.asarray(
+        parm.parm_data['LENNARD_JONES_ACOEF'])[index[np.ix_(atoms, atoms)]]
+
+
+def _bonds(parm):
+    return sorted((bond.atom1.idx, bond.atom2.idx, round(bond.type.k, 4),
+                   round(bond.type.req, 4)) for bond in parm.bonds)
+
+
+def test_merge_topologies(tmpdir):
+    reference = pmd.load_file(
+        os.path.join(CB7, 'cb7-1.prmtop'), xyz=os.path.join(CB7, 'cb7-1.rst7'))
+    host_guest = pmd.load_file(
+        os.path.join(CB7, 'hg.prmtop'), xyz=os.path.join(CB7, 'hg.inpcrd'))
+    chloride, water = create_water_and_ions_blocks(reference['!:CB7,MOL'])
+    # Two blocks of the same water template, which must share its types and parameters.
+    blocks = [
+        SolventBlock(water.template, 700, water.coordinates[:2100]), chloride,
+        SolventBlock(water.template, 800, water.coordinates[2100:])
+    ]
+
+    merged = os.path.join(str(tmpdir), 'merged.prmtop')
+    write_prmtop(
+        merged,
+        merge_topologies(
+            [(host_guest, 1)] + [(block.template, block.count)
+                                 for block in blocks],
+            box=reference.box))
+    expected = host_guest + structure_from_blocks(blocks)
+    expected.box = reference.box
+    expected.save(os.path.join(str(tmpdir), 'expected.prmtop'))
+
+    merged = pmd.amber.AmberParm(merged)
+    expected = pmd.amber.AmberParm(os.path.join(str(tmpdir), 'expected.prmtop'))
+    for pointer in ('NATOM', 'NTYPES', 'NBONH', 'MBONA', 'NTHETH', 'MTHETA',
+                    'NPHIH', 'MPHIA', 'NNB', 'NRES', 'IFBOX'):
+        assert merged.parm_data['POINTERS'][POINTERS.index(
+            pointer)] == expected.parm_data['POINTERS'][POINTERS.index(pointer)]
+    for flag in ('ATOM_NAME', 'AMBER_ATOM_TYPE', 'ATOM_TYPE_INDEX',
+                 'RESIDUE_LABEL', 'RESIDUE_POINTER', 'NUMBER_EXCLUDED_ATOMS',
+                 'EXCLUDED_ATOMS_LIST', 'SOLVENT_POINTERS',
+                 'ATOMS_PER_MOLECULE'):
+        assert merged.parm_data[flag] == expected.parm_data[flag], flag
+    assert merged.parm_data['CHARGE'] == pytest.approx(
+        expected.parm_data['CHARGE'])
+    assert np.allclose(
+        _lennard_jones(merged), _lennard_jones(expected), rtol=1e-6)
+    assert _bonds(merged) == _bonds(expected)
+    assert len(merged.angles) == len(expected.angles)
+    assert len(merged.dihedrals) == len(expected.dihedrals)
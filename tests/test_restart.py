@@ -0,0 +1,34 @@
+import os as os
+
+import numpy as np
+import parmed as pmd
+import pytest
+
+from smirnovert.restart import read_restart, write_restart
+
+CB7 = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cb7-1')
+
+
+def test_read_restart():
+    coordinates, box = read_restart(os.path.join(CB7, 'cb7-1.rst7'))
+    expected = pmd.load_file(os.path.join(CB7, 'cb7-1.rst7'))
+    assert np.allclose(coordinates, expected.coordinates.reshape(-1, 3))
+    assert np.allclose(box, expected.box)
+
+
+@pytest.mark.parametrize('extension', ['.inpcrd', '.ncrst'])
+@pytest.mark.parametrize('box', [None, [30.5, 31.25, 32.0, 90.0, 90.0, 90.0]])
+def test_round_trip(extension, box, tmpdir):
+    coordinates = np.random.RandomState(0).uniform(-99, 99, (7, 3))
+    file_name = str(tmpdir.join('restart' + extension))
+    write_restart(file_name, coordinates, box=box)
+    read_coordinates, read_box = read_restart(file_name)
+    # The ASCII format has seven decimals; NetCDF keeps the full precision.
+    assert np.allclose(read_coordinates, coordinates, atol=1e-6)
+    if box is None:
+        assert read_box is None
+    else:
+        assert np.allclose(read_box, box)
+    with pytest.raises(OSError):
+        write_restart(file_name, coordinates, box=box)
+    write_restart(file_name, coordinates, box=box, overwrite=True)
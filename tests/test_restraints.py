@@ -0,0 +1,57 @@
+import os as os
+
+import pytest
+
+from smirnovert.mapping import IndexMap
+from smirnovert.restraints import IncompleteGroup, rewrite_restraints, tokenize
+
+A_BAM_P = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'a-bam-p', 'original')
+DISANG = os.path.join(A_BAM_P, 'disang.rest')
+
+
+def _read(file_name):
+    with open(file_name, 'rb') as file:
+        return file.read()
+
+
+def test_identity_is_byte_identical(tmpdir):
+    target = str(tmpdir.join('disang.rest'))
+    rewrite_restraints(DISANG, target, IndexMap(range(10000)),
+                       {number: number
+                        for number in range(1, 1000)})
+    assert _read(target) == _read(DISANG)
+
+
+def test_shifted_mapping(tmpdir):
+    target = str(tmpdir.join('disang.rest'))
+    # Ten atoms and two residues are inserted before the host.
+    rewrite_restraints(DISANG, target,
+                       IndexMap.from_dict({i: i + 10
+                                           for i in range(10000)}),
+                       {number: number + 2
+                        for number in range(1, 1000)})
+    reference = _read(DISANG).decode().splitlines()
+    lines = _read(target).decode().splitlines()
+    assert len(lines) == len(reference)
+    assert lines[0].startswith(
+        '#AnchorAtoms :6@O3 :8@C1 :10@C6 :12@C4 :12@N1 #Type a')
+    assert lines[1].startswith('&rst iat= 11,23,           r1=')
+    assert lines[3].startswith('&rst iat= 13,12,11,23,     r1=')
+    # The atom lists keep their width, so the other columns stay aligned.
+    for line, original in zip(lines[1:], reference[1:]):
+        if original.startswith('&rst'):
+            assert line.index('r1=') == original.index('r1=')
+            assert line[line.index('r1='):] == original[original.index('r1='):]
+
+
+def test_unterminated_group(tmpdir):
+    source = str(tmpdir.join('broken.rest'))
+    target = str(tmpdir.join('target.rest'))
+    with open(source, 'w') as file:
+        file.write('&rst iat= 1,13, r1= 0.0,\n')
+    with pytest.raises(IncompleteGroup):
+        tokenize(_read(source).decode())
+    with pytest.raises(ValueError):
+        rewrite_restraints(source, target, IndexMap(range(20)))
+    assert not os.path.exists(target)
@@ -0,0 +1,69 @@
+import os as os
+
+import numpy as np
+import parmed as pmd
+import pytest
+
+from smirnovert.stream import read_solute, read_solvent_structure
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+CB7 = os.path.join(TESTS, 'cb7-1')
+A_BAM_P = os.path.join(TESTS, 'a-bam-p', 'original')
+
+
+def _terms(structure, kind):
+    terms = []
+    for term in getattr(structure, kind):
+        atoms = [
+            getattr(term, f'atom{i}').idx for i in range(1, 5)
+            if hasattr(term, f'atom{i}')
+        ]
+        if atoms[0] > atoms[-1]:
+            atoms = atoms[::-1]
+        k = term.type.phi_k if kind == 'dihedrals' else term.type.k
+        terms.append(tuple(atoms) + (round(k, 4), ))
+    return sorted(terms)
+
+
+# The dummy atoms of `a-bam-p` come before the host, so the solute is not at the start of the system.
+@pytest.mark.parametrize('prmtop, inpcrd, resnames', [
+    (os.path.join(CB7, 'cb7-1.prmtop'), os.path.join(CB7, 'cb7-1.rst7'),
+     ['CB7', 'MOL']),
+    (os.path.join(A_BAM_P, 'full.topo'), os.path.join(A_BAM_P, 'full.crds'),
+     ['MGO', 'BAM']),
+    (os.path.join(A_BAM_P, 'full.topo'), os.path.join(A_BAM_P, 'full.crds'),
+     ['BAM']),
+])
+@pytest.mark.parametrize('chunk_size', [7, 100000])
+def test_read_solute(prmtop, inpcrd, resnames, chunk_size):
+    solute = read_solute(prmtop, inpcrd, resnames, chunk_size=chunk_size)
+    expected = pmd.load_file(prmtop, inpcrd)[':' + ','.join(resnames)]
+
+    assert [residue.name for residue in solute.residues
+            ] == [residue.name for residue in expected.residues]
+    assert [atom.name for atom in solute.atoms
+            ] == [atom.name for atom in expected.atoms]
+    assert [atom.type for atom in solute.atoms
+            ] == [atom.type for atom in expected.atoms]
+    assert [atom.charge for atom in solute.atoms] == pytest.approx(
+        [atom.charge for atom in expected.atoms])
+    assert np.allclose(solute.coordinates, expected.coordinates)
+    for kind in ('bonds', 'angles', 'dihedrals'):
+        assert _terms(solute, kind) == _terms(expected, kind)
+
+
+def test_read_solvent_structure():
+    prmtop = os.path.join(CB7, 'cb7-1.prmtop')
+    inpcrd = os.path.join(CB7, 'cb7-1.rst7')
+    solvent = read_solvent_structure(
+        prmtop, inpcrd, ['CB7', 'MOL'], chunk_size=500)
+    expected = pmd.load_file(prmtop, inpcrd)['!:CB7,MOL']
+
+    assert [residue.name for residue in solvent.residues
+            ] == [residue.name for residue in expected.residues]
+    assert [atom.name for atom in solvent.atoms
+            ] == [atom.name for atom in expected.atoms]
+    assert [atom.charge for atom in solvent.atoms] == pytest.approx(
+        [atom.charge for atom in expected.atoms])
+    assert np.allclose(solvent.coordinates, expected.coordinates)
+    assert len(solvent.bonds) == len(expected.bonds)